@@ -0,0 +1,186 @@
+# #### Libs & Constants
+# Sends the Level 4 work units of the configured experiment (LLM_MODEL_IDX) to every model of COMPARE_MODEL_IDXS at once,
+# over one shared client (connection pool), concurrency limit, rate limiter and response cache. Each model writes its
+# logfile and parsed CSV files to its own EXP_PATH, and a throughput/latency/token comparison table is printed at the end.
+
+import os
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+from glob import glob
+from functools import partial
+
+from utils import logger, log_parser, log_metadata, process_all_csv_files
+from utils import system_prompt_msg, user_prompt_msg, assistent_prompt_msg
+from llm import AsyncLLM, run_concurrently
+from response_cache import ResponseCache
+from rate_limiter import RateLimiter, TokenEstimator
+from manifest import RunManifest, unit_id
+from call_metrics import CallMetrics, set_call_level
+from work_units import load_family_types_json, l4_work_units
+
+from config import model_dict, COMPARE_MODEL_IDXS, get_model_paths, get_client, LLM_GENERATION, REPLAY_LOGS, USE_TMY
+from config import COUNTRIES, FOLDER_PATH, l1_output_dir, l3_output_dir, MAX_CONCURRENT_REQUESTS, RESUME_RUN
+from config import RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_TOKENS_PER_MINUTE, MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY, STREAM_RESPONSES
+from config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_MODE, RESPONSE_CACHE_MAX_SIZE_MB, RESPONSE_CACHE_MAX_AGE_DAYS
+
+if not LLM_GENERATION or REPLAY_LOGS:
+    raise ValueError("Comparing models needs LLM_GENERATION = True and REPLAY_LOGS = False (and the DEEPINFRA_TOKEN).")
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# #### Shared resources
+response_cache = ResponseCache(RESPONSE_CACHE_PATH, mode=RESPONSE_CACHE_MODE,
+                               max_size_mb=RESPONSE_CACHE_MAX_SIZE_MB, max_age_days=RESPONSE_CACHE_MAX_AGE_DAYS)
+
+# One account, one quota: all models go through the same limiter, its token estimate seeded with the logged usage of every model
+token_estimator = TokenEstimator()
+n_calls = sum(token_estimator.seed_from_logs(glob(f"{get_model_paths(model_dict[int(idx)])['exp_path']}/logfile_l*.txt"))
+              for idx in COMPARE_MODEL_IDXS)
+print(f"Token estimator seeded with {n_calls} logged calls")
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_TOKENS_PER_MINUTE, token_estimator)
+
+# Latency percentiles of every call per model, saved next to the comparison table
+run_time = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+call_metrics = CallMetrics(f"{FOLDER_PATH}/model_comparison_{run_time}_metrics.json",
+                           f"{FOLDER_PATH}/model_comparison_{run_time}_metrics.prom")
+
+llm_options = dict(cache=response_cache, rate_limiter=rate_limiter, max_retries=MAX_RETRIES,
+                   retry_base_delay=RETRY_BASE_DELAY, retry_max_delay=RETRY_MAX_DELAY, stream=STREAM_RESPONSES,
+                   metrics=call_metrics)
+
+def model_log_file(paths):
+    # Same naming as 01_get_multi_llm_response.py, with the run timestamp so earlier logs are kept
+    l4_logfile_path = f"{paths['l4_logfile_path']}_tmy" if USE_TMY else paths['l4_logfile_path']
+    time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+    return f"{l4_logfile_path}_compare_{time_now}"
+
+def log_result(model_run, unit, guide_prompt, usage_prompt_tokens, usage_completion_tokens):
+    # Runs on the event loop thread, so each unit's block is written without interleaving
+    model_logger = partial(logger, file_name=f"{model_run['log_file']}.txt", unit=unit_id(unit))
+
+    time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+    model_logger([f"[{time_now}]", 100*"-"] + system_prompt_msg(unit["system_prompt"]) + user_prompt_msg(unit["user_prompt"])
+                 + assistent_prompt_msg(guide_prompt))
+
+    family_type_clean = unit["family_type"].replace("'","-")
+    family_members_clean = [member.replace("'", "-") for member in unit["members"]]
+    log_metadata(unit["country"], family_type_clean, family_members_clean, unit["season"], unit["pattern"],
+                 usage_prompt_tokens, usage_completion_tokens, model_logger)
+
+    model_run["manifest"].mark(unit, "answered")
+    model_run["finished"] = time.monotonic()
+
+async def run_models(model_runs):
+    semaphore = asyncio.Semaphore(max(1, int(MAX_CONCURRENT_REQUESTS)))
+    return await asyncio.gather(*(
+        run_concurrently(model_run["llm"], model_run["units"], semaphore=semaphore,
+                         on_result=partial(log_result, model_run))
+        for model_run in model_runs))
+
+def comparison_table(model_runs, results, start):
+    """
+    Builds the per-model comparison of the run.
+
+    Parameters:
+    - model_runs (list): The model runs (dicts with "model", "llm", "units", "finished").
+    - results (list): The run_concurrently results of each model run.
+    - start (float): time.monotonic() at the start of the run.
+
+    Returns:
+    - pd.DataFrame: One row per model.
+    """
+    rows = []
+    for model_run, model_results in zip(model_runs, results):
+        calls = pd.DataFrame(model_run["llm"].call_stats,
+                             columns=["request_latency", "prompt_tokens", "completion_tokens", "cached", "retries"])
+        api_calls = calls.loc[~calls["cached"].astype(bool)]
+        wall_time = (model_run["finished"] or start) - start
+        completed = len(calls)
+
+        rows.append({
+            "Model": model_run["model"],
+            "Units": len(model_run["units"]),
+            "Completed": completed,
+            "Failed": sum(isinstance(answer, Exception) for _, answer, _, _ in model_results),
+            "Cached": int(calls["cached"].sum()),
+            "Retries": int(calls["retries"].sum()),
+            "Wall_Time_s": round(wall_time, 2),
+            "Units_per_min": round(60 * completed / wall_time, 2) if wall_time > 0 else np.nan,
+            # Provider latency of the successful requests (rate limiter waits and retry backoffs excluded)
+            "Latency_Mean_s": round(api_calls["request_latency"].mean(), 2) if len(api_calls) else np.nan,
+            "Latency_P95_s": round(api_calls["request_latency"].quantile(0.95), 2) if len(api_calls) else np.nan,
+            "Prompt_Tokens": int(api_calls["prompt_tokens"].sum()),
+            "Completion_Tokens": int(api_calls["completion_tokens"].sum()),
+            "Completion_Tokens_per_s": round(api_calls["completion_tokens"].sum() / wall_time, 1) if wall_time > 0 else np.nan,
+        })
+
+    return pd.DataFrame(rows)
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# ### Level 4 fan-out
+#
+print()
+print(110*"=")
+print(f"Level 4 model comparison: {[model_dict[idx] for idx in COMPARE_MODEL_IDXS]}")
+print(110*"=")
+
+# The scenarios (family types and weather) of the configured experiment are shared by all models
+print(f"Processing weather data from folder: {l3_output_dir}")
+weather_data = process_all_csv_files(l3_output_dir, COUNTRIES)
+family_types_json = load_family_types_json(l1_output_dir)
+
+model_runs = []
+for idx in COMPARE_MODEL_IDXS:
+    model = model_dict[int(idx)]
+    paths = get_model_paths(model)
+    os.makedirs(paths["l4_output_dir"], exist_ok=True)
+    os.makedirs(os.path.dirname(paths["manifest_path"]), exist_ok=True)
+
+    units = l4_work_units(family_types_json, weather_data, l4_output_dir=paths["l4_output_dir"])
+    manifest = RunManifest(paths["manifest_path"])
+    print(f"Model: {model}")
+    pending_units = manifest.pending(units) if RESUME_RUN else units
+
+    model_runs.append({
+        "model": model,
+        "paths": paths,
+        "llm": AsyncLLM("chat", model, get_client(async_client=True), **llm_options),
+        "manifest": manifest,
+        "all_units": units,
+        "units": pending_units,
+        "log_file": model_log_file(paths),
+        "finished": None,
+    })
+
+print(f"Sending {sum(len(model_run['units']) for model_run in model_runs)} requests with up to {MAX_CONCURRENT_REQUESTS} concurrent requests")
+start = time.monotonic()
+set_call_level("l4")
+results = asyncio.run(run_models(model_runs))
+
+response_cache.report("Level 4 comparison")
+call_metrics.report("Level 4 comparison")
+call_metrics.export()
+
+for model_run, model_results in zip(model_runs, results):
+    for unit, answer, _, _ in model_results:
+        if isinstance(answer, Exception):
+            model_run["manifest"].mark(unit, "failed")
+
+    if os.path.exists(f"{model_run['log_file']}.txt"):
+        print(f"Model: {model_run['model']} -> {model_run['paths']['l4_output_dir']}")
+        log_parser(file_path=model_run["log_file"], output_dir=model_run["paths"]["l4_output_dir"], metadata_type="family_consumption")
+    model_run["manifest"].refresh(model_run["all_units"])
+
+comparison = comparison_table(model_runs, results, start)
+
+print()
+print(110*"=")
+print("Model comparison (Level 4)")
+print(110*"=")
+print(comparison.to_string(index=False))
+
+time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+comparison_file = f"{FOLDER_PATH}/model_comparison_{time_now}.csv"
+comparison.to_csv(comparison_file, index=False)
+print(f"Comparison saved to {comparison_file}")
@@ -1,73 +1,224 @@
 # #### Libs & Constants
 
 import os
+import time
 import pvlib
+import asyncio
 import pandas as pd
+from functools import partial
 
 from utils import *
-
-from prompts import system_prompt_l1, user_prompt_family_types_l1, \
-                    system_prompt_l2, user_prompt_l2, \
-                    system_prompt_l3, user_prompt_daily_l3, \
-                    system_prompt_l4, user_prompt_daily_l4
-
-from config import LLM_MODEL, CLIENT, USE_TMY
-from config import JSON_FILE_PATH, LLM_GENERATION
-from config import COUNTRIES, YEAR, CAPITALS, SEASONS, PATTERNS
+from llm import LLM, AsyncLLM, run_concurrently, usage_count
+from response_cache import ResponseCache
+from rate_limiter import RateLimiter, TokenEstimator
+from manifest import RunManifest, unit_id, has_valid_output
+from scheduler import DagScheduler
+from validation import get_valid_l4_response, get_valid_l4_response_async
+from work_units import load_family_types_json, l1_work_units, l2_work_units, l3_work_units, l4_work_units
+from work_units import pack_l4_work_units, scenario_units, l3_country_work_units, l4_season_groups
+from replay import ReplayLog, ReplayLLM, AsyncReplayLLM
+from log_watcher import LogWatcher
+from call_metrics import CallMetrics, set_call_level
+
+from config import LLM_MODEL, get_client, USE_TMY
+from config import JSON_FILE_PATH, LLM_GENERATION, ASYNC_GENERATION, MAX_CONCURRENT_REQUESTS, L4_SCENARIOS_PER_REQUEST
+from config import VALIDATE_ON_ARRIVAL, L4_MAX_REPAIRS, DAG_SCHEDULER, LIVE_PARSE
+from config import COUNTRIES, YEAR, CAPITALS, SEASONS
 from config import l1_logfile_path, l2_logfile_path, l3_logfile_path, l4_logfile_path, original_logfile_path
 from config import l1_output_dir, l2_output_dir, l3_output_dir, l4_output_dir
+from config import EXP_PATH, MANIFEST_PATH, RESUME_RUN, REPLAY_LOGS, REPLAY_LOG_PATH
+from config import RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_TOKENS_PER_MINUTE, MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY, STREAM_RESPONSES
+from config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_MODE, RESPONSE_CACHE_MAX_SIZE_MB, RESPONSE_CACHE_MAX_AGE_DAYS
+from config import METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH
 
 # ---------------------------------------------------------------------------------------------------------------------------------
 # #### LLM
-class LLM:
-  def __init__(self, modeltype, model, client):
-    self.modeltype = modeltype
-    self.model = model
-    self.client = client
-
-  def getResponse(self, messages, temperature=0.2, max_tokens = 4096*10, seed=None):
-    response = self.client.chat.completions.create(
-      model=self.model,
-      messages=messages,
-      max_tokens=max_tokens,
-      temperature=temperature,  # Adjusted to add some variability in responses
-    #   seed=seed
-    )
-    answer = response.choices[0].message.content.strip()
-    # print(answer)
-    usage_prompt_tokens = response.usage.prompt_tokens
-    usage_completion_tokens = response.usage.completion_tokens
-    # print(f"Prompt Tokens: {usage_prompt_tokens}, Completion Tokens: {usage_completion_tokens}")
-
-    return answer, str(usage_prompt_tokens), str(usage_completion_tokens)
-
 # Define the model and client
-llm = LLM("chat", LLM_MODEL, CLIENT)
+response_cache = ResponseCache(RESPONSE_CACHE_PATH, mode="bypass" if REPLAY_LOGS else RESPONSE_CACHE_MODE,
+                               max_size_mb=RESPONSE_CACHE_MAX_SIZE_MB, max_age_days=RESPONSE_CACHE_MAX_AGE_DAYS)
+
+# Token usage of past runs drives the tokens/min estimate of each request
+token_estimator = TokenEstimator()
+n_calls = token_estimator.seed_from_logs(glob(f"{EXP_PATH}/logfile_l*.txt"))
+print(f"Token estimator seeded with {n_calls} logged calls")
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_TOKENS_PER_MINUTE, token_estimator)
+
+# Latency percentiles of every call, by level (set_call_level) and model
+call_metrics = CallMetrics(METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH)
+
+llm_options = dict(cache=response_cache, rate_limiter=rate_limiter, max_retries=MAX_RETRIES,
+                   retry_base_delay=RETRY_BASE_DELAY, retry_max_delay=RETRY_MAX_DELAY, stream=STREAM_RESPONSES,
+                   metrics=call_metrics)
+
+if REPLAY_LOGS:
+    # Every request is answered from the recorded logfiles (no client), the repairs are part of the logged answers
+    # and every output is rebuilt
+    replay_log = ReplayLog(REPLAY_LOG_PATH, USE_TMY)
+    llm = ReplayLLM("chat", LLM_MODEL, replay_log, metrics=call_metrics)
+    async_llm = AsyncReplayLLM("chat", LLM_MODEL, replay_log, metrics=call_metrics)
+    RESUME_RUN = False
+    L4_MAX_REPAIRS = 0
+else:
+    replay_log = None
+    llm = LLM("chat", LLM_MODEL, get_client() if LLM_GENERATION else None, **llm_options)
+    async_llm = AsyncLLM("chat", LLM_MODEL, get_client(async_client=True) if LLM_GENERATION else None, **llm_options)
+
+manifest = RunManifest(MANIFEST_PATH)
+
+def register_units(units):
+    # In replay mode, requests are matched to the recorded answers of their work units
+    return replay_log.register(units) if replay_log is not None else units
+
+logged_l3_answers = None
+
+def l3_guide(unit):
+    """
+    Answer of a done Level 3 work unit, the guide of the next season: from the manifest, else from the Level 3 logfiles
+    (outputs written before the manifest existed, or after it was deleted). Warns when none is recorded.
+    """
+    global logged_l3_answers
+    answer = manifest.answer(unit)
+    if answer:
+        return answer
+
+    if logged_l3_answers is None:
+        logged_l3_answers = ReplayLog(EXP_PATH, USE_TMY, levels=[3])
+    answer = logged_l3_answers.recorded_answer(unit)
+    if answer:
+        return answer
+
+    print(f"    Warning: no recorded answer for {unit['country']} {unit['season']}, the next season is sent without previous-season guide.")
+    return ""
+
+live_parsed_levels = set()
+
+def start_live_parse(output_dir, metadata_type):
+    # With LIVE_PARSE, the answers of a level are parsed while it runs instead of after copy_log_file
+    if not LIVE_PARSE:
+        return None
+    return LogWatcher(original_logfile_path, output_dir, metadata_type, JSON_FILE_PATH).start()
+
+def stop_live_parse(level, watcher):
+    if watcher is not None:
+        watcher.stop()
+        # A watcher that failed has not parsed the answers logged after its error: the log_parser pass runs instead
+        if watcher.error is None:
+            live_parsed_levels.add(level)
+        else:
+            print(f"Level {level} is parsed again from the logfile after the live parsing error.")
+
+def log_prompt_block(system_prompt, user_prompt, assistant_prompt=None, unit=None):
+    time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+    block = [f"[{time_now}]", 100*"-"] + system_prompt + user_prompt
+    if assistant_prompt is not None:
+        block += assistant_prompt
+    logger(block, unit=unit)
 
-def combined_prompt_msg(system_prompt, user_prompt, messages=None, loop_idx=0):
+def combined_prompt_msg(system_prompt, user_prompt, messages=None, loop_idx=0, unit=None):
     system_prompt = system_prompt_msg(system_prompt)
     user_prompt = user_prompt_msg(user_prompt)
-    # 
-    if (loop_idx == 0) or True:
-        time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
-        logger(f"[{time_now}]")
-        logger(100*"-")
-        logger(system_prompt)
-        logger(user_prompt)
     #
     if messages is None:
+        log_prompt_block(system_prompt, user_prompt, unit=unit)
         messages = system_prompt + user_prompt
     else:
         assistant_prompt = assistent_prompt_msg(messages)
-        logger(assistant_prompt)
+        log_prompt_block(system_prompt, user_prompt, assistant_prompt, unit=unit)
         messages = system_prompt + assistant_prompt + user_prompt
     #
+    start = time.monotonic()
     guidePrompt, usage_prompt_tokens, usage_completion_tokens = llm.getResponse(messages)
     guidePrompt = assistent_prompt_msg(guidePrompt)
-    logger(guidePrompt)
+    logger(guidePrompt, unit=unit)
+    if unit is not None:
+        log_timing(unit, time.monotonic() - start, usage_prompt_tokens, usage_completion_tokens)
 
     return guidePrompt, usage_prompt_tokens, usage_completion_tokens
 
+def log_l4_metadata(unit, usage_prompt_tokens, usage_completion_tokens, logger=logger):
+    family_type_clean = unit["family_type"].replace("'","-")
+    family_members_clean = [member.replace("'", "-") for member in unit["members"]]
+    if "scenarios" in unit:
+        log_metadata_packed(unit["country"], family_type_clean, family_members_clean, unit["scenarios"], usage_prompt_tokens, usage_completion_tokens, logger)
+    else:
+        log_metadata(unit["country"], family_type_clean, family_members_clean, unit["season"], unit["pattern"], usage_prompt_tokens, usage_completion_tokens, logger)
+
+def l4_exchange_messages(exchanges):
+    """
+    Log messages of the requests of a repaired Level 4 answer: the original answer, then each repair prompt and answer,
+    each followed by its usage. Their roles are not read by the parsers, which pair the merged answer logged after them
+    with the metadata line of the unit (the usage of all requests).
+    """
+    if not exchanges or len(exchanges) < 2:
+        return []
+    messages = []
+    for index, exchange in enumerate(exchanges):
+        if exchange["prompt"] is None:
+            messages.append({"role": "original_assistant", "content": exchange["answer"]})
+        else:
+            messages += [{"role": "repair_user", "content": exchange["prompt"]},
+                         {"role": "repair_assistant", "content": exchange["answer"]}]
+        messages.append({"role": "repair_metadata", "content": f"Request, {index}, "
+                                                              f"Usage_Prompt_Tokens, {exchange['usage_prompt_tokens']}, "
+                                                              f"Usage_Completion_Tokens, {exchange['usage_completion_tokens']}"})
+    return messages
+
+def mark_l4_answered(unit, problems=None):
+    # Scenarios still invalid after their repairs are marked "invalid", so that a resumed run sends them again
+    for scenario_unit in scenario_units(unit):
+        invalid = (scenario_unit["season"], scenario_unit["pattern"]) in (problems or {})
+        manifest.mark(scenario_unit, "invalid" if invalid else "answered")
+
+def l4_scenario_label(unit):
+    if "scenarios" in unit:
+        return ", ".join(f"{season}-{day_pattern}" for season, day_pattern in unit["scenarios"])
+    return f"{unit['season']} | {unit['pattern']}"
+
+def report_prompt_tokens_per_scenario(l4_usage):
+    """
+    Prints the Level 4 prompt tokens per scenario of this run, next to the unpacked equivalent. The unpacked figure is
+    estimated from the length of the single-scenario prompts, with the tokens-per-character ratio measured on this run.
+    """
+    if not l4_usage:
+        return
+
+    def prompt_chars(messages):
+        return sum(len(str(message["content"])) for message in messages)
+
+    n_scenarios = sum(len(scenario_units(unit)) for unit, _ in l4_usage)
+    prompt_tokens = sum(usage_count(usage_prompt_tokens) for _, usage_prompt_tokens in l4_usage)
+    tokens_per_char = prompt_tokens / sum(prompt_chars(unit["messages"]) for unit, _ in l4_usage)
+    unpacked_prompt_tokens = tokens_per_char * sum(prompt_chars(scenario["messages"]) for unit, _ in l4_usage for scenario in scenario_units(unit))
+
+    print(f"Level 4 prompt tokens per scenario: {prompt_tokens / n_scenarios:.0f} with up to {L4_SCENARIOS_PER_REQUEST} scenario(s) per request, "
+          f"~{unpacked_prompt_tokens / n_scenarios:.0f} unpacked ({1 - prompt_tokens / unpacked_prompt_tokens:.0%} saved)")
+
+def recover_interrupted_level(manifest):
+    """
+    Parses the responses that an interrupted run left in the working logfile, so that the
+    corresponding work units have their outputs and are skipped by this run.
+    """
+    level = manifest.interrupted_level()
+    if level is None:
+        return
+
+    if os.path.exists(original_logfile_path) and os.path.getsize(original_logfile_path) > 0:
+        print(f"Recovering the responses of the interrupted Level {level} run from {original_logfile_path}")
+        time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+        partial_logfile_path = f"{EXP_PATH}/logfile_l{level}_partial_{time_now}"
+        copy_log_file(original_logfile_path, partial_logfile_path, clear_original=True)
+
+        if level == 1:
+            log_parser_json(file_path=partial_logfile_path, output_dir=l1_output_dir, output_file_name_template=JSON_FILE_PATH)
+        elif level == 2:
+            log_parser(file_path=partial_logfile_path, output_dir=l2_output_dir, metadata_type="weather_range")
+        elif level == 3:
+            log_parser(file_path=partial_logfile_path, output_dir=l3_output_dir, metadata_type="weather")
+        elif level == 4:
+            log_parser(file_path=partial_logfile_path, output_dir=l4_output_dir, metadata_type="family_consumption")
+
+    manifest.level_finished(level)
+
 # Calculate the number of family members per family per country
 def get_number_of_family_members(family_types_json):
     results = {}
@@ -162,6 +313,203 @@ def generate_tmy_weather(country, lat, lon, output_dir):
         # Save the group to a CSV file
         group.to_csv(output_dir + '/' + file_name, index=False)
 
+# ---------------------------------------------------------------------------------------------------------------------------------
+# ### DAG scheduler: per-country dependencies across the levels
+# L1(country) and L2(country) start right away, L3(country, season) waits for L2(country) and for the previous season
+# (guide_prompt chaining), and L4(country, seasons) waits for L1(country) and the weather of its seasons (as many seasons
+# as L4_SCENARIOS_PER_REQUEST packs in one request, see l4_season_groups). Each request is logged to its level logfile
+# and parsed as soon as its answer arrives, so the levels of different countries overlap.
+def level_logfile(logfile_path):
+    if os.path.exists(f"{logfile_path}.txt"):
+        logfile_path = f"{logfile_path}_{pd.Timestamp.now().strftime('%Y-%m-%d_T%H-%M-%S')}"
+    return logfile_path
+
+def log_request_block(logfile_path, log_messages, answer, log_meta, unit=None):
+    """
+    Appends the block of one request (prompts, answer, metadata) to a level logfile.
+
+    Returns:
+    - list: The logged lines, ready for parse_log_lines / parse_json_log_lines.
+    """
+    items = []
+    def collect(msg):
+        if isinstance(msg, list):
+            items.extend(msg)
+        else:
+            items.append(msg)
+
+    collect(f"[{pd.Timestamp.now().strftime('%Y-%m-%d_T%H-%M-%S')}]")
+    collect(100*"-")
+    collect(log_messages)
+    collect(assistent_prompt_msg(answer))
+    log_meta(collect)
+
+    logger(items, file_name=f"{logfile_path}.txt", unit=unit_id(unit) if unit is not None else None)
+    return [str(item) for item in items]
+
+def is_pending(unit, dag_units):
+    dag_units.setdefault(unit["level"], []).append(unit)
+    if RESUME_RUN and manifest.completed(unit):
+        if manifest.status(unit) != "done":
+            manifest.mark(unit, "done")
+        return False
+    if manifest.status(unit) is None:
+        manifest.mark(unit, "pending")
+    return True
+
+def run_dag_pipeline():
+    semaphore = asyncio.Semaphore(max(1, int(MAX_CONCURRENT_REQUESTS)))
+    logfiles = {1: level_logfile(l1_logfile_path), 2: level_logfile(l2_logfile_path), 3: level_logfile(l3_logfile_path),
+                4: level_logfile(f"{l4_logfile_path}_tmy" if USE_TMY else l4_logfile_path)}
+    dag_units = {}
+    l4_usage = []
+
+    async def request(unit, messages):
+        set_call_level(unit["key"][0])
+        async with semaphore:
+            start = time.monotonic()
+            answer, usage_prompt_tokens, usage_completion_tokens = await async_llm.getResponse(messages)
+        log_timing(unit_id(unit), time.monotonic() - start, usage_prompt_tokens, usage_completion_tokens)
+        return answer, usage_prompt_tokens, usage_completion_tokens
+
+    async def run_l1(country):
+        unit = register_units(l1_work_units([country]))[0]
+        if not USE_TMY and is_pending(unit, dag_units):
+            answer, usage_prompt_tokens, usage_completion_tokens = await request(unit, unit["messages"])
+            block = log_request_block(logfiles[1], unit["messages"], answer,
+                                      partial(log_metadata_family_types, country, usage_prompt_tokens, usage_completion_tokens), unit)
+            parse_json_log_lines(block, l1_output_dir, JSON_FILE_PATH)
+            manifest.mark(unit, "answered")
+        if not has_valid_output(unit):
+            raise ValueError(f"No valid Level 1 family types for {country}")
+        with open(unit["output_file"], "r") as file:
+            return json.load(file)
+
+    async def run_l2(country):
+        unit = register_units(l2_work_units([country]))[0]
+        if is_pending(unit, dag_units):
+            answer, usage_prompt_tokens, usage_completion_tokens = await request(unit, unit["messages"])
+            block = log_request_block(logfiles[2], unit["messages"], answer,
+                                      partial(log_metadata_weather_range, country, usage_prompt_tokens, usage_completion_tokens), unit)
+            parse_log_lines(block, l2_output_dir, "weather_range")
+            manifest.mark(unit, "answered")
+        if not has_valid_output(unit):
+            raise ValueError(f"No valid Level 2 weather ranges for {country}")
+
+    async def run_l3(country, season, previous):
+        unit = next(unit for unit in register_units(l3_country_work_units(country)) if unit["season"] == season)
+        guide_prompt = "" if season == SEASONS[0] else previous
+        if not is_pending(unit, dag_units):
+            return l3_guide(unit)
+
+        if guide_prompt:
+            guide_msg = assistent_prompt_msg(guide_prompt)
+            messages = system_prompt_msg(unit["system_prompt"]) + guide_msg + user_prompt_msg(unit["user_prompt"])
+            log_messages = system_prompt_msg(unit["system_prompt"]) + user_prompt_msg(unit["user_prompt"]) + guide_msg
+        else:
+            messages = log_messages = unit["messages"]
+
+        answer, usage_prompt_tokens, usage_completion_tokens = await request(unit, messages)
+        block = log_request_block(logfiles[3], log_messages, answer,
+                                  partial(log_metadata_weather, country, season, usage_prompt_tokens, usage_completion_tokens), unit)
+        parse_log_lines(block, l3_output_dir, "weather")
+        manifest.mark(unit, "answered", answer=answer)
+        return answer
+
+    async def run_tmy(country):
+        if all(os.path.exists(f"{l3_output_dir}/{country.replace(' ', '-')}_{season}.csv") for season in SEASONS):
+            return
+        if REPLAY_LOGS:
+            raise ValueError(f"Replay needs the TMY weather files of {country} in {l3_output_dir} (they are not part of the logfiles).")
+        lat, lon = CAPITALS[country]
+        await asyncio.to_thread(generate_tmy_weather, country, lat, lon, l3_output_dir)
+
+    async def run_l4_unit(unit):
+        set_call_level(unit["key"][0])
+        async with semaphore:
+            start = time.monotonic()
+            problems, exchanges = None, None
+            if VALIDATE_ON_ARRIVAL:
+                answer, usage_prompt_tokens, usage_completion_tokens, problems, exchanges = \
+                    await get_valid_l4_response_async(async_llm, unit, L4_MAX_REPAIRS)
+            else:
+                answer, usage_prompt_tokens, usage_completion_tokens = await async_llm.getResponse(unit["messages"])
+        log_timing(unit_id(unit), time.monotonic() - start, usage_prompt_tokens, usage_completion_tokens)
+
+        log_messages = system_prompt_msg(unit["system_prompt"]) + user_prompt_msg(unit["user_prompt"]) + l4_exchange_messages(exchanges)
+        block = log_request_block(logfiles[4], log_messages, answer,
+                                  partial(log_l4_metadata, unit, usage_prompt_tokens, usage_completion_tokens), unit)
+        parse_log_lines(block, l4_output_dir, "family_consumption")
+        mark_l4_answered(unit, problems)
+        l4_usage.append((unit, usage_prompt_tokens))
+
+    async def run_l4(country, seasons, family_types, *_weather):
+        weather_data = {country: {}}
+        for season in seasons:
+            weather_data[country][season] = process_csv(f"{l3_output_dir}/{country.replace(' ', '-')}_{season}.csv")
+            if weather_data[country][season] is None:
+                raise ValueError(f"No weather data for {country} in {season}")
+
+        units = l4_work_units(family_types, weather_data, seasons=seasons)
+        pending_units = [unit for unit in units if is_pending(unit, dag_units)]
+        request_units = register_units(pack_l4_work_units(pending_units, weather_data, L4_SCENARIOS_PER_REQUEST))
+
+        results = await asyncio.gather(*(run_l4_unit(unit) for unit in request_units), return_exceptions=True)
+        for unit, result in zip(request_units, results):
+            if isinstance(result, Exception):
+                print(f"Request failed for {unit['key']}: {result}")
+                for scenario_unit in scenario_units(unit):
+                    manifest.mark(scenario_unit, "failed")
+
+    def setup(scheduler):
+        for country in COUNTRIES:
+            scheduler.add(("l1", country), partial(run_l1, country))
+
+            if USE_TMY:
+                scheduler.add(("tmy", country), partial(run_tmy, country))
+            else:
+                scheduler.add(("l2", country), partial(run_l2, country))
+                previous = ("l2", country)
+                for season in SEASONS:
+                    scheduler.add(("l3", country, season), partial(run_l3, country, season), deps=[previous])
+                    previous = ("l3", country, season)
+
+            # One Level 4 task per group of seasons that a packed request can hold (one season without packing)
+            for seasons in l4_season_groups(SEASONS, L4_SCENARIOS_PER_REQUEST):
+                weather_tasks = [("tmy", country)] if USE_TMY else [("l3", country, season) for season in seasons]
+                scheduler.add(("l4", country, *seasons), partial(run_l4, country, seasons), deps=[("l1", country), *weather_tasks])
+
+    scheduler = DagScheduler()
+    results = asyncio.run(scheduler.run(setup))
+    for task_id, result in results.items():
+        if isinstance(result, Exception):
+            print(f"Task {task_id} failed: {result}")
+
+    print("DAG timeline:")
+    scheduler.report()
+    response_cache.report("DAG")
+    report_prompt_tokens_per_scenario(l4_usage)
+    async_llm.stream_report("DAG")
+    call_metrics.report("DAG")
+    call_metrics.export()
+
+    for level in sorted(dag_units):
+        manifest.refresh(dag_units[level])
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# ### Resume: recover the responses logged by an interrupted run
+if RESUME_RUN:
+    recover_interrupted_level(manifest)
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# ### DAG scheduler (replaces the level-by-level generation below)
+if LLM_GENERATION and DAG_SCHEDULER:
+    print()
+    print(110*"=")
+    print(f"DAG scheduler: Levels 1-4 per country, up to {MAX_CONCURRENT_REQUESTS} concurrent requests")
+    print(110*"=")
+    run_dag_pipeline()
+
 # ---------------------------------------------------------------------------------------------------------------------------------
 # ### Level 1: Family types for different countries
 print()
@@ -169,30 +517,43 @@ print(110*"=")
 print("Level 1: Family types for different countries")
 print(110*"=")
 
-if LLM_GENERATION and not USE_TMY:
-    system_prompt = system_prompt_l1
+if LLM_GENERATION and not USE_TMY and not DAG_SCHEDULER:
+    l1_units = register_units(l1_work_units(COUNTRIES))
+    pending_units = manifest.pending(l1_units) if RESUME_RUN else l1_units
 
-    for country in COUNTRIES:
-        print(f"Country: {country}")
-        user_prompt = user_prompt_family_types_l1.replace("$COUNTRY$", country)
-        # print(user_prompt)
-        family_types, usage_prompt_tokens, usage_completion_tokens  = combined_prompt_msg(system_prompt, user_prompt)
-        family_types = family_types[0]['content']
-        log_metadata_family_types(country, usage_prompt_tokens, usage_completion_tokens, logger)
-        # break
+    if pending_units:
+        manifest.level_started(1)
+        set_call_level("l1")
+        watcher = start_live_parse(l1_output_dir, "family_types")
 
-    time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
-    logger(f"[{time_now}]")
+        for unit in pending_units:
+            print(f"Country: {unit['country']}")
+            family_types, usage_prompt_tokens, usage_completion_tokens  = combined_prompt_msg(unit["system_prompt"], unit["user_prompt"], unit=unit_id(unit))
+            family_types = family_types[0]['content']
+            log_metadata_family_types(unit["country"], usage_prompt_tokens, usage_completion_tokens, partial(logger, unit=unit_id(unit)))
+            manifest.mark(unit, "answered")
 
-    if os.path.exists(f'{l1_logfile_path}.txt'):
-        print("Logfile 1 exists and will be used!")
-        with open(original_logfile_path, 'w') as original_file:
-            original_file.truncate(0)
-            print(f"Cleared contents of {original_logfile_path}")
-    else:
+        time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+        logger(f"[{time_now}]")
+
+        response_cache.report("Level 1")
+        llm.stream_report("Level 1")
+        call_metrics.report("Level 1", level="l1")
+        call_metrics.export()
+
+        if os.path.exists(f'{l1_logfile_path}.txt'):
+            print("Logfile 1 exists!")
+            l1_logfile_path = f'{l1_logfile_path}_{time_now}'
+
+        stop_live_parse(1, watcher)
         copy_log_file(original_logfile_path, l1_logfile_path, clear_original=True)
+        manifest.level_finished(1)
+
+if not DAG_SCHEDULER and 1 not in live_parsed_levels and os.path.exists(f'{l1_logfile_path}.txt'):
+    log_parser_json(file_path=l1_logfile_path, output_dir=l1_output_dir, output_file_name_template=JSON_FILE_PATH)
 
-log_parser_json(file_path=l1_logfile_path, output_dir=l1_output_dir, output_file_name_template=JSON_FILE_PATH)
+if LLM_GENERATION and not USE_TMY and not DAG_SCHEDULER:
+    manifest.refresh(l1_units)
 
 
 # ---------------------------------------------------------------------------------------------------------------------------------
@@ -202,32 +563,44 @@ print(110*"=")
 print("Level 2: Typical min-max ranges for the weather parameters for all seasons")
 print(110*"=")
 
-if LLM_GENERATION and not USE_TMY:
-    system_prompt = system_prompt_l2
+if LLM_GENERATION and not USE_TMY and not DAG_SCHEDULER:
+    l2_units = register_units(l2_work_units(COUNTRIES))
+    pending_units = manifest.pending(l2_units) if RESUME_RUN else l2_units
 
-    for country in COUNTRIES:
-        # if country == "USA":
-            print(f"Country: {country}")
-            user_prompt = user_prompt_l2.replace("$Country$", country)
-            user_prompt = user_prompt.replace("[$Year$]", str(YEAR))
-            # print(user_prompt)
-            guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(system_prompt, user_prompt)
+    if pending_units:
+        manifest.level_started(2)
+        set_call_level("l2")
+        watcher = start_live_parse(l2_output_dir, "weather_range")
+
+        for unit in pending_units:
+            print(f"Country: {unit['country']}")
+            guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(unit["system_prompt"], unit["user_prompt"], unit=unit_id(unit))
             guide_prompt = guide_prompt[0]['content']
-            log_metadata_weather_range(country, usage_prompt_tokens, usage_completion_tokens, logger)
-            # break
+            log_metadata_weather_range(unit["country"], usage_prompt_tokens, usage_completion_tokens, partial(logger, unit=unit_id(unit)))
+            manifest.mark(unit, "answered")
 
-    time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
-    logger(f"[{time_now}]")
+        time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+        logger(f"[{time_now}]")
+
+        response_cache.report("Level 2")
+        llm.stream_report("Level 2")
+        call_metrics.report("Level 2", level="l2")
+        call_metrics.export()
 
-    if os.path.exists(f'{l2_logfile_path}.txt'):
-        print("Logfile 2 exists!")
-        l2_logfile_path = f'{l2_logfile_path}_{time_now}'
+        if os.path.exists(f'{l2_logfile_path}.txt'):
+            print("Logfile 2 exists!")
+            l2_logfile_path = f'{l2_logfile_path}_{time_now}'
 
-    copy_log_file(original_logfile_path, l2_logfile_path, clear_original=True)
+        stop_live_parse(2, watcher)
+        copy_log_file(original_logfile_path, l2_logfile_path, clear_original=True)
+        manifest.level_finished(2)
 
-if not USE_TMY:
+if not USE_TMY and not DAG_SCHEDULER and 2 not in live_parsed_levels and os.path.exists(f'{l2_logfile_path}.txt'):
     log_parser(file_path=l2_logfile_path, output_dir=l2_output_dir, metadata_type="weather_range")
 
+if LLM_GENERATION and not USE_TMY and not DAG_SCHEDULER:
+    manifest.refresh(l2_units)
+
 
 # ---------------------------------------------------------------------------------------------------------------------------------
 # ### Level 3: Daily weather data for different countries, considering their seasonal, and geographical contexts
@@ -236,79 +609,66 @@ print(110*"=")
 print("Level 3: Daily weather data for different countries, considering their seasonal, and geographical contexts")
 print(110*"=")
 
-if LLM_GENERATION and not USE_TMY:
-    system_prompt = system_prompt_l3
+if LLM_GENERATION and not USE_TMY and not DAG_SCHEDULER:
+    l3_units = register_units(l3_work_units(load_family_types_json(l1_output_dir)))
+    pending_units = manifest.pending(l3_units) if RESUME_RUN else l3_units
+    pending_ids = {unit_id(unit) for unit in pending_units}
+
+    if pending_units:
+        manifest.level_started(3)
+        set_call_level("l3")
+        watcher = start_live_parse(l3_output_dir, "weather")
+
+        # The seasons of a country are chained: each request carries the previous season's answer as guide
+        guide_prompt = ""
+        for unit in l3_units:
+            if unit["season"] == SEASONS[0]:
+                print(f"Country: {unit['country']}")
+                guide_prompt = ""
 
-    # Get list of json files in folder
-    family_json_files = [f for f in os.listdir(l1_output_dir) if f.endswith(".json")]
+            if unit_id(unit) not in pending_ids:
+                guide_prompt = l3_guide(unit)
+                print(f"    Season: {unit['season']} (done)")
+                continue
 
-    for output_file in family_json_files:
-        full_file_path = os.path.join(l1_output_dir, output_file)  # Combine directory and file name
+            print(f"    Season: {unit['season']}")
+            if not guide_prompt:
+                guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(unit["system_prompt"], unit["user_prompt"], unit=unit_id(unit))
+            else:
+                guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(unit["system_prompt"], unit["user_prompt"], guide_prompt, unit=unit_id(unit))
 
-        # Load the JSON file for further processing
-        with open(full_file_path, "r") as file:
-            family_types_json = json.load(file)
-            # get_number_of_family_members(family_types_json)
+            guide_prompt = guide_prompt[0]['content']
 
-            for country_data in family_types_json:
-                print(f"Country: {country_data['Country']}")
+            log_metadata_weather(unit["country"], unit["season"], usage_prompt_tokens, usage_completion_tokens, partial(logger, unit=unit_id(unit)))
+            manifest.mark(unit, "answered", answer=guide_prompt)
 
-                idx = 0
-                guide_prompt = ""
-                for season in SEASONS:
-                    print(f"    Season: {season}")
-
-                    # Read the corresponding weather data
-                    weather_file = f"{l2_output_dir}/{country_data['Country'].replace(' ', '-')}_weather_min_max.csv"
-                    weather_data = pd.read_csv(weather_file)
-
-                    user_prompt_indexed = user_prompt_daily_l3
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Country$]", country_data['Country'])
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Season$]", season)
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Year$]", str(YEAR))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Temperature_Min$]", str(weather_data.loc[weather_data["Season"] == season, "Temperature_Min"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Temperature_Max$]", str(weather_data.loc[weather_data["Season"] == season, "Temperature_Max"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Humidity_Min$]", str(weather_data.loc[weather_data["Season"] == season, "Humidity_Min"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Humidity_Max$]", str(weather_data.loc[weather_data["Season"] == season, "Humidity_Max"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$SolRad-Diffuse_Min$]", str(weather_data.loc[weather_data["Season"] == season, "SolRad-Diffuse_Min"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$SolRad-Diffuse_Max$]", str(weather_data.loc[weather_data["Season"] == season, "SolRad-Diffuse_Max"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$SolRad-Direct_Min$]", str(weather_data.loc[weather_data["Season"] == season, "SolRad-Direct_Min"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$SolRad-Direct_Max$]", str(weather_data.loc[weather_data["Season"] == season, "SolRad-Direct_Max"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Wind-Speed_Min$]", str(weather_data.loc[weather_data["Season"] == season, "Wind-Speed_Min"].values[0]))
-                    user_prompt_indexed = user_prompt_indexed.replace("[$Wind-Speed_Max$]", str(weather_data.loc[weather_data["Season"] == season, "Wind-Speed_Max"].values[0]))
-
-                    if idx == 0:
-                        guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(system_prompt, user_prompt_indexed)
-                    else:
-                        guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(system_prompt, user_prompt_indexed, guide_prompt)
-
-                    guide_prompt = guide_prompt[0]['content']
-                    
-                    log_metadata_weather(country_data["Country"], season, usage_prompt_tokens, usage_completion_tokens, logger)
-                    idx += 1
-
-        #             break
-        #         break
-        #     break
-        # break
+        time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+        logger(f"[{time_now}]")
 
-    time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
-    logger(f"[{time_now}]")
+        response_cache.report("Level 3")
+        llm.stream_report("Level 3")
+        call_metrics.report("Level 3", level="l3")
+        call_metrics.export()
 
-    if os.path.exists(f'{l3_logfile_path}.txt'):
-        print("Logfile 3 exists!")
-        l3_logfile_path = f'{l3_logfile_path}_{time_now}'
+        if os.path.exists(f'{l3_logfile_path}.txt'):
+            print("Logfile 3 exists!")
+            l3_logfile_path = f'{l3_logfile_path}_{time_now}'
 
-    copy_log_file(original_logfile_path, l3_logfile_path, clear_original=True)
+        stop_live_parse(3, watcher)
+        copy_log_file(original_logfile_path, l3_logfile_path, clear_original=True)
+        manifest.level_finished(3)
 
-if not USE_TMY:
+if not USE_TMY and not DAG_SCHEDULER and 3 not in live_parsed_levels and os.path.exists(f'{l3_logfile_path}.txt'):
     log_parser(file_path=l3_logfile_path, output_dir=l3_output_dir, metadata_type="weather")
 
+if LLM_GENERATION and not USE_TMY and not DAG_SCHEDULER:
+    manifest.refresh(l3_units)
+
 
 # ---------------------------------------------------------------------------------------------------------------------------------
 # This part can replace Stage 2 and Stage 3 LLM Outputs if USE_TMY is set to True
 # 
-if USE_TMY:
+if USE_TMY and not DAG_SCHEDULER:
     print()
     print("Generating TMY data for all countries based on defined capitals long and lat")
     
@@ -316,6 +676,9 @@ if USE_TMY:
     # tmy_output_folder = COMBINE_AND_PLOT_PATHS['weather']['raw_tmy']
 
     if not os.listdir(l3_output_dir):
+        if REPLAY_LOGS:
+            raise ValueError(f"Replay needs the TMY weather files in {l3_output_dir} (they are not part of the logfiles).")
+
         # Create a folder to save the CSV files
         os.makedirs(l3_output_dir, exist_ok=True)
 
@@ -338,77 +701,99 @@ print(110*"=")
 print("Level 4: Daily profile based on weather and family type")
 print(110*"=")
 
-if LLM_GENERATION:
+if LLM_GENERATION and not DAG_SCHEDULER:
 
     print(f"Processing weather data from folder: {l3_output_dir}")
     weather_data = process_all_csv_files(l3_output_dir, COUNTRIES)
 
-    system_prompt = system_prompt_l4
-    guide_prompt = ""
-
-    # Get list of json files in folder
-    family_json_files = [f for f in os.listdir(l1_output_dir) if f.endswith(".json") and not f.startswith("selected_")]
-
-    print(family_json_files)
-
-    for output_file in family_json_files:
-        full_file_path = os.path.join(l1_output_dir, output_file)  # Combine directory and file name
-
-        # Load the JSON file for further processing
-        with open(full_file_path, "r") as file:
-            family_types_json = json.load(file)
-            # get_number_of_family_members(family_types_json)
-
-            for country_data in family_types_json:                    
-                print(f"Country: {country_data['Country']}")
-
-                for family in country_data['Families']:                            
-                    print(f"  Family Type: {family['Family Type']}")
-                    print(f"  Members: {', '.join(family['Members'])}")
-                    idx = 0
-                    for season in SEASONS:
-                        print(f"    Season: {season}")
-
-                        for day_pattern in PATTERNS:
-                            print(f"      Pattern: {day_pattern}")
-
-                            user_prompt_indexed = user_prompt_daily_l4
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Country$]", country_data['Country'])
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Year$]", str(YEAR))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$FamilyType$]", family['Family Type'])
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Members$]", ", ".join(family['Members']))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$MembersNum$]", str(len(family['Members'])))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Pattern$]", day_pattern)
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Season$]", season)
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Hour$]", str(weather_data[country_data['Country']][season]["Hour"]))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Temperature$]", str(weather_data[country_data['Country']][season]["Temperature_Value"]))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$Humidity$]", str(weather_data[country_data['Country']][season]["Humidity_Value"]))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$SolarRadiationDirect$]", str(weather_data[country_data['Country']][season]["SolRad-Direct_Value"]))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$SolarRadiationDiffuse$]", str(weather_data[country_data['Country']][season]["SolRad-Diffuse_Value"]))
-                            user_prompt_indexed = user_prompt_indexed.replace("[$WindSpeed$]", str(weather_data[country_data['Country']][season]["Wind-Speed_Value"]))
-
-                            guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(system_prompt, user_prompt_indexed)
-                            guide_prompt=guide_prompt[0]['content']
-                            # usage_prompt_tokens, usage_completion_tokens = None, None
-
-                            family_type_clean = family["Family Type"].replace("'","-")
-                            family_members_clean = [member.replace("'", "-") for member in family["Members"]]
-                            log_metadata(country_data["Country"], family_type_clean, family_members_clean, season, day_pattern, usage_prompt_tokens, usage_completion_tokens, logger)
-                            idx += 1
-
-                            # break   # 1 Day Pattern
-                        # break       # 1 Season
-                    # break           # 1 Family
-            # break                   # 1 Country
+    family_types_json = load_family_types_json(l1_output_dir)
+    # get_number_of_family_members(family_types_json)
+
+    l4_units = l4_work_units(family_types_json, weather_data)
+    pending_units = manifest.pending(l4_units) if RESUME_RUN else l4_units
+    request_units = register_units(pack_l4_work_units(pending_units, weather_data, L4_SCENARIOS_PER_REQUEST))
+    l4_usage = []
+
+    if pending_units:
+        manifest.level_started(4)
+        set_call_level("l4")
+        watcher = start_live_parse(l4_output_dir, "family_consumption")
+
+        if ASYNC_GENERATION:
+            print(f"Async generation with up to {MAX_CONCURRENT_REQUESTS} concurrent requests")
+            l4_validations = {}     # unit id -> (scenarios still invalid after the repairs, requests of the answer)
+
+            def log_l4_result(unit, guide_prompt, usage_prompt_tokens, usage_completion_tokens):
+                # Runs on the event loop thread, so each unit's block is written without interleaving
+                print(f"  Done: {unit['country']} | {unit['family_type']} | {l4_scenario_label(unit)}")
+                unit_logger = partial(logger, unit=unit_id(unit))
+                problems, exchanges = l4_validations.pop(unit_id(unit), (None, None))
+                log_prompt_block(system_prompt_msg(unit["system_prompt"]), user_prompt_msg(unit["user_prompt"]), unit=unit_id(unit))
+                unit_logger(l4_exchange_messages(exchanges) + assistent_prompt_msg(guide_prompt))
+                log_l4_metadata(unit, usage_prompt_tokens, usage_completion_tokens, unit_logger)
+                mark_l4_answered(unit, problems)
+                l4_usage.append((unit, usage_prompt_tokens))
+
+            async def get_l4_response(async_llm, unit):
+                start = time.monotonic()
+                if VALIDATE_ON_ARRIVAL:
+                    answer, usage_prompt_tokens, usage_completion_tokens, *l4_validations[unit_id(unit)] = \
+                        await get_valid_l4_response_async(async_llm, unit, L4_MAX_REPAIRS)
+                else:
+                    answer, usage_prompt_tokens, usage_completion_tokens = await async_llm.getResponse(unit["messages"])
+                log_timing(unit_id(unit), time.monotonic() - start, usage_prompt_tokens, usage_completion_tokens)
+                return answer, usage_prompt_tokens, usage_completion_tokens
+
+            results = asyncio.run(run_concurrently(async_llm, request_units, MAX_CONCURRENT_REQUESTS, on_result=log_l4_result,
+                                                   get_response=get_l4_response))
+
+            failed_units = [unit for unit, answer, _, _ in results if isinstance(answer, Exception)]
+            for unit in failed_units:
+                for scenario_unit in scenario_units(unit):
+                    manifest.mark(scenario_unit, "failed")
+            if failed_units:
+                print(f"{len(failed_units)} of {len(request_units)} Level 4 requests failed.")
+        else:
+            for unit in request_units:
+                print(f"Country: {unit['country']} | Family Type: {unit['family_type']} | Scenario: {l4_scenario_label(unit)}")
+
+                problems = None
+                if VALIDATE_ON_ARRIVAL:
+                    start = time.monotonic()
+                    log_prompt_block(system_prompt_msg(unit["system_prompt"]), user_prompt_msg(unit["user_prompt"]), unit=unit_id(unit))
+                    guide_prompt, usage_prompt_tokens, usage_completion_tokens, problems, exchanges = get_valid_l4_response(llm, unit, L4_MAX_REPAIRS)
+                    logger(l4_exchange_messages(exchanges) + assistent_prompt_msg(guide_prompt), unit=unit_id(unit))
+                    log_timing(unit_id(unit), time.monotonic() - start, usage_prompt_tokens, usage_completion_tokens)
+                else:
+                    guide_prompt, usage_prompt_tokens, usage_completion_tokens = combined_prompt_msg(unit["system_prompt"], unit["user_prompt"], unit=unit_id(unit))
+                log_l4_metadata(unit, usage_prompt_tokens, usage_completion_tokens, partial(logger, unit=unit_id(unit)))
+                mark_l4_answered(unit, problems)
+                l4_usage.append((unit, usage_prompt_tokens))
 
-    time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
-    logger(f"[{time_now}]")
+        time_now = pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S")
+        logger(f"[{time_now}]")
+
+        response_cache.report("Level 4")
+        report_prompt_tokens_per_scenario(l4_usage)
+        llm.stream_report("Level 4")
+        async_llm.stream_report("Level 4")
+        call_metrics.report("Level 4", level="l4")
+        call_metrics.export()
+
+        if os.path.exists(f'{l4_logfile_path}.txt'):
+            print("Logfile 4 exists!")
+            l4_logfile_path = f'{l4_logfile_path}_{time_now}'
+            print(f"File saved as: {l4_logfile_path}.")
+
+        stop_live_parse(4, watcher)
+        copy_log_file(original_logfile_path, l4_logfile_path, clear_original=True)
+        manifest.level_finished(4)
 
-    if os.path.exists(f'{l4_logfile_path}.txt'):
-        print("Logfile 4 exists!")
-        l4_logfile_path = f'{l4_logfile_path}_{time_now}'
-        print(f"File saved as: {l4_logfile_path}.")
+if not DAG_SCHEDULER and 4 not in live_parsed_levels and os.path.exists(f'{l4_logfile_path}.txt'):
+    log_parser(file_path=l4_logfile_path, output_dir=l4_output_dir, metadata_type="family_consumption")
 
-    copy_log_file(original_logfile_path, l4_logfile_path, clear_original=True)
+if LLM_GENERATION and not DAG_SCHEDULER:
+    manifest.refresh(l4_units)
 
-log_parser(file_path=l4_logfile_path, output_dir=l4_output_dir, metadata_type="family_consumption")
\ No newline at end of file
+if replay_log is not None:
+    replay_log.report()
@@ -0,0 +1,72 @@
+# Description: Offline benchmark of the Level 4 request loop, sequential vs. async, against mock_server.py.
+#
+# Usage:
+#   python benchmarks/benchmark_async_l4.py --units 48 --latency 0.5 --concurrency 1 8 32
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPINFRA_TOKEN", "mock")
+
+from openai import OpenAI, AsyncOpenAI
+
+from llm import LLM, AsyncLLM, run_concurrently
+from mock_server import start_mock_server
+from prompts import system_prompt_l4, user_prompt_daily_l4
+from utils import system_prompt_msg, user_prompt_msg
+
+
+def synthetic_work_units(n_units):
+    members = ["Father", "Mother", "Son", "Daughter"]
+    user_prompt = user_prompt_daily_l4.replace("[$Members$]", ", ".join(members)).replace("[$MembersNum$]", str(len(members)))
+    messages = system_prompt_msg(system_prompt_l4) + user_prompt_msg(user_prompt)
+    return [{"key": ("l4", "Mockland", "Nuclear Family", i), "messages": messages} for i in range(n_units)]
+
+
+def run_sequential(base_url, work_units):
+    llm = LLM("chat", "mock/model", OpenAI(api_key="mock", base_url=base_url))
+    start = time.perf_counter()
+    for unit in work_units:
+        llm.getResponse(unit["messages"])
+    return time.perf_counter() - start
+
+
+def run_async(base_url, work_units, concurrency):
+    async def main():
+        async_llm = AsyncLLM("chat", "mock/model", AsyncOpenAI(api_key="mock", base_url=base_url))
+        start = time.perf_counter()
+        await run_concurrently(async_llm, work_units, concurrency)
+        return time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--units", type=int, default=48, help="Number of Level 4 work units.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock server latency per request (s).")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    server = start_mock_server(port=0, latency=args.latency)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    work_units = synthetic_work_units(args.units)
+
+    print()
+    print(110*"=")
+    print(f"Level 4 benchmark: {args.units} units, {args.latency}s mock latency")
+    print(110*"=")
+
+    if not args.skip_sequential:
+        elapsed = run_sequential(base_url, work_units)
+        print(f"{'sequential':>16}: {elapsed:8.2f} s  {args.units / elapsed:8.2f} calls/s")
+
+    for concurrency in args.concurrency:
+        elapsed = run_async(base_url, work_units, concurrency)
+        print(f"{f'async x{concurrency}':>16}: {elapsed:8.2f} s  {args.units / elapsed:8.2f} calls/s")
+
+    server.shutdown()
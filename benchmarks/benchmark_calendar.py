@@ -0,0 +1,182 @@
+# Description: Benchmark of the calendar of 02B_create_base_dataframes.ipynb over a multi-year range at 1h to 1min steps:
+# the row-wise DataFrame.apply seasons + strftime day names of the former generate_time_dataframe vs. the integer date
+# arithmetic of calendar_engine.calendar_frame. Both must give the same CSV text (the row-wise version only runs up to
+# --max-row-wise rows, it takes minutes beyond). Then the weekend and holiday columns of process_country_data for all
+# countries: the row-wise weekend rule walk + one holidays object per date vs. weekend_flags / holiday_descriptions.
+# Last, the country calendar as 02C loaded it (CSV parse + row-wise pattern) vs. a hit of the calendar cache.
+#
+# Usage:
+#   python benchmarks/benchmark_calendar.py --years 10
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import holidays
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from calendar_engine import calendar_frame, weekend_flags, holiday_descriptions, holiday_table, base_calendar, country_calendar
+from config import WEEKEND_BY_COUNTRY, COUNTRY_CODE
+
+TIME_STEPS = ["1h", "30min", "15min", "5min", "1min"]
+
+
+def row_wise_calendar(start_datetime, end_datetime, time_step="h"):
+    # The former generate_time_dataframe, without the CSV file
+    datetimes = pd.date_range(start=start_datetime, end=end_datetime, freq=time_step)
+    df = pd.DataFrame({'datetime': datetimes})
+    df['year'] = df['datetime'].dt.year
+    df['quarter'] = df['datetime'].dt.quarter
+    df['month'] = df['datetime'].dt.month
+    df['week'] = df['datetime'].dt.isocalendar().week
+    df['day'] = df['datetime'].dt.day
+    df['day_name'] = df['datetime'].dt.strftime('%a').str.upper()
+    df['hour'] = df['datetime'].dt.hour
+    day_name_to_number = {'MON': 1, 'TUE': 2, 'WED': 3, 'THU': 4, 'FRI': 5, 'SAT': 6, 'SUN': 7}
+    df['day_number'] = df['day_name'].map(day_name_to_number)
+
+    def get_season(day, month, hemisphere='northern'):
+        if (month == 12 and day >= 21) or (month in [1, 2]) or (month == 3 and day < 20):
+            return 'Winter' if hemisphere == 'northern' else 'Summer'
+        elif (month == 3 and day >= 20) or (month in [4, 5]) or (month == 6 and day < 21):
+            return 'Spring' if hemisphere == 'northern' else 'Autumn'
+        elif (month == 6 and day >= 21) or (month in [7, 8]) or (month == 9 and day < 23):
+            return 'Summer' if hemisphere == 'northern' else 'Winter'
+        else:
+            return 'Autumn' if hemisphere == 'northern' else 'Spring'
+
+    df['season_northern'] = df.apply(lambda row: get_season(row['day'], row['month'], 'northern'), axis=1)
+    df['season_southern'] = df.apply(lambda row: get_season(row['day'], row['month'], 'southern'), axis=1)
+    return df
+
+
+def row_wise_country_columns(df, country_code, weekend_days_by_country, language='en_US'):
+    # The former weekend / holiday columns of process_country_data
+    def get_weekend_for_country_and_date(country_code, weekend_days_by_country, date):
+        weekend_rules = weekend_days_by_country.get(country_code.upper())
+        if not weekend_rules:
+            return ['SAT', 'SUN']
+        for rule in weekend_rules:
+            if rule['start'] <= date <= rule['end']:
+                return rule['weekend']
+        return ['SAT', 'SUN']
+
+    def check_holidays(greg_date, country_code, language='en_US'):
+        try:
+            country_holidays = getattr(holidays, country_code.upper())(years=greg_date.year, language=language)
+            if greg_date in country_holidays:
+                return country_holidays[greg_date]
+        except AttributeError:
+            return "No Holiday"
+        return "No Holiday"
+
+    df = df.copy()
+    df['is_weekend'] = df.apply(
+        lambda row: 1 if row['day_name'] in get_weekend_for_country_and_date(country_code, weekend_days_by_country,
+                                                                             row['datetime']) else 0, axis=1)
+    df['date_only'] = df['datetime'].dt.date
+    unique_dates = df['date_only'].drop_duplicates()
+    holiday_desc_dict = {date: check_holidays(pd.Timestamp(date), country_code, language) for date in unique_dates}
+    df['is_holiday'] = df['date_only'].map({date: (0 if desc == "No Holiday" else 1) for date, desc in holiday_desc_dict.items()})
+    df['holiday_desc'] = df['date_only'].map(holiday_desc_dict)
+    return df[['is_weekend', 'is_holiday', 'holiday_desc']]
+
+
+def vectorized_country_columns(df, country_code, weekend_days_by_country, language='en_US'):
+    # The weekend / holiday columns of process_country_data
+    columns = pd.DataFrame(index=df.index)
+    columns['is_weekend'] = weekend_flags(df['datetime'], df['day_number'], weekend_days_by_country.get(country_code.upper()))
+    holiday_desc = holiday_descriptions(df['datetime'], country_code, language=language)
+    columns['is_holiday'] = (holiday_desc != "No Holiday").astype(int)
+    columns['holiday_desc'] = holiday_desc
+    return columns
+
+
+def all_countries(function, df):
+    return [function(df, country_code, WEEKEND_BY_COUNTRY) for country_code in COUNTRY_CODE]
+
+
+def csv_text(df):
+    buffer = io.StringIO()
+    df.drop(columns=["minute"], errors="ignore").to_csv(buffer, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    return buffer.getvalue()
+
+
+def csv_master(csv_path):
+    # The former load_master_file of 02C
+    df = pd.read_csv(csv_path, parse_dates=['datetime'])
+    df['pattern'] = df.apply(lambda row: 'Weekend' if row['is_weekend'] == 1 or row['is_holiday'] == 1 else 'Weekday', axis=1)
+    return df
+
+
+def cached_master(start_datetime, end_datetime, time_step, country_code, cache_dir):
+    base_df = base_calendar(start_datetime, end_datetime, time_step, cache_dir=cache_dir)
+    return country_calendar(base_df, country_code, WEEKEND_BY_COUNTRY.get(country_code), cache_dir=cache_dir)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start-year", type=int, default=2020)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--max-row-wise", type=int, default=200000, help="Largest range run with the row-wise calendar.")
+    parser.add_argument("--country-years", type=int, default=5, help="Years of the hourly weekend / holiday benchmark.")
+    args = parser.parse_args()
+
+    start_datetime = f"{args.start_year}-01-01 00:00:00"
+    end_datetime = f"{args.start_year + args.years - 1}-12-31 23:59:59"
+
+    print()
+    print(110*"=")
+    print(f"Calendar benchmark: {start_datetime} to {end_datetime}")
+    print(110*"=")
+
+    for time_step in TIME_STEPS:
+        df, vectorized_time = timed(calendar_frame, start_datetime, end_datetime, time_step)
+        line = f"{time_step:>6}: {len(df):>9} rows, vectorized {vectorized_time:6.2f} s ({df.memory_usage(deep=True).sum() / 1e6:.0f} MB)"
+
+        if len(df) <= args.max_row_wise:
+            reference, row_wise_time = timed(row_wise_calendar, start_datetime, end_datetime, time_step)
+            if csv_text(df) != csv_text(reference):
+                raise AssertionError(f"The calendars differ at {time_step}.")
+            line += f", row-wise {row_wise_time:6.2f} s ({row_wise_time / vectorized_time:.0f}x, same CSV)"
+        else:
+            line += ", row-wise skipped"
+        print(line)
+
+    # Weekend / holiday columns of every country, hourly (the range crosses the 2022 weekend change of the UAE)
+    df = calendar_frame("2019-01-01 00:00:00", f"{2019 + args.country_years - 1}-12-31 23:59:59", "1h")
+    reference, row_wise_time = timed(all_countries, row_wise_country_columns, df)
+    holiday_table.cache_clear()
+    result, first_time = timed(all_countries, vectorized_country_columns, df)
+    _, cached_time = timed(all_countries, vectorized_country_columns, df)
+    for country_code, a, b in zip(COUNTRY_CODE, result, reference):
+        if csv_text(a) != csv_text(b):
+            raise AssertionError(f"The weekend / holiday columns of {country_code} differ.")
+    print(f"{len(COUNTRY_CODE)} countries x {len(df)} hours: row-wise {row_wise_time:6.2f} s, vectorized {first_time:6.2f} s "
+          f"({cached_time:.2f} s with the cached holiday tables, {row_wise_time / first_time:.0f}x, same columns)")
+
+    # Country calendar of 02C: CSV written by 02B vs. calendar cache (first call builds it, the next ones load it)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for time_step in ["1h", "15min"]:
+            calendar_args = (start_datetime, end_datetime, time_step, "US", cache_dir)
+            df, build_time = timed(cached_master, *calendar_args)
+            _, load_time = timed(cached_master, *calendar_args)
+            csv_path = os.path.join(cache_dir, f"US_{time_step}.csv")
+            df.to_csv(csv_path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+            _, csv_time = timed(csv_master, csv_path)
+            print(f"{time_step:>6} US calendar ({len(df)} rows): CSV + row-wise pattern {csv_time:6.2f} s, "
+                  f"cache build {build_time:6.2f} s, cache hit {load_time * 1000:.0f} ms")
+    finally:
+        shutil.rmtree(cache_dir)
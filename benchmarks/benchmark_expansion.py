@@ -0,0 +1,91 @@
+# Description: Benchmark of the yearly expansion of 02C_expand_to_yearly_dataframes.ipynb: one pd.merge of the calendar
+# against each family template on (season, pattern, hour) + column filtering (the former expand_family_data) vs. the
+# slot index of yearly_expansion.TemplateIndex (built once per country) and one take for all families. Noise is left out,
+# both must give the same values.
+#
+# Usage:
+#   python benchmarks/benchmark_expansion.py --families 20 --members 8 --time-step 15min
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from calendar_engine import calendar_frame, country_calendar
+from config import WEEKEND_BY_COUNTRY
+from yearly_expansion import TemplateIndex
+
+KEYS = ["season", "pattern", "hour"]
+
+
+def synthetic_templates(families, members, rng):
+    slots = pd.MultiIndex.from_product([["Winter", "Spring", "Summer", "Autumn"], ["Weekday", "Weekend"], range(24)],
+                                       names=KEYS).to_frame(index=False)
+    templates = []
+    for family in range(families):
+        template = slots.assign(country="USA", family_type=f"Family {family}")
+        for member in range(members):
+            template[f"member{member}_action"] = "Sleeping"
+            template[f"member{member}_consumption"] = np.round(rng.uniform(0, 1, len(slots)), 2)
+        template["total_electricity_usage"] = template.filter(like="_consumption").sum(axis=1)
+        templates.append(template.sample(frac=1, random_state=family).reset_index(drop=True))
+    return templates
+
+
+def merge_expansion(master_df, templates):
+    # The former expand_family_data, without noise and file
+    expanded = []
+    for template in templates:
+        expanded_df = pd.merge(master_df, template, on=KEYS, how="left", suffixes=('', '_template'))
+        expanded_df = expanded_df[[col for col in expanded_df.columns if not col.endswith('_template')]]
+        expanded_df = expanded_df[[col for col in expanded_df.columns if not col.endswith('_action')]]
+        expanded_df.drop(columns=['country', 'family_type', 'holiday_desc', 'year', 'month', 'day', 'hour'], inplace=True)
+        expanded.append(expanded_df)
+    return expanded
+
+
+def take_expansion(master_df, templates):
+    template_index = TemplateIndex(master_df, KEYS)
+    value_columns = [[col for col in template.columns if col not in KEYS + ['country', 'family_type']
+                      and not col.endswith('_action')] for template in templates]
+    calendar_df = master_df.drop(columns=['holiday_desc', 'year', 'month', 'day', 'hour'])
+    return [pd.concat([calendar_df, values_df.set_index(calendar_df.index)], axis=1)
+            for values_df in template_index.expand(templates, value_columns)]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--time-step", default="1h")
+    parser.add_argument("--families", type=int, default=20)
+    parser.add_argument("--members", type=int, default=8)
+    args = parser.parse_args()
+
+    base_df = calendar_frame("2025-01-01 00:00:00", f"{2025 + args.years - 1}-12-31 23:59:59", args.time_step)
+    master_df = country_calendar(base_df, "US", WEEKEND_BY_COUNTRY.get("US"))
+    master_df["pattern"] = np.where((master_df["is_weekend"] == 1) | (master_df["is_holiday"] == 1), "Weekend", "Weekday")
+    templates = synthetic_templates(args.families, args.members, np.random.default_rng(0))
+
+    reference, merge_time = timed(merge_expansion, master_df, templates)
+    result, take_time = timed(take_expansion, master_df, templates)
+    for a, b in zip(result, reference):
+        if list(a.columns) != list(b.columns) or not np.array_equal(a.iloc[:, -(args.members + 1):].to_numpy(),
+                                                                     b.iloc[:, -(args.members + 1):].to_numpy()):
+            raise AssertionError("The expanded templates differ.")
+
+    print()
+    print(110*"=")
+    print(f"Yearly expansion: {len(master_df)} timestamps ({args.time_step}), {args.families} families x {args.members} members")
+    print(110*"=")
+    print(f"pd.merge per family {merge_time:6.2f} s, slot index + one take {take_time:6.2f} s "
+          f"({merge_time / take_time:.1f}x, same values)")
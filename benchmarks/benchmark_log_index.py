@@ -0,0 +1,131 @@
+# Description: Benchmark of the logfile readers on a synthetic Level 4 logfile with the demo prompts and answers: the
+# readlines() passes of process_log_tokens / process_log_timestamps / log pairing vs. the same readers through the
+# byte-offset index of log_index.py (first build, incremental update, indexed reads), with their peak Python memory.
+# With zstandard installed, also archives the logfile and reads the answers back from the archive.
+#
+# Usage:
+#   python benchmarks/benchmark_log_index.py --calls 20000
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPINFRA_TOKEN", "mock")
+
+import utils
+import log_index
+from utils import pair_log_records, process_log_tokens, process_log_timestamps
+
+DEMO_LOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "demo", "phi-4", "logfile_l4_tmy.txt")
+
+
+def demo_blocks():
+    """
+    Returns the logged blocks (timestamp to metadata line) of the demo Level 4 logfile.
+    """
+    blocks = []
+    with open(DEMO_LOG, "r") as file:
+        block = []
+        for line in file:
+            if line.startswith("[") and block:
+                blocks.append(block)
+                block = []
+            block.append(line)
+        blocks.append(block)
+    return blocks
+
+
+def write_synthetic_log(file_path, n_calls, blocks):
+    # A new timestamp per block, so that process_log_timestamps has durations to compute
+    with open(file_path, "w") as file:
+        for i in range(n_calls):
+            block = blocks[i % len(blocks)]
+            file.write(f"[2025-01-{1 + i // 86400 % 28:02d}_T{i // 3600 % 24:02d}-{i // 60 % 60:02d}-{i % 60:02d}]\n")
+            file.writelines(block[1:])
+
+
+def read_all(file_path):
+    # The three readers of a logfile: token totals, call durations and the (metadata, answer) pairs
+    tokens = process_log_tokens(file_path)
+    durations = process_log_timestamps(file_path)[1]
+    if utils.LOG_INDEX:
+        pairs = sum(1 for _ in pair_log_records(log_index.open_log_index(file_path).lines(("assistant", "metadata"))))
+    else:
+        with open(file_path, "r") as file:
+            pairs = sum(1 for _ in pair_log_records(file))
+    return tokens, durations, pairs
+
+
+def measured(function, *args, reset=None):
+    """
+    Times a call, then repeats it under tracemalloc for its peak Python memory (memory-mapped pages are not counted).
+    `reset` is called before each run.
+    """
+    if reset is not None:
+        reset()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    if reset is not None:
+        reset()
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def drop_index(file_path):
+    # Next open_log_index builds the index from scratch
+    log_index.loaded_indexes.clear()
+    if os.path.exists(log_index.index_path(file_path)):
+        os.remove(log_index.index_path(file_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000, help="Calls (blocks) of the synthetic logfile.")
+    parser.add_argument("--append-calls", type=int, default=100, help="Calls appended before the incremental update.")
+    args = parser.parse_args()
+
+    blocks = demo_blocks()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "logfile_l4.txt")
+        write_synthetic_log(file_path, args.calls, blocks)
+        size = os.path.getsize(file_path)
+
+        print()
+        print(110*"=")
+        print(f"Log index benchmark: {args.calls} calls, {size / 1e6:.1f} MB")
+        print(110*"=")
+
+        utils.LOG_INDEX = False
+        reference, scan_time, scan_peak = measured(read_all, file_path)
+        print(f"{'readlines passes':>28}: {scan_time:7.2f} s, peak {scan_peak / 1e6:8.1f} MB")
+
+        utils.LOG_INDEX = True
+        index, build_time, build_peak = measured(log_index.open_log_index, file_path, reset=lambda: drop_index(file_path))
+        print(f"{'index build':>28}: {build_time:7.2f} s, peak {build_peak / 1e6:8.1f} MB "
+              f"({os.path.getsize(index.path) / 1e6:.1f} MB index, {len(index.records)} records)")
+
+        result, read_time, read_peak = measured(read_all, file_path)
+        if result != reference:
+            raise AssertionError("The indexed readers and the readlines passes differ.")
+        print(f"{'indexed readers':>28}: {read_time:7.2f} s, peak {read_peak / 1e6:8.1f} MB "
+              f"({scan_time / read_time:.1f}x, same results)")
+
+        with open(file_path, "a") as file:
+            for i in range(args.append_calls):
+                file.writelines(blocks[i % len(blocks)])
+        _, update_time, _ = measured(log_index.open_log_index, file_path)
+        print(f"{f'update (+{args.append_calls} calls)':>28}: {update_time:7.2f} s")
+
+        if log_index.zstandard is not None:
+            archive_path = log_index.archive_log(file_path, remove=True)
+            result, archive_time, archive_peak = measured(read_all, file_path)
+            print(f"{'readers on the .zst archive':>28}: {archive_time:7.2f} s, peak {archive_peak / 1e6:8.1f} MB "
+                  f"({os.path.getsize(archive_path) / 1e6:.1f} MB archive)")
@@ -0,0 +1,141 @@
+# Description: Benchmark of the log pairing step (metadata line -> nearest preceding unpaired assistant line) on a synthetic
+# Level 4 logfile: the former quadratic scan over readlines() vs. the single-pass utils.pair_log_records.
+# With --parse-calls, also times the full parsing into CSV files (utils.parse_log_lines) for each --workers count.
+#
+# Usage:
+#   python benchmarks/benchmark_log_parser.py --calls 100000 --legacy-calls 5000
+#   python benchmarks/benchmark_log_parser.py --calls 0 --legacy-calls 0 --parse-calls 20000 --workers 1 2 4 8
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DEEPINFRA_TOKEN", "mock")
+
+from utils import pair_log_records, parse_log_lines
+
+DEMO_LOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "demo", "phi-4", "logfile_l4_tmy.txt")
+
+
+def demo_blocks():
+    """
+    Returns the (assistant line, metadata line) pairs of the demo Level 4 logfile.
+    """
+    with open(DEMO_LOG, "r") as file:
+        lines = file.readlines()
+    assistant_lines = [line for line in lines if line.startswith("{'role': 'assistant'")]
+    metadata_lines = [line for line in lines if line.startswith("{'role': 'metadata'")]
+    return list(zip(assistant_lines, metadata_lines))
+
+
+def write_synthetic_log(file_path, n_calls, blocks):
+    # Same block layout as 01_get_multi_llm_response.py, with short prompts and the demo answers
+    with open(file_path, "w") as file:
+        for i in range(n_calls):
+            assistant_line, metadata_line = blocks[i % len(blocks)]
+            file.write(f"[2025-01-01_T00-00-00]\n{100*'-'}\n")
+            file.write(f"{{'role': 'system', 'content': 'System prompt {i}'}}\n")
+            file.write(f"{{'role': 'user', 'content': 'User prompt {i}'}}\n")
+            file.write(assistant_line)
+            file.write(metadata_line)
+
+
+def legacy_pairs(file_path):
+    """
+    The former pairing of log_parser / log_parser_json_org: readlines(), then a scan of all assistant lines
+    for every metadata line.
+    """
+    with open(file_path, "r") as file:
+        lines = file.readlines()
+
+    assistant_lines = [(i, line.strip()) for i, line in enumerate(lines) if line.startswith("{'role': 'assistant'")]
+    metadata_lines = [(i, line.strip()) for i, line in enumerate(lines) if line.startswith("{'role': 'metadata'")]
+
+    pairs = []
+    processed_indices = set()
+    for metadata_index, metadata_line in metadata_lines:
+        assistant_candidates = [
+            (idx, line) for idx, line in assistant_lines if idx < metadata_index and idx not in processed_indices
+        ]
+        if not assistant_candidates:
+            continue
+        assistant_index, _ = assistant_candidates[-1]
+        processed_indices.add(assistant_index)
+        pairs.append((metadata_index, assistant_index))
+
+    return pairs
+
+
+def streaming_pairs(file_path):
+    with open(file_path, "r") as file:
+        return [(metadata_index, assistant[0]) for metadata_index, _, assistant, _ in pair_log_records(file)
+                if assistant is not None]
+
+
+def parse_to_csv(file_path, output_dir, workers):
+    # The serial mode prints every record; only the returned summaries are used here
+    with open(file_path, "r") as file, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return parse_log_lines(file, output_dir, "family_consumption", workers)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=100000, help="Calls (blocks) of the synthetic logfile.")
+    parser.add_argument("--legacy-calls", type=int, default=5000,
+                        help="Calls of the logfile used for the legacy scan, which is quadratic (0 skips it).")
+    parser.add_argument("--parse-calls", type=int, default=0, help="Calls of the logfile parsed into CSV files (0 skips it).")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Process counts of the parsing runs.")
+    args = parser.parse_args()
+
+    blocks = demo_blocks()
+
+    print()
+    print(110*"=")
+    print(f"Log pairing benchmark: synthetic Level 4 logfiles built from {len(blocks)} demo answers")
+    print(110*"=")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.legacy_calls:
+            small_log = os.path.join(tmp_dir, "logfile_small.txt")
+            write_synthetic_log(small_log, args.legacy_calls, blocks)
+
+            legacy, legacy_time = timed(legacy_pairs, small_log)
+            streaming, streaming_time = timed(streaming_pairs, small_log)
+            if legacy != streaming:
+                raise AssertionError("The streaming pairing differs from the legacy pairing.")
+            print(f"{args.legacy_calls:>8} calls: legacy {legacy_time:8.2f} s, streaming {streaming_time:8.2f} s "
+                  f"({legacy_time / streaming_time:.0f}x), identical pairs")
+
+        if args.calls:
+            large_log = os.path.join(tmp_dir, "logfile_large.txt")
+            write_synthetic_log(large_log, args.calls, blocks)
+            size_mb = os.path.getsize(large_log) / 2**20
+
+            streaming, streaming_time = timed(streaming_pairs, large_log)
+            print(f"{args.calls:>8} calls ({size_mb:.0f} MB): streaming {streaming_time:8.2f} s, "
+                  f"{len(streaming) / streaming_time:,.0f} pairs/s")
+            if args.legacy_calls:
+                estimate = legacy_time * (args.calls / args.legacy_calls)**2
+                print(f"{'':>8}  legacy estimate (quadratic from {args.legacy_calls} calls): {estimate:,.0f} s")
+
+        if args.parse_calls:
+            parse_log = os.path.join(tmp_dir, "logfile_parse.txt")
+            write_synthetic_log(parse_log, args.parse_calls, blocks)
+            print(f"Parsing {args.parse_calls} calls into CSV files ({os.cpu_count()} CPUs):")
+
+            baseline = None
+            for workers in args.workers:
+                summaries, parse_time = timed(parse_to_csv, parse_log, os.path.join(tmp_dir, f"csv_{workers}"), workers)
+                failed = sum(1 for summary in summaries if not summary["outputs"])
+                baseline = baseline or parse_time
+                print(f"{workers:>8} workers: {parse_time:8.2f} s, {len(summaries) / parse_time:,.0f} records/s, "
+                      f"speedup {baseline / parse_time:.2f}x, {failed} failed records")
@@ -0,0 +1,85 @@
+# Description: Benchmark of the payload parsing step of utils.parse_log_record on the demo logfiles: the quoting regexes +
+# ast.literal_eval + per-member DataFrames (utils.parse_payload_literal) vs. the tokenizer of payload_parser.payload_frame.
+# Both must give the same CSV text for every demo scenario.
+#
+# Usage:
+#   python benchmarks/benchmark_payload_parser.py --repeat 20
+import os
+import ast
+import sys
+import time
+import argparse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault("DEEPINFRA_TOKEN", "mock")
+
+from utils import pair_log_records, extract_final_message, parse_payload_literal
+from payload_parser import payload_frame
+
+DEMO_LOGS = [
+    ("logfile_l4_tmy.txt", "family_consumption"),
+    ("logfile_l4.txt", "family_consumption"),
+    ("logfile_l3.txt", "weather"),
+    ("logfile_l2.txt", "weather_range"),
+]
+
+
+def demo_scenarios(file_name, metadata_type):
+    """
+    Returns the (metadata, message) of every scenario of a demo logfile, as parse_log_record passes them to the parsers.
+    """
+    scenarios = []
+    with open(os.path.join(REPO_DIR, "demo", "phi-4", file_name), "r") as file:
+        for _, metadata_line, assistant, _ in pair_log_records(file):
+            if assistant is None:
+                continue
+            metadata_parts = [part.strip() for part in ast.literal_eval(metadata_line)["content"].split(",")]
+            metadata = {"Country": metadata_parts[1]}
+            if metadata_type == "family_consumption":
+                metadata.update({"Family Type": metadata_parts[3], "Season": metadata_parts[7], "Pattern": metadata_parts[9]})
+            elif metadata_type == "weather":
+                metadata["Season"] = metadata_parts[3]
+            scenarios.append((metadata, extract_final_message(assistant[1].replace("\n", "").strip())))
+    return scenarios
+
+
+def literal_frames(scenarios, metadata_type):
+    return [parse_payload_literal(content, metadata, metadata_type, lambda message, error=False: None)
+            for metadata, content in scenarios]
+
+
+def tokenized_frames(scenarios, metadata_type):
+    return [payload_frame(content, metadata, metadata_type) for metadata, content in scenarios]
+
+
+def timed(function, repeat, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over each demo logfile.")
+    args = parser.parse_args()
+
+    print()
+    print(110*"=")
+    print(f"Payload parser benchmark: demo/phi-4 logfiles, {args.repeat} passes")
+    print(110*"=")
+
+    for file_name, metadata_type in DEMO_LOGS:
+        scenarios = demo_scenarios(file_name, metadata_type)
+        literal, literal_time = timed(literal_frames, args.repeat, scenarios, metadata_type)
+        tokenized, tokenized_time = timed(tokenized_frames, args.repeat, scenarios, metadata_type)
+
+        fallbacks = sum(frame is None for frame in tokenized)
+        if any(frame is not None and frame.to_csv(index=False) != reference.to_csv(index=False)
+               for frame, reference in zip(tokenized, literal)):
+            raise AssertionError(f"The tokenizer and the literal_eval path differ on {file_name}.")
+
+        print(f"{file_name:>20}: {len(scenarios):3d} scenarios  literal_eval {1000 * literal_time / len(scenarios):6.2f} ms  "
+              f"tokenizer {1000 * tokenized_time / len(scenarios):6.2f} ms  ({literal_time / tokenized_time:.1f}x), "
+              f"{fallbacks} fallbacks, identical CSV")
@@ -0,0 +1,147 @@
+# Description: Offline end-to-end benchmark of 01_get_multi_llm_response.py (Levels 1-4) against mock_server.py.
+#
+# The pipeline runs in a temporary copy of the repository whose config.py is set to the requested size and mode,
+# and reports the calls/sec and wall time of each run.
+#
+# Usage:
+#   python benchmarks/benchmark_pipeline.py --countries 2 --families 3 --latency 0.2 --modes sequential async dag
+#   python benchmarks/benchmark_pipeline.py --countries 6 --families 10 --latency 1.0 --latency-dist lognormal --error-rate 0.05
+import os
+import re
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from mock_server import start_mock_server
+
+# Countries with TMY coordinates in config.CAPITALS; larger runs add synthetic ones
+BENCHMARK_COUNTRIES = ["USA", "Japan", "India", "Sweden", "United Arab Emirates", "Brazil"]
+SCENARIOS_PER_FAMILY = 8  # 4 seasons x (Weekday, Weekend)
+
+MODES = {
+    "sequential": {"ASYNC_GENERATION": False, "DAG_SCHEDULER": False},
+    "async": {"ASYNC_GENERATION": True, "DAG_SCHEDULER": False},
+    "dag": {"ASYNC_GENERATION": True, "DAG_SCHEDULER": True},
+}
+
+
+def benchmark_countries(n_countries):
+    extra = [f"Country{i + 1}" for i in range(max(0, n_countries - len(BENCHMARK_COUNTRIES)))]
+    return (BENCHMARK_COUNTRIES + extra)[:n_countries]
+
+
+def set_config(config_text, name, value):
+    """
+    Replaces the value of a top-level `NAME = ...` assignment of config.py (keeping the inline comment).
+    """
+    pattern = re.compile(rf"^{name} = [^#\n]*", flags=re.MULTILINE)
+    if not pattern.search(config_text):
+        raise ValueError(f"{name} not found in config.py")
+    return pattern.sub(lambda _: f"{name} = {value!r}   ", config_text, count=1)
+
+
+def prepare_run_dir(run_dir, settings):
+    for file_path in glob.glob(os.path.join(REPO_DIR, "*.py")):
+        shutil.copy(file_path, run_dir)
+
+    config_path = os.path.join(run_dir, "config.py")
+    with open(config_path, "r") as file:
+        config_text = file.read()
+    for name, value in settings.items():
+        config_text = set_config(config_text, name, value)
+    with open(config_path, "w") as file:
+        file.write(config_text)
+
+
+def run_pipeline(base_url, server, mode, countries, n_families, args):
+    """
+    Runs the full pipeline once in a fresh temporary folder.
+
+    Returns:
+    - dict: Mode, size, calls, wall time, calls/sec and the number of Level 4 CSV files produced.
+    """
+    settings = {
+        "FOLDER_PATH": "bench",
+        "LLM_GENERATION": True,
+        "USE_TMY": False,
+        "COUNTRIES": countries,
+        "NUMBER_FAMILIES_PER_COUNTRY": n_families,
+        "MAX_CONCURRENT_REQUESTS": args.concurrency,
+        "RESPONSE_CACHE_MODE": "bypass",
+        "RESUME_RUN": False,
+        **MODES[mode],
+    }
+    if args.no_rate_limit:
+        settings.update(RATE_LIMIT_REQUESTS_PER_MINUTE=None, RATE_LIMIT_TOKENS_PER_MINUTE=None)
+
+    with tempfile.TemporaryDirectory(prefix=f"bench_{mode}_") as run_dir:
+        prepare_run_dir(run_dir, settings)
+        env = dict(os.environ, LLM_BASE_URL=base_url, DEEPINFRA_TOKEN="mock")
+
+        calls_before = server.stats.snapshot().get("requests", 0)
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "01_get_multi_llm_response.py"], cwd=run_dir, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        wall_time = time.perf_counter() - start
+        calls = server.stats.snapshot().get("requests", 0) - calls_before
+
+        if process.returncode != 0:
+            print(process.stdout[-3000:])
+            raise RuntimeError(f"The {mode} run failed (exit code {process.returncode})")
+        if args.verbose:
+            print(process.stdout)
+
+        l4_files = glob.glob(os.path.join(run_dir, "bench", "*", "data_l4_family_consumption", "LLM", "raw_csv", "*.csv"))
+
+    return {
+        "mode": mode,
+        "countries": len(countries),
+        "families": n_families,
+        "calls": calls,
+        "wall_time": wall_time,
+        "calls_per_s": calls / wall_time if wall_time > 0 else 0.0,
+        "l4_files": len(l4_files),
+        "l4_expected": len(countries) * n_families * SCENARIOS_PER_FAMILY,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--countries", type=int, default=2, help="Number of COUNTRIES.")
+    parser.add_argument("--families", type=int, default=3, help="NUMBER_FAMILIES_PER_COUNTRY.")
+    parser.add_argument("--modes", nargs="+", default=["sequential", "async", "dag"], choices=list(MODES))
+    parser.add_argument("--concurrency", type=int, default=8, help="MAX_CONCURRENT_REQUESTS of the async and dag runs.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock server latency per request (s).")
+    parser.add_argument("--latency-dist", default="fixed", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share of requests answered with 500.")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Disable the client-side rate limits of config.py.")
+    parser.add_argument("--verbose", action="store_true", help="Print the output of each pipeline run.")
+    args = parser.parse_args()
+
+    server = start_mock_server(port=0, latency=args.latency, latency_dist=args.latency_dist, latency_sigma=args.latency_sigma,
+                               error_rate=args.error_rate, server_error_rate=args.server_error_rate, retry_after=0.1)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    countries = benchmark_countries(args.countries)
+
+    print()
+    print(110*"=")
+    print(f"Pipeline benchmark: {len(countries)} countries x {args.families} families, "
+          f"{args.latency}s {args.latency_dist} mock latency, {args.error_rate:.0%} 429 / {args.server_error_rate:.0%} 500 errors")
+    print(110*"=")
+
+    for mode in args.modes:
+        result = run_pipeline(base_url, server, mode, countries, args.families, args)
+        print(f"{mode:>12}: {result['calls']:6d} calls  {result['wall_time']:8.2f} s  {result['calls_per_s']:8.2f} calls/s  "
+              f"L4 files {result['l4_files']}/{result['l4_expected']}")
+
+    print(f"Mock server: {server.stats.snapshot()}")
+    server.shutdown()
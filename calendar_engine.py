@@ -0,0 +1,284 @@
+# Description: Vectorized calendar of a time range (02B_create_base_dataframes.ipynb). The calendar fields are computed with
+# integer arithmetic on the day numbers (days since 1970-01-01), once per distinct day, then broadcast to every timestamp,
+# so any pandas frequency ('1h', '15min', '1min', ...) and multi-year ranges cost about the same per row.
+# The weekend rules and holidays of a country are looked up once per rule / per (country, year), not once per row.
+# Built calendars can be kept in a cache folder (pickled DataFrames keyed by their inputs), shared by 02B and 02C and by runs.
+import os
+import json
+import hashlib
+import functools
+import holidays
+import numpy as np
+import pandas as pd
+
+DAY_NAMES = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+SEASON_NAMES = ["Winter", "Spring", "Summer", "Autumn"]
+SEASON_STARTS = [320, 621, 923, 1221]   # MMDD of the first day of Spring, Summer, Autumn and Winter (northern hemisphere)
+SOUTHERN_COUNTRIES = ["BR"]             # Country codes using season_southern
+CALENDAR_VERSION = 1                    # Part of the cache keys, bump it when the calendar columns change
+
+NS_PER_DAY = 86400 * 10**9
+NS_PER_HOUR = 3600 * 10**9
+NS_PER_MINUTE = 60 * 10**9
+
+
+def civil_from_days(days):
+    """
+    Converts day numbers (days since 1970-01-01) into proleptic Gregorian (year, month, day) arrays.
+    """
+    z = days + 719468
+    era = np.floor_divide(z, 146097)
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def days_from_civil(year, month, day):
+    """
+    Converts (year, month, day) arrays into day numbers (days since 1970-01-01).
+    """
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    yoe = year - era * 400
+    doy = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def iso_weeks_in_year(year):
+    # 53 weeks when the year starts on a Thursday, or on a Wednesday in a leap year
+    def p(y):
+        return (y + y // 4 - y // 100 + y // 400) % 7
+    return np.where((p(year) == 4) | (p(year - 1) == 3), 53, 52)
+
+
+def iso_week(days, year, weekday):
+    """
+    Returns the ISO 8601 week number of day numbers, given their year and ISO weekday (1 = Monday).
+    """
+    ordinal = days - days_from_civil(year, np.ones_like(year), np.ones_like(year)) + 1
+    week = (ordinal - weekday + 10) // 7
+    # Early January days may belong to the last week of the previous year, late December days to week 1
+    return np.where(week < 1, iso_weeks_in_year(year - 1), np.where(week > iso_weeks_in_year(year), 1, week))
+
+
+def season_codes(month, day, hemisphere="northern"):
+    """
+    Returns the index in SEASON_NAMES of the astronomical season of each (month, day), e.g. Winter from December 21 to
+    March 19 in the northern hemisphere (Summer in the southern one).
+    """
+    northern = np.searchsorted(SEASON_STARTS, month * 100 + day, side="right") % 4
+    return northern if hemisphere == "northern" else (northern + 2) % 4
+
+
+def calendar_frame(start_datetime, end_datetime, time_step="h"):
+    """
+    Builds the calendar of a time range: datetime, year, quarter, month, ISO week, day, day_name, hour, day_number
+    (1 = Monday), season_northern and season_southern (plus minute for sub-hourly steps).
+
+    Parameters:
+    - start_datetime: Start date and time.
+    - end_datetime: End date and time.
+    - time_step (str): Any pandas frequency ('h', '15min', '1min', 'D', ...).
+
+    Returns:
+    - pd.DataFrame: One row per timestamp (day_name and the seasons are categoricals).
+    """
+    if pd.to_datetime(start_datetime) >= pd.to_datetime(end_datetime):
+        raise ValueError("start_datetime must be less than end_datetime")
+
+    datetimes = pd.date_range(start=start_datetime, end=end_datetime, freq=time_step)
+    # Calendar fields of the local wall time
+    ns = (datetimes.tz_localize(None) if datetimes.tz is not None else datetimes).asi8
+    all_days = np.floor_divide(ns, NS_PER_DAY)
+    time_of_day = ns - all_days * NS_PER_DAY
+
+    # The day fields are computed once per distinct day
+    codes, days = pd.factorize(all_days)
+    year, month, day = civil_from_days(days)
+    weekday = (days + 3) % 7 + 1
+    week = iso_week(days, year, weekday)
+    year, month, day, weekday, week = (values.astype(np.int32) for values in (year, month, day, weekday, week))
+
+    df = pd.DataFrame({
+        "datetime": datetimes,
+        "year": year[codes],
+        "quarter": ((month - 1) // 3 + 1)[codes],
+        "month": month[codes],
+        "week": week[codes],
+        "day": day[codes],
+        "day_name": pd.Categorical.from_codes((weekday - 1)[codes], DAY_NAMES),
+        "hour": (time_of_day // NS_PER_HOUR).astype(np.int32),
+    })
+    if (time_of_day % NS_PER_HOUR).any():
+        df["minute"] = (time_of_day % NS_PER_HOUR // NS_PER_MINUTE).astype(np.int32)
+    df["day_number"] = weekday[codes]
+    df["season_northern"] = pd.Categorical.from_codes(season_codes(month, day, "northern")[codes], SEASON_NAMES)
+    df["season_southern"] = pd.Categorical.from_codes(season_codes(month, day, "southern")[codes], SEASON_NAMES)
+    return df
+
+
+def weekend_flags(datetimes, day_numbers, weekend_rules, default_weekend=("SAT", "SUN")):
+    """
+    Returns 1 where the timestamp falls on a weekend day of the rule in force at that time, 0 elsewhere.
+
+    The rules of a country ({'start', 'end', 'weekend'} dicts of WEEKEND_BY_COUNTRY, not overlapping) are resolved with
+    one sorted lookup of the timestamps in the rule start times; timestamps outside every rule use `default_weekend`.
+
+    Parameters:
+    - datetimes (pd.Series): Timestamps.
+    - day_numbers (pd.Series): ISO weekday of each timestamp (1 = Monday).
+    - weekend_rules (list): Rules of the country (None or empty: `default_weekend` everywhere).
+    - default_weekend (tuple): Weekend day names outside the rules.
+
+    Returns:
+    - np.ndarray: 0/1 per timestamp.
+    """
+    rules = sorted(weekend_rules or [], key=lambda rule: rule["start"])
+    # Row 0 is the default weekend, row i + 1 the weekend of rule i (columns: MON ... SUN)
+    weekends = np.array([[name in weekend for name in DAY_NAMES]
+                         for weekend in [default_weekend] + [rule["weekend"] for rule in rules]])
+
+    values = pd.DatetimeIndex(datetimes).asi8
+    starts = np.array([pd.Timestamp(rule["start"]).value for rule in rules], dtype=np.int64)
+    ends = np.array([pd.Timestamp(rule["end"]).value for rule in rules], dtype=np.int64)
+    rule = np.searchsorted(starts, values, side="right") - 1
+    inside = (rule >= 0) & (values <= ends[np.maximum(rule, 0)]) if len(rules) else np.zeros(len(values), bool)
+    rows = np.where(inside, rule + 1, 0)
+    return weekends[rows, np.asarray(day_numbers, dtype=np.int64) - 1].astype(int)
+
+
+@functools.lru_cache(maxsize=None)
+def holiday_table(country_code, year, language="en_US"):
+    """
+    Returns the holidays {date: name} of a country and year, built once per (country, year, language) and kept for the
+    other calls of the session (empty if the holidays package has no such country).
+    """
+    try:
+        country_holidays = getattr(holidays, country_code.upper())(years=year, language=language)
+    except AttributeError:
+        return {}
+    return dict(country_holidays.items())
+
+
+def holiday_descriptions(datetimes, country_code, language="en_US", no_holiday="No Holiday"):
+    """
+    Returns the holiday name of the day of each timestamp (`no_holiday` on the other days).
+    """
+    days = pd.Series(datetimes).dt.normalize()
+    years = range(days.min().year, days.max().year + 1)
+    table = pd.Series({pd.Timestamp(date): name for year in years
+                       for date, name in holiday_table(country_code, year, language).items()}, dtype=object)
+    return days.map(table).fillna(no_holiday)
+
+
+def country_columns(df, country_code, weekend_rules, language="en_US"):
+    """
+    Adds the country columns to a calendar_frame: season (of the country's hemisphere), is_weekend, is_holiday and
+    holiday_desc (the hemisphere seasons are dropped).
+
+    Returns:
+    - pd.DataFrame: The country calendar (a copy).
+    """
+    df = df.copy()
+    df["season"] = df["season_southern"] if country_code in SOUTHERN_COUNTRIES else df["season_northern"]
+
+    # Weekend rule of each timestamp in one lookup (SAT-SUN for countries without rules)
+    df["is_weekend"] = weekend_flags(df["datetime"], df["day_number"], weekend_rules)
+
+    # Holiday tables are built once per (country, year) and reused by the next calls
+    holiday_desc = holiday_descriptions(df["datetime"], country_code, language=language)
+    df["is_holiday"] = (holiday_desc != "No Holiday").astype(int)
+    df["holiday_desc"] = holiday_desc
+
+    return df.drop(columns=["season_southern", "season_northern"])
+
+
+def cache_key(**fields):
+    """
+    Returns the cache key of a calendar: a hash of its inputs, the calendar version and the holidays package version.
+    """
+    fields = {**fields, "calendar_version": CALENDAR_VERSION, "holidays_version": holidays.__version__}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def cached_frame(cache_dir, name, key, build):
+    """
+    Returns the DataFrame cached as <cache_dir>/<name>_<key>.pkl, built by `build()` and written first if it is missing.
+    A calendar whose inputs changed gets a new key, so stale entries are never read (the cache folder can be deleted).
+    df.attrs holds the "cache_key" and "cache_path" of the entry (None without cache_dir or key).
+    """
+    if cache_dir is None or key is None:
+        df = build()
+        df.attrs.update(cache_key=None, cache_path=None)
+        return df
+
+    path = os.path.join(cache_dir, f"{name}_{key}.pkl")
+    if os.path.exists(path):
+        df = pd.read_pickle(path)
+    else:
+        df = build()
+        df.attrs.clear()
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+    df.attrs.update(cache_key=key, cache_path=path)
+    return df
+
+
+def base_calendar(start_datetime, end_datetime, time_step="h", cache_dir=None):
+    """
+    calendar_frame of a time range, read from `cache_dir` when it was built before.
+    """
+    key = cache_key(start=start_datetime, end=end_datetime, time_step=time_step)
+    return cached_frame(cache_dir, "base", key, lambda: calendar_frame(start_datetime, end_datetime, time_step))
+
+
+def country_calendar(base_df, country_code, weekend_rules, language="en_US", cache_dir=None):
+    """
+    Calendar of a country (country_columns of a base_calendar), read from `cache_dir` when it was built before from the
+    same base calendar, weekend rules, language and holidays version (a base calendar built without cache is not cached).
+
+    Parameters:
+    - base_df (pd.DataFrame): Output of base_calendar.
+    - country_code (str): ISO country code.
+    - weekend_rules (list): WEEKEND_BY_COUNTRY rules of the country.
+    - language (str): Language of the holiday names.
+    - cache_dir (str): Cache folder (None: no cache).
+
+    Returns:
+    - pd.DataFrame: The country calendar.
+    """
+    base_key = base_df.attrs.get("cache_key")
+    key = cache_key(base=base_key, country=country_code, weekend_rules=weekend_rules, language=language) if base_key else None
+    return cached_frame(cache_dir, country_code, key, lambda: country_columns(base_df, country_code, weekend_rules, language))
+
+
+def save_csv(df, file_path):
+    """
+    Writes a calendar to CSV, unless `file_path` was already written from the same cache entry (its cache key is kept in
+    the <file_path>.key sidecar). Calendars built without cache are always written.
+
+    Returns:
+    - bool: True if the CSV was written.
+    """
+    key = df.attrs.get("cache_key")
+    key_path = f"{file_path}.key"
+    if key is not None and os.path.exists(file_path) and os.path.exists(key_path):
+        with open(key_path) as file:
+            if file.read().strip() == key:
+                return False
+
+    if os.path.exists(key_path):
+        os.remove(key_path)
+    df.to_csv(file_path, index=False, date_format="%Y-%m-%d %H:%M:%S")
+    if key is not None:
+        with open(key_path, "w") as file:
+            file.write(key + "\n")
+    return True
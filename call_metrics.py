@@ -0,0 +1,174 @@
+# Description: Per-call latency and token metrics of the LLM calls, measured inside LLM.getResponse with monotonic clocks.
+# The calls are aggregated per model and level (p50/p95/p99 latency, time-to-first-token, tokens/sec) and exported as a JSON
+# file and a Prometheus text file (node_exporter textfile collector format), rewritten while the run goes on.
+import os
+import json
+import time
+import threading
+import contextvars
+import numpy as np
+import pandas as pd
+
+QUANTILES = (0.5, 0.95, 0.99)
+EXPORT_INTERVAL = 10.0      # Seconds between two exports while calls are recorded (the last calls are exported by export())
+
+# Level of the calls made in the current thread / asyncio task ("l1" ... "l4"), set by the callers of getResponse
+call_level = contextvars.ContextVar("call_level", default=None)
+
+
+def set_call_level(level):
+    call_level.set(level)
+
+
+def quantiles(values):
+    if not len(values):
+        return {f"p{round(q * 100)}": None for q in QUANTILES}
+    return {f"p{round(q * 100)}": round(float(value), 4) for q, value in zip(QUANTILES, np.quantile(values, QUANTILES))}
+
+
+class CallMetrics:
+    """
+    Collects one record per LLM call (shared by the sync and async clients of a run) and exports their aggregates.
+
+    Fields of a call:
+    - latency: getResponse duration (rate limiter waits, retries and backoffs included).
+    - request_latency: duration of the successful request alone (the provider latency).
+    - time_to_first_token: first streamed content chunk (streamed calls only).
+    - prompt_tokens, completion_tokens, cached, retries.
+
+    Parameters:
+    - json_path (str): JSON export (None: no JSON file).
+    - prometheus_path (str): Prometheus text export (None: no Prometheus file).
+    - export_interval (float): Minimum seconds between two automatic exports.
+    """
+    def __init__(self, json_path=None, prometheus_path=None, export_interval=EXPORT_INTERVAL):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.export_interval = export_interval
+        self.calls = []
+        self.lock = threading.Lock()
+        self.last_export = time.monotonic()
+
+    def record(self, model, **call):
+        with self.lock:
+            self.calls.append({"model": model, "level": call_level.get() or "-", **call})
+            due = time.monotonic() - self.last_export >= self.export_interval
+        if due:
+            self.export()
+
+    def summary(self):
+        """
+        Returns one dict per (model, level) with the call counts, the latency / time-to-first-token quantiles (seconds, API
+        calls only) and the token throughput.
+        """
+        with self.lock:
+            calls = pd.DataFrame(self.calls)
+        rows = []
+        if calls.empty:
+            return rows
+
+        for (model, level), group in calls.groupby(["model", "level"], sort=True):
+            api_calls = group.loc[~group["cached"]]
+            request_latency = api_calls["request_latency"].to_numpy(dtype=float)
+            time_to_first_token = api_calls["time_to_first_token"].dropna().to_numpy(dtype=float)
+            completion_tokens = api_calls["completion_tokens"].to_numpy(dtype=float)
+            tokens_per_second = completion_tokens / np.maximum(request_latency, 1e-9)
+
+            rows.append({
+                "model": model,
+                "level": level,
+                "calls": len(group),
+                "cached": int(group["cached"].sum()),
+                "retries": int(group["retries"].sum()),
+                "latency_s": quantiles(api_calls["latency"].to_numpy(dtype=float)),
+                "latency_sum_s": round(float(api_calls["latency"].sum()), 4),
+                "request_latency_s": quantiles(request_latency),
+                "request_latency_sum_s": round(float(request_latency.sum()), 4),
+                "time_to_first_token_s": quantiles(time_to_first_token),
+                "time_to_first_token_sum_s": round(float(time_to_first_token.sum()), 4),
+                "streamed": len(time_to_first_token),
+                "tokens_per_s": quantiles(tokens_per_second),
+                # Completion tokens over the summed request time (not the wall time of concurrent calls)
+                "completion_tokens_per_s": round(float(completion_tokens.sum() / request_latency.sum()), 2) if request_latency.sum() > 0 else None,
+                "prompt_tokens": int(api_calls["prompt_tokens"].sum()),
+                "completion_tokens": int(completion_tokens.sum()),
+            })
+        return rows
+
+    def export(self):
+        """
+        Writes the summary to the JSON and Prometheus files (each file is replaced atomically).
+        """
+        with self.lock:
+            self.last_export = time.monotonic()
+        if self.json_path is None and self.prometheus_path is None:
+            return
+        rows = self.summary()
+        if self.json_path is not None:
+            write_atomically(self.json_path, json.dumps({"time": pd.Timestamp.now().isoformat(), "metrics": rows}, indent=2) + "\n")
+        if self.prometheus_path is not None:
+            write_atomically(self.prometheus_path, prometheus_text(rows))
+
+    def report(self, label="", level=None):
+        """
+        Prints the percentiles of the recorded calls, per model and level (only `level` if given).
+        """
+        rows = [row for row in self.summary() if level is None or row["level"] == level]
+        if not rows:
+            return
+        print(f"Call metrics {label}:")
+        for row in rows:
+            latency, ttft, throughput = row["request_latency_s"], row["time_to_first_token_s"], row["tokens_per_s"]
+            line = (f"  {row['model']} {row['level']}: {row['calls']} calls ({row['cached']} cached, {row['retries']} retries), "
+                    f"latency p50/p95/p99 {format_quantiles(latency)}s")
+            if row["streamed"]:
+                line += f", time-to-first-token p50/p95 {format_quantiles(ttft, 2)}s"
+            line += f", {format_quantiles(throughput, 1, '{:.1f}')} tokens/s p50, {row['completion_tokens_per_s']} tokens/s overall"
+            print(line)
+
+
+def format_quantiles(values, count=3, fmt="{:.2f}"):
+    return "/".join("-" if value is None else fmt.format(value) for value in list(values.values())[:count])
+
+
+def write_atomically(path, text):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+def prometheus_text(rows):
+    """
+    Formats the summary rows in the Prometheus text exposition format (summaries, counters and gauges labelled by model
+    and level).
+    """
+    metrics = [
+        ("llm_request_latency_seconds", "summary", "Latency of the successful request of the LLM calls.", "request_latency_s", "request_latency_sum_s"),
+        ("llm_time_to_first_token_seconds", "summary", "Time to the first streamed token of the LLM calls.", "time_to_first_token_s", "time_to_first_token_sum_s"),
+        ("llm_call_latency_seconds", "summary", "Duration of getResponse (rate limiter waits and retries included).", "latency_s", "latency_sum_s"),
+        ("llm_completion_tokens_per_second", "gauge", "Completion tokens over the summed request time.", "completion_tokens_per_s", None),
+        ("llm_calls_total", "counter", "LLM calls (cached calls included).", "calls", None),
+        ("llm_cached_calls_total", "counter", "LLM calls answered from the response cache.", "cached", None),
+        ("llm_retries_total", "counter", "Retried requests of the LLM calls.", "retries", None),
+        ("llm_prompt_tokens_total", "counter", "Prompt tokens of the API calls.", "prompt_tokens", None),
+        ("llm_completion_tokens_total", "counter", "Completion tokens of the API calls.", "completion_tokens", None),
+    ]
+
+    lines = []
+    for name, metric_type, help_text, key, sum_key in metrics:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for row in rows:
+            labels = f'model="{row["model"]}",level="{row["level"]}"'
+            value = row[key]
+            if metric_type == "summary":
+                count = row["streamed"] if key == "time_to_first_token_s" else row["calls"] - row["cached"]
+                for q, quantile_value in zip(QUANTILES, value.values()):
+                    if quantile_value is not None:
+                        lines.append(f'{name}{{{labels},quantile="{q}"}} {quantile_value}')
+                lines.append(f"{name}_sum{{{labels}}} {row[sum_key]}")
+                lines.append(f"{name}_count{{{labels}}} {count}")
+            elif value is not None:
+                lines.append(f"{name}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,7 +1,7 @@
 # Description: This file contains the configuration for the experiment.
 import os
 import pandas as pd
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 
 # Load the environment variables
@@ -22,12 +22,56 @@ model_dict = {
     4: "deepseek-ai/DeepSeek-R1"                    # https://deepinfra.com/deepseek-ai/DeepSeek-R1
 }
 
+# USD per 1M (prompt, completion) tokens, used by planner.py (check the model pages above, prices change)
+MODEL_PRICES = {
+    "meta-llama/Meta-Llama-3.1-405B-Instruct": (0.80, 0.80),
+    "meta-llama/Llama-3.3-70B-Instruct": (0.23, 0.40),
+    "microsoft/phi-4": (0.07, 0.14),
+    "Qwen/QwQ-32B-Preview": (0.12, 0.18),
+    "deepseek-ai/DeepSeek-R1": (0.75, 2.40),
+}
+
 FOLDER_PATH = "demo"
 LLM_MODEL_IDX = 2
+COMPARE_MODEL_IDXS = [1, 2, 4]  # Models run side by side by 01B_compare_models.py (on the Level 4 work units of LLM_MODEL_IDX)
 LLM_GENERATION = True   # For 4 stages, given the USE_TMY is False. If USE_TMY is True, this will generate Stage 1 and 4 only.
 USE_TMY = True         # When set to True, the TMY data will be used for the weather data skipping Stage 2 and 3.
 SAVE_PLOTS = True
 
+ASYNC_GENERATION = False        # When set to True, Level 4 requests are sent concurrently through the async client.
+MAX_CONCURRENT_REQUESTS = 8     # Upper bound of in-flight requests when ASYNC_GENERATION or DAG_SCHEDULER is True.
+DAG_SCHEDULER = False           # When set to True, Levels 1-4 run per country as soon as their inputs exist (overlapping levels) instead of level by level.
+LIVE_PARSE = False              # When set to True, the level-by-level runs parse each answer into its CSV/JSON file as soon as it is logged (see log_watcher.py).
+VALIDATE_ON_ARRIVAL = True      # Level 4 answers are checked when they arrive (parsing, 24 hours per member, no negative consumption, member count).
+L4_MAX_REPAIRS = 2              # Re-requests of the failing scenarios / member blocks of an invalid Level 4 answer.
+L4_SCENARIOS_PER_REQUEST = 1    # Level 4 (season, pattern) scenarios of the same family asked in one request (1 = one request per scenario, up to 8).
+
+RESUME_RUN = True               # When set to True, work units whose parsed output already exists are skipped (see MANIFEST_PATH).
+REPLAY_LOGS = False             # When set to True, every LLM call is answered from the recorded logfiles (no client, no network) and all outputs are rebuilt.
+REPLAY_LOG_PATH = None          # Folder of the recorded logfile_l*.txt files to replay (None: EXP_PATH).
+
+RATE_LIMIT_REQUESTS_PER_MINUTE = 180      # Client-side budgets (None disables). Keep them just below the provider quota.
+RATE_LIMIT_TOKENS_PER_MINUTE = 400000
+MAX_RETRIES = 6                           # Retries of rate-limited, timed-out or 5xx requests (exponential backoff with jitter)
+RETRY_BASE_DELAY = 1.0                    # Seconds; the n-th retry waits a random time in [0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**n)]
+RETRY_MAX_DELAY = 60.0
+
+STREAM_RESPONSES = False    # Stream completions and stop as soon as $$MESSAGE_END$$ arrives (recommended for reasoning models such as QwQ and DeepSeek-R1, which keep generating after the payload).
+
+RESPONSE_CACHE_MODE = "use"         # "use" (read and write), "refresh" (always call the API and overwrite) or "bypass" (no cache).
+RESPONSE_CACHE_MAX_SIZE_MB = 512    # Least recently used responses are evicted beyond this size (down to 90% of it).
+RESPONSE_CACHE_MAX_AGE_DAYS = 30    # Cached responses older than this are ignored and removed.
+
+LOG_PARSER_WORKERS = 1          # Processes parsing the logfiles into CSV files (above 1, records are parsed in parallel and a summary replaces the per-record messages). Forked processes only (Linux/macOS with the 'fork' start method; parsed serially elsewhere), since the 01 scripts have no __main__ guard.
+LOG_PARSER_CHUNK_SIZE = 64      # Records sent to a parser process at a time.
+
+LOG_INDEX = True                # Logfile readers (log_parser, log_parser_json, process_log_tokens, process_log_timestamps) go through the byte-offset index <logfile>.txt.idx (see log_index.py).
+
+DATASET_FORMAT = "csv"          # "csv" (one CSV file per scenario / family) or "parquet" (typed files partitioned by country/family/season, needs pyarrow; see dataset_store.py). Level 2-3 weather files stay CSV.
+
+# OpenAI-compatible endpoint. Override with LLM_BASE_URL (e.g. http://127.0.0.1:8000/v1 for mock_server.py).
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.deepinfra.com/v1/openai")
+
 # COUNTRIES = ["USA", "Japan", "India", "Sweden", "United Arab Emirates", "Brazil"]
 # COUNTRIES = ["USA", "Brazil"]       # For testing purposes
 COUNTRIES = ["USA"]                 # For testing purposes
@@ -35,28 +79,56 @@ COUNTRIES = ["USA"]                 # For testing purposes
 NUMBER_FAMILIES_PER_COUNTRY = 3     # Number of families to generate per country (passed to prompts.py file)
 
 # ---------------------------------------------------------------------------------------------------------------------------------
+def get_model_subname(model):
+    return model.split("/")[1].replace(".", "p")
+
+def get_model_paths(model):
+    """
+    Level 4 paths of any model, laid out like the paths of LLM_MODEL above (used to run several models at once).
+    """
+    exp_path = os.path.join(FOLDER_PATH, get_model_subname(model))
+    return {
+        "exp_path": exp_path,
+        "manifest_path": f"{exp_path}/{TYPE}/manifest.jsonl",
+        "l4_logfile_path": f"{exp_path}/logfile_l4",
+        "l4_output_dir": f"{exp_path}/data_l4_family_consumption/{TYPE}/raw_csv",
+    }
+
 LLM_MODEL = model_dict[int(LLM_MODEL_IDX)]
-LLM_MODEL_SUBNAME = LLM_MODEL.split("/")[1].replace(".", "p")
+LLM_MODEL_SUBNAME = get_model_subname(LLM_MODEL)
 print(f"LLM Model: {LLM_MODEL}")
 
-if LLM_GENERATION:
+if REPLAY_LOGS:
+    # Replay runs the generation code paths, answered from the logfiles
+    LLM_GENERATION = True
+    print(f'Replay: {REPLAY_LOGS}')
+elif LLM_GENERATION:
     print(f'LLM Generation: {LLM_GENERATION}')
 
-    # Get the API key from the environment variable
-    api_key = os.getenv("DEEPINFRA_TOKEN")
+_clients = {}
 
-    # Validate that the API key exists
-    if not api_key:
-        raise ValueError("API key not found! Please set DEEPINFRA_TOKEN as an environment variable.")
-    else:
-        print("API key found!")
+def get_client(async_client=False):
+    """
+    Returns the (async) OpenAI client of LLM_BASE_URL, created on first use so that importing
+    this file needs neither the API key nor the network.
+    """
+    if async_client not in _clients:
+        # Get the API key from the environment variable
+        api_key = os.getenv("DEEPINFRA_TOKEN")
 
-    CLIENT = OpenAI(
-        api_key=api_key,
-        base_url="https://api.deepinfra.com/v1/openai"
-    )
-else:
-    CLIENT = None
+        # Validate that the API key exists
+        if not api_key:
+            raise ValueError("API key not found! Please set DEEPINFRA_TOKEN as an environment variable.")
+
+        # Retries are handled by llm.LLM (MAX_RETRIES) so that they go through the rate limiter
+        client_class = AsyncOpenAI if async_client else OpenAI
+        _clients[async_client] = client_class(
+            api_key=api_key,
+            base_url=LLM_BASE_URL,
+            max_retries=0
+        )
+
+    return _clients[async_client]
 
 # ---------------------------------------------------------------------------------------------------------------------------------
 # Paths
@@ -71,17 +143,34 @@ print(f"Sub Experiment Path: {SUB_EXP_PATH}")
 
 original_logfile_path = f"{EXP_PATH}/logfile.txt"
 
+# Status of every work unit of the experiment (append-only JSON lines)
+MANIFEST_PATH = f"{SUB_EXP_PATH}/manifest.jsonl"
+
+# Structured log: one JSON record per logged message, metadata line and request timing, tagged with the work unit id (None disables)
+EVENT_LOG_PATH = f"{EXP_PATH}/events.jsonl"
+
+# Per-call latency / time-to-first-token / tokens-per-second percentiles by level and model (None disables an export)
+METRICS_JSON_PATH = f"{EXP_PATH}/llm_metrics.json"
+METRICS_PROMETHEUS_PATH = f"{EXP_PATH}/llm_metrics.prom"
+
+# Shared by all models, the model name is part of every cache key
+RESPONSE_CACHE_PATH = f"{FOLDER_PATH}/response_cache"
+
 l1_logfile_path = f"{EXP_PATH}/logfile_l1"
 l2_logfile_path = f"{EXP_PATH}/logfile_l2"
 l3_logfile_path = f"{EXP_PATH}/logfile_l3"
 l4_logfile_path = f"{EXP_PATH}/logfile_l4"
 
+if REPLAY_LOG_PATH is None:
+    REPLAY_LOG_PATH = EXP_PATH
+
 l1_output_dir = f"{EXP_PATH}/data_l1_family_types"
 l2_output_dir = f"{EXP_PATH}/data_l2_weather_range"
 l3_output_dir = f"{EXP_PATH}/data_l3_weather_by_season"
 l4_output_dir = f"{EXP_PATH}/data_l4_family_consumption"
 
 JSON_FILE_PATH = f"{l1_output_dir}/family_types_$COUNTRY$.json"
+
 JSON_MASTER_FILE_PATH = f'{l1_output_dir}/selected_family_types.json'
 
 def generate_paths(base_path):
@@ -100,6 +189,7 @@ EXP_YEARLY_PATH = f'{EXP_PATH}/csv_yearly_profiles'
 
 EXP_PROFILES_EXPAND_PATH = f'{SUB_EXP_PATH}/csv_expanded_profile'
 EXP_WEATHER_EXPAND_PATH = f'{SUB_EXP_PATH}/csv_expanded_weather'
+EXP_ENSEMBLE_PATH = f'{SUB_EXP_PATH}/csv_ensemble_profile'
 
 CSV_FINAL_PROFILES_WEATHER = f"{SUB_EXP_PATH}/csv_profile_with_weather"
 
@@ -204,10 +294,16 @@ TIME_STEP  = '1h'
 START_TIME = f"{YEAR}-01-01 00:00:00"
 END_TIME   = f"{YEAR}-12-31 23:59:59"
 YEARLY_FILE_TEMPLATE = f'{EXP_YEARLY_PATH}/time_data_{TIME_STEP}_{YEAR}'
+CALENDAR_CACHE = True                                   # Keep the base / country calendars as binary files, rebuilt only when their inputs change
+CALENDAR_CACHE_PATH = f"{FOLDER_PATH}/calendar_cache"    # Cache folder of the calendars (can be deleted)
 # ---------------------------------------------------------------------------------------------------------------------------------
 # Constants for file 04_expand_to_yearly_dataframes.ipynb
 WEATHER_NOISE_FACTOR = 2
 FAMILY_NOISE_FACTOR = 2
+ENSEMBLE_REALIZATIONS = 0       # Noisy realizations per family written by the ensemble cell of 02C (0: no ensemble, see ensemble.py)
+ENSEMBLE_SEED = 2025            # Root seed of the ensemble (same seed: same realizations, whatever the chunk size and workers)
+ENSEMBLE_CHUNK_SIZE = 20        # Realizations held in memory and written per file
+ENSEMBLE_WORKERS = 1            # Processes generating the chunks
 # ---------------------------------------------------------------------------------------------------------------------------------
 # Constants for file 05_generate_synthetic_data.ipynb
 
@@ -0,0 +1,144 @@
+# Description: Partitioned Parquet store of the intermediate datasets (raw Level 4 profiles, combined, expanded and
+# profile_with_weather), used in place of the per-scenario CSV files when DATASET_FORMAT is "parquet".
+#
+# Each dataset keeps its folder of config.py and is partitioned by country / family / season:
+#   <FAMILY_RAW_PATH>/country=USA/family=Nuclear-Family/season=Winter/Weekday.parquet
+#   <FAMILY_COMBINED_PATH>/country=USA/family=Nuclear-Family/part.parquet
+# Columns keep their types (integers, floats, datetimes), so the reads need no parse_dates, and a read only loads the
+# files of the selected partitions and the requested columns.
+import os
+import glob
+import pandas as pd
+
+from config import DATASET_FORMAT
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PART_NAME = "part"      # File name of a partition holding a single table
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("DATASET_FORMAT = 'parquet' needs pyarrow (pip install pyarrow).")
+
+
+def partition_value(value):
+    # Same cleaning as the CSV file names
+    return str(value).replace(" ", "-").replace("'", "-")
+
+
+def partition_path(root, name=PART_NAME, **partition):
+    """
+    Returns the Parquet file of a partition, e.g. partition_path(root, "Weekday", country="USA", family="Nuclear Family",
+    season="Winter") -> <root>/country=USA/family=Nuclear-Family/season=Winter/Weekday.parquet
+    """
+    keys = [f"{key}={partition_value(value)}" for key, value in partition.items()]
+    return os.path.join(root, *keys, f"{name}.parquet")
+
+
+def write_parquet(df, path):
+    require_pyarrow()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path)
+    return path
+
+
+def write_partition(df, root, name=PART_NAME, **partition):
+    """
+    Writes a DataFrame as one partition of a dataset (an existing partition file is replaced).
+
+    Parameters:
+    - df (pd.DataFrame): The table.
+    - root (str): Folder of the dataset.
+    - name (str): File name within the partition.
+    - partition: Partition keys and values (e.g. country="USA", family="Nuclear Family").
+
+    Returns:
+    - str: Path of the written file.
+    """
+    return write_parquet(df, partition_path(root, name, **partition))
+
+
+def partition_files(root, **filters):
+    """
+    Returns the Parquet files of a dataset whose partitions match the filters, sorted by path. Keys without a filter
+    match any value (partition_files(root, country="USA") lists every family and season of the USA).
+    """
+    files = glob.glob(os.path.join(root, "**", "*.parquet"), recursive=True)
+    selected = []
+    for file in files:
+        keys = dict(part.split("=", 1) for part in os.path.relpath(os.path.dirname(file), root).split(os.sep) if "=" in part)
+        if all(keys.get(key) == partition_value(value) for key, value in filters.items()):
+            selected.append(file)
+    return sorted(selected)
+
+
+def read_partitions(root, columns=None, **filters):
+    """
+    Reads the partitions of a dataset that match the filters into one DataFrame.
+
+    Parameters:
+    - root (str): Folder of the dataset.
+    - columns (list): Columns to load (None: all columns).
+    - filters: Partition keys and values (see partition_files).
+
+    Returns:
+    - pd.DataFrame or None: The concatenated partitions, or None if no partition matches.
+    """
+    require_pyarrow()
+    files = partition_files(root, **filters)
+    if not files:
+        return None
+    return ds.dataset(files, format="parquet").to_table(columns=columns).to_pandas()
+
+
+def read_table(path, columns=None, parse_dates=None):
+    """
+    Reads one CSV or Parquet file (Parquet files already hold typed datetimes, `parse_dates` only applies to CSV files).
+    """
+    if path.endswith(".parquet"):
+        require_pyarrow()
+        return pq.read_table(path, columns=columns).to_pandas()
+    return pd.read_csv(path, usecols=columns, parse_dates=parse_dates)
+
+
+def save_table(df, csv_path, root, **partition):
+    """
+    Writes an intermediate dataset: `csv_path` when DATASET_FORMAT is "csv", the partition of `root` otherwise.
+
+    Returns:
+    - str: Path of the written file.
+    """
+    if DATASET_FORMAT == "parquet":
+        return write_partition(df, root, **partition)
+    df.to_csv(csv_path, index=False)
+    return csv_path
+
+
+def load_table(csv_path, root, columns=None, parse_dates=None, **partition):
+    """
+    Reads an intermediate dataset written by save_table.
+
+    Returns:
+    - pd.DataFrame or None: The table, or None if it does not exist.
+    """
+    if DATASET_FORMAT == "parquet":
+        return read_partitions(root, columns=columns, **partition)
+    if not os.path.isfile(csv_path):
+        return None
+    return read_table(csv_path, columns=columns, parse_dates=parse_dates)
+
+
+def raw_profile_path(output_dir, country, family_type, season, pattern):
+    """
+    Returns the output file of a parsed Level 4 scenario: <COUNTRY>_<FAMILY>_<SEASON>_<PATTERN>.csv, or its partition when
+    DATASET_FORMAT is "parquet".
+    """
+    if DATASET_FORMAT == "parquet":
+        return partition_path(output_dir, pattern, country=country, family=family_type, season=season)
+    return os.path.join(output_dir, f"{partition_value(country)}_{partition_value(family_type)}_{season}_{pattern}.csv")
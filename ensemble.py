@@ -0,0 +1,109 @@
+# Description: Monte Carlo ensemble of the yearly family profiles (02C_expand_to_yearly_dataframes.ipynb). Each family gets
+# N noisy realizations of its expanded profile. Realization r draws from its own stream: the r-th SeedSequence.spawn child
+# of the family stream, itself keyed by (ENSEMBLE_SEED, country, family type). A realization thus never depends on the
+# other realizations, the chunk size or the number of processes. The noise of a chunk of realizations is drawn and applied
+# as one (realizations x timestamps x members) array, and each chunk is written to its own file before the next one is built.
+import time
+import zlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from dataset_store import save_table
+
+
+def family_seed(seed, country, family_type):
+    """
+    Returns the SeedSequence of a family: the root seed and a stable hash of the country and family type (not Python's
+    hash(), which changes between processes).
+    """
+    return np.random.SeedSequence(seed, spawn_key=(zlib.crc32(f"{country}|{family_type}".encode("utf-8")),))
+
+
+def realization_generators(family_seed_sequence, start, stop):
+    """
+    Generators of realizations start..stop-1, equal to family_seed_sequence.spawn(stop)[start:stop] without spawning
+    (and advancing) the first children.
+    """
+    return [np.random.default_rng(np.random.SeedSequence(family_seed_sequence.entropy,
+                                                         spawn_key=family_seed_sequence.spawn_key + (r,)))
+            for r in range(start, stop)]
+
+
+def family_noise(values, noise_factor, generators):
+    """
+    Noisy realizations of the consumption columns of a family, the batched form of apply_dynamic_noise: Gaussian noise of
+    standard deviation noise_factor x column mean, rounded to 3 decimals and clipped at 0.
+
+    Parameters:
+    - values (np.ndarray): Expanded consumption columns (timestamps x members).
+    - noise_factor (float): Scaling factor of the noise.
+    - generators (list): One np.random.Generator per realization.
+
+    Returns:
+    - np.ndarray: realizations x timestamps x members.
+    """
+    scale = noise_factor * np.nanmean(values, axis=0)
+    noise = np.stack([generator.standard_normal(values.shape) for generator in generators])
+    return np.round(values + noise * scale, 3).clip(min=0)
+
+
+def write_chunk(calendar_df, consumption_columns, values, noise_factor, family_seed_sequence, start, stop, csv_path, root, partition):
+    """
+    Builds realizations start..stop-1 of a family and writes them as one table (long format, with a `realization`
+    column and the recomputed total_electricity_usage).
+
+    Returns:
+    - str: Path of the written file.
+    """
+    realizations = family_noise(values, noise_factor, realization_generators(family_seed_sequence, start, stop))
+    count, rows = realizations.shape[:2]
+
+    chunk_df = calendar_df.iloc[np.tile(np.arange(rows), count)].reset_index(drop=True)
+    chunk_df.insert(0, "realization", np.repeat(np.arange(start, stop), rows))
+    chunk_df["total_electricity_usage"] = np.round(np.nansum(realizations, axis=2).reshape(-1), 3)
+    chunk_df[consumption_columns] = realizations.reshape(count * rows, -1)
+    return save_table(chunk_df, csv_path, root, **partition, chunk=f"{start:05d}")
+
+
+def generate_family_ensemble(calendar_df, values_df, country, family_type, main_dir, realizations, noise_factor=0.1,
+                             seed=0, chunk_size=20, workers=1):
+    """
+    Generates and writes the ensemble of a family, `chunk_size` realizations per file
+    (<main_dir>/<country>_<family>_ensemble_<first realization>.csv, or the chunk=<first realization> partition).
+
+    Parameters:
+    - calendar_df (pd.DataFrame): Calendar columns of the expanded profile (one row per timestamp).
+    - values_df (pd.DataFrame): Expanded template columns of the family (TemplateIndex.expand), same rows.
+    - country (str): Country name.
+    - family_type (str): Family type.
+    - main_dir (str): Output folder.
+    - realizations (int): Number of realizations.
+    - noise_factor (float): Scaling factor of the noise.
+    - seed (int): Root seed of the ensemble.
+    - chunk_size (int): Realizations held in memory and written per file.
+    - workers (int): Number of processes (the output does not depend on it).
+
+    Returns:
+    - list: Paths of the written files, in realization order.
+    """
+    consumption_columns = [col for col in values_df.columns if "consumption" in col]
+    values = values_df[consumption_columns].to_numpy(dtype=float)
+    family_seed_sequence = family_seed(seed, country, family_type)
+
+    formatted_country = country.replace(" ", "-")
+    formatted_family_type = family_type.replace(" ", "-").replace("'", "-")
+    partition = {"country": country, "family": family_type}
+
+    chunks = [(start, min(start + chunk_size, realizations)) for start in range(0, realizations, chunk_size)]
+    tasks = [(calendar_df, consumption_columns, values, noise_factor, family_seed_sequence, start, stop,
+              f"{main_dir}/{formatted_country}_{formatted_family_type}_ensemble_{start:05d}.csv", main_dir, partition)
+             for start, stop in chunks]
+
+    start_time = time.monotonic()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            paths = list(executor.map(write_chunk, *zip(*tasks)))
+    else:
+        paths = [write_chunk(*task) for task in tasks]
+    print(f"  Ensemble: {realizations} realizations of {family_type} in {len(paths)} files ({time.monotonic() - start_time:.1f}s)")
+    return paths
@@ -0,0 +1,335 @@
+# Description: LLM wrappers around the OpenAI-compatible chat completions API (sync and async).
+import time
+import asyncio
+
+from rate_limiter import is_retryable, backoff_delay
+
+MESSAGE_START = "$$MESSAGE_START$$"
+MESSAGE_END = "$$MESSAGE_END$$"
+ESTIMATED_USAGE = "~"   # Prefix of the usage approximated from the text length (streams stopped at MESSAGE_END)
+
+
+def payload_complete(text):
+    """
+    True once a complete $$MESSAGE_START$$...$$MESSAGE_END$$ payload has arrived outside of any
+    <think>...</think> block (reasoning models may draft the format while thinking).
+    """
+    if "<think>" in text:
+        if "</think>" not in text:
+            return False
+        text = text.rsplit("</think>", 1)[1]
+
+    start = text.find(MESSAGE_START)
+    return start != -1 and text.find(MESSAGE_END, start + len(MESSAGE_START)) != -1
+
+
+def approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def usage_text(tokens, estimated=False):
+    # Token counts returned by getResponse and logged in the metadata lines. Approximated counts are prefixed with
+    # ESTIMATED_USAGE so that the log readers (token estimator, log index, replay, planner), which only take digits, skip them
+    return f"{ESTIMATED_USAGE}{tokens}" if estimated else str(tokens)
+
+
+def usage_count(text):
+    return int(str(text).lstrip(ESTIMATED_USAGE))
+
+
+def usage_estimated(*texts):
+    return any(str(text).startswith(ESTIMATED_USAGE) for text in texts)
+
+
+def total_usage(usages):
+    """
+    Sums (usage_prompt_tokens, usage_completion_tokens) pairs of getResponse; the totals are estimated if any pair is.
+    """
+    estimated = any(usage_estimated(*usage) for usage in usages)
+    return (usage_text(sum(usage_count(prompt_tokens) for prompt_tokens, _ in usages), estimated),
+            usage_text(sum(usage_count(completion_tokens) for _, completion_tokens in usages), estimated))
+
+
+class LLM:
+    def __init__(self, modeltype, model, client, cache=None, rate_limiter=None,
+                 max_retries=0, retry_base_delay=1.0, retry_max_delay=60.0, stream=False, metrics=None):
+        self.modeltype = modeltype
+        self.model = model
+        self.client = client
+        self.cache = cache                  # Optional response_cache.ResponseCache
+        self.rate_limiter = rate_limiter    # Optional rate_limiter.RateLimiter
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.stream = stream                # Stream the completion and stop at $$MESSAGE_END$$
+        self.metrics = metrics              # Optional call_metrics.CallMetrics
+        self.stream_stats = []
+        self.call_stats = []                # Latency and usage of every getResponse call
+
+    def _from_cache(self, messages, temperature, max_tokens):
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.make_key(self.model, messages, temperature, max_tokens)
+        return cache_key, self.cache.get(cache_key)
+
+    def forget(self, messages, temperature=0.2, max_tokens=4096*10):
+        """
+        Removes the cached response of a request (same defaults as getResponse), e.g. an answer that is still invalid
+        after its repairs, so that the next run sends it again instead of replaying it from the cache.
+        """
+        if self.cache is not None:
+            self.cache.remove(self.cache.make_key(self.model, messages, temperature, max_tokens))
+
+    def _estimate_tokens(self, messages):
+        return self.rate_limiter.estimator.estimate(messages)
+
+    def _retry_delay(self, attempt, error):
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise error
+        delay = backoff_delay(attempt, error, self.retry_base_delay, self.retry_max_delay)
+        print(f"Request failed ({type(error).__name__}: {error}). Retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def _request_args(self, messages, temperature, max_tokens):
+        request_args = dict(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,  # Adjusted to add some variability in responses
+            # seed=seed
+        )
+        if self.stream:
+            request_args.update(stream=True, stream_options={"include_usage": True})
+        return request_args
+
+    def _completion_result(self, response):
+        answer = response.choices[0].message.content.strip()
+        return answer, response.usage.prompt_tokens, response.usage.completion_tokens, False, None
+
+    def _stream_result(self, messages, parts, usage, start, time_to_first_token, time_to_payload):
+        """
+        Builds the answer of a streamed completion and records its timings. When the stream was stopped
+        at $$MESSAGE_END$$, the provider never sends the usage, so it is approximated from the text length
+        (returned with the ESTIMATED_USAGE prefix by getResponse).
+        """
+        answer = "".join(parts).strip()
+        usage_estimated = usage is None
+        if usage_estimated:
+            usage_prompt_tokens = approx_tokens("".join(str(m.get("content", "")) for m in messages))
+            usage_completion_tokens = approx_tokens(answer)
+        else:
+            usage_prompt_tokens, usage_completion_tokens = usage.prompt_tokens, usage.completion_tokens
+
+        self.stream_stats.append({
+            "time_to_first_token": time_to_first_token,
+            "time_to_payload": time_to_payload,
+            "total_time": time.monotonic() - start,
+            "early_stop": time_to_payload is not None,
+            "completion_tokens": usage_completion_tokens,
+        })
+        return answer, usage_prompt_tokens, usage_completion_tokens, usage_estimated, time_to_first_token
+
+    def _stream_completion(self, request_args):
+        start = time.monotonic()
+        parts, usage, time_to_first_token, time_to_payload, tail = [], None, None, None, ""
+
+        stream = self.client.chat.completions.create(**request_args)
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if time_to_first_token is None:
+                    time_to_first_token = time.monotonic() - start
+                parts.append(delta)
+
+                # Only search the full text when a marker may have just been completed
+                if "$$" in tail + delta and payload_complete("".join(parts)):
+                    time_to_payload = time.monotonic() - start
+                    break
+                tail = (tail + delta)[-len(MESSAGE_END):]
+        finally:
+            stream.close()
+
+        return self._stream_result(request_args["messages"], parts, usage, start, time_to_first_token, time_to_payload)
+
+    def _record_call(self, start, usage_prompt_tokens, usage_completion_tokens, cached=False, retries=0,
+                     request_latency=None, time_to_first_token=None):
+        latency = time.monotonic() - start
+        call = {
+            "latency": latency,
+            "request_latency": latency if request_latency is None else request_latency,
+            "time_to_first_token": time_to_first_token,
+            "prompt_tokens": int(usage_prompt_tokens),
+            "completion_tokens": int(usage_completion_tokens),
+            "cached": cached,
+            "retries": retries,
+        }
+        self.call_stats.append(call)
+        if self.metrics is not None:
+            self.metrics.record(self.model, **call)
+
+    def _cached_result(self, start, cached):
+        self._record_call(start, cached["usage_prompt_tokens"], cached["usage_completion_tokens"], cached=True)
+        estimated = cached.get("usage_estimated", False)
+        return (cached["answer"], usage_text(cached["usage_prompt_tokens"], estimated),
+                usage_text(cached["usage_completion_tokens"], estimated))
+
+    def _finish(self, messages, result, reservation, cache_key, start, retries, request_latency):
+        answer, usage_prompt_tokens, usage_completion_tokens, usage_estimated, time_to_first_token = result
+        self._record_call(start, usage_prompt_tokens, usage_completion_tokens, retries=retries,
+                          request_latency=request_latency, time_to_first_token=time_to_first_token)
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.settle(reservation, usage_prompt_tokens + usage_completion_tokens)
+            if not usage_estimated:
+                self.rate_limiter.estimator.record(messages, usage_prompt_tokens, usage_completion_tokens)
+
+        if self.cache is not None:
+            self.cache.put(cache_key, answer, usage_prompt_tokens, usage_completion_tokens, usage_estimated)
+
+        return answer, usage_text(usage_prompt_tokens, usage_estimated), usage_text(usage_completion_tokens, usage_estimated)
+
+    def stream_report(self, label=""):
+        """
+        Prints the mean time-to-first-token and time-to-payload of the streamed calls since the last report.
+        """
+        if not self.stream_stats:
+            return
+
+        def mean(key):
+            values = [stat[key] for stat in self.stream_stats if stat[key] is not None]
+            return f"{sum(values) / len(values):.2f}s" if values else "-"
+
+        early_stops = sum(stat["early_stop"] for stat in self.stream_stats)
+        print(f"Streaming {label}: {len(self.stream_stats)} calls, {early_stops} stopped at {MESSAGE_END}, "
+              f"mean time-to-first-token {mean('time_to_first_token')}, mean time-to-payload {mean('time_to_payload')}, "
+              f"mean total {mean('total_time')}")
+        self.stream_stats = []
+
+    def getResponse(self, messages, temperature=0.2, max_tokens=4096*10, seed=None):
+        start = time.monotonic()
+        cache_key, cached = self._from_cache(messages, temperature, max_tokens)
+        if cached is not None:
+            return self._cached_result(start, cached)
+
+        request_args = self._request_args(messages, temperature, max_tokens)
+        attempt = 0
+        while True:
+            reservation = None
+            if self.rate_limiter is not None:
+                reservation = self.rate_limiter.acquire(self._estimate_tokens(messages))
+            request_start = time.monotonic()
+            try:
+                if self.stream:
+                    result = self._stream_completion(request_args)
+                else:
+                    result = self._completion_result(self.client.chat.completions.create(**request_args))
+                break
+            except Exception as e:
+                if reservation is not None:
+                    self.rate_limiter.settle(reservation, 0)
+                time.sleep(self._retry_delay(attempt, e))
+                attempt += 1
+
+        return self._finish(messages, result, reservation, cache_key, start, attempt, time.monotonic() - request_start)
+
+
+class AsyncLLM(LLM):
+    """
+    Same interface as LLM, but built on the async OpenAI client (openai.AsyncOpenAI) so that
+    many requests can be in flight at once.
+    """
+    async def _stream_completion(self, request_args):
+        start = time.monotonic()
+        parts, usage, time_to_first_token, time_to_payload, tail = [], None, None, None, ""
+
+        stream = await self.client.chat.completions.create(**request_args)
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if time_to_first_token is None:
+                    time_to_first_token = time.monotonic() - start
+                parts.append(delta)
+
+                if "$$" in tail + delta and payload_complete("".join(parts)):
+                    time_to_payload = time.monotonic() - start
+                    break
+                tail = (tail + delta)[-len(MESSAGE_END):]
+        finally:
+            await stream.close()
+
+        return self._stream_result(request_args["messages"], parts, usage, start, time_to_first_token, time_to_payload)
+
+    async def getResponse(self, messages, temperature=0.2, max_tokens=4096*10, seed=None):
+        start = time.monotonic()
+        cache_key, cached = self._from_cache(messages, temperature, max_tokens)
+        if cached is not None:
+            return self._cached_result(start, cached)
+
+        request_args = self._request_args(messages, temperature, max_tokens)
+        attempt = 0
+        while True:
+            reservation = None
+            if self.rate_limiter is not None:
+                reservation = await self.rate_limiter.acquire_async(self._estimate_tokens(messages))
+            request_start = time.monotonic()
+            try:
+                if self.stream:
+                    result = await self._stream_completion(request_args)
+                else:
+                    result = self._completion_result(await self.client.chat.completions.create(**request_args))
+                break
+            except Exception as e:
+                if reservation is not None:
+                    self.rate_limiter.settle(reservation, 0)
+                await asyncio.sleep(self._retry_delay(attempt, e))
+                attempt += 1
+
+        return self._finish(messages, result, reservation, cache_key, start, attempt, time.monotonic() - request_start)
+
+
+async def run_concurrently(async_llm, work_units, max_concurrency=8, on_result=None, semaphore=None, get_response=None):
+    """
+    Sends one request per work unit with at most `max_concurrency` requests in flight.
+
+    Parameters:
+    - async_llm (AsyncLLM): The async LLM wrapper.
+    - work_units (list): Dicts holding at least a "messages" key; all other keys are metadata.
+    - max_concurrency (int): Upper bound of concurrent requests.
+    - on_result (callable): Optional callback(unit, answer, usage_prompt_tokens, usage_completion_tokens),
+      called as soon as each unit finishes (in completion order).
+    - semaphore (asyncio.Semaphore): Optional semaphore shared with other concurrent runs (e.g. one per model),
+      in which case `max_concurrency` is ignored.
+    - get_response (callable): Optional coroutine function(async_llm, unit) returning (answer, usage_prompt_tokens,
+      usage_completion_tokens), used instead of async_llm.getResponse(unit["messages"]) (e.g. to validate the answer).
+
+    Returns:
+    - list: (unit, answer, usage_prompt_tokens, usage_completion_tokens) tuples in the order of `work_units`.
+      Failed units carry the exception in place of the answer and None for the token counts.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+
+    async def run_unit(unit):
+        async with semaphore:
+            try:
+                if get_response is not None:
+                    answer, usage_prompt_tokens, usage_completion_tokens = await get_response(async_llm, unit)
+                else:
+                    answer, usage_prompt_tokens, usage_completion_tokens = await async_llm.getResponse(unit["messages"])
+            except Exception as e:
+                print(f"Request failed for {unit.get('key', unit)}: {e}")
+                return unit, e, None, None
+
+        if on_result is not None:
+            on_result(unit, answer, usage_prompt_tokens, usage_completion_tokens)
+        return unit, answer, usage_prompt_tokens, usage_completion_tokens
+
+    return await asyncio.gather(*(run_unit(unit) for unit in work_units))
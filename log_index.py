@@ -0,0 +1,298 @@
+# Description: Sidecar byte-offset index of the logfiles. One scan records the offset, role, timestamp and work unit of every
+# logged line in <logfile>.idx; later readers jump to the lines they need through a memory map instead of reading the whole log.
+# Archived logs are compressed into independent zstd segments (<logfile>.zst) that stay seekable through the same index.
+#
+# Usage:
+#   python log_index.py build demo/phi-4/logfile_l4.txt
+#   python log_index.py archive demo/phi-4/logfile_l4.txt --remove     # needs zstandard (pip install zstandard)
+import os
+import re
+import ast
+import mmap
+import json
+import zlib
+import bisect
+import argparse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_VERSION = 1
+CHECK_BYTES = 4096                      # Bytes hashed at the start and before the end of the indexed part (detects a replaced logfile)
+SEGMENT_SIZE = 4 * 1024 * 1024          # Uncompressed bytes per zstd segment of an archive (whole lines)
+COMPRESSION_LEVEL = 10                  # zstd level of the archives (the logs repeat the same prompts, higher levels gain little)
+UNIT_FIELDS = ["Country", "Family Type", "Season", "Pattern"]
+
+ROLE_PATTERN = re.compile(rb"\{'role': '(\w+)'")
+TIMESTAMP_PATTERN = re.compile(r"\[(\d{4}-\d{2}-\d{2}_T\d{2}-\d{2}-\d{2})\]")
+TOKEN_PATTERN = re.compile(r"Usage_Prompt_Tokens, (\d+), Usage_Completion_Tokens, (\d+)")
+
+loaded_indexes = {}     # Absolute log path -> LogIndex (see open_log_index)
+
+
+def index_path(file_path):
+    return f"{file_path}.idx"
+
+
+def metadata_fields(line):
+    """
+    Returns the work unit key ("USA|Nuclear Family|Winter|Weekday") and the token counts of a metadata line.
+    """
+    fields = {}
+    try:
+        parts = [part.strip() for part in ast.literal_eval(line)["content"].split(",")]
+    except (ValueError, SyntaxError, KeyError, TypeError):
+        return fields
+
+    key = [parts[i + 1] for i, part in enumerate(parts[:-1]) if part in UNIT_FIELDS]
+    if key:
+        fields["unit"] = "|".join(key)
+    match = TOKEN_PATTERN.search(line)
+    if match:
+        fields["prompt_tokens"], fields["completion_tokens"] = int(match.group(1)), int(match.group(2))
+    return fields
+
+
+def index_lines(data, start, line_number, time):
+    """
+    Indexes the complete lines of the log from offset `start` (`data` is the memory-mapped file, nothing is copied but
+    the lines that are parsed).
+
+    Returns:
+    - tuple: (records, end offset of the last complete line, number of lines, last timestamp).
+    """
+    records = []
+    position = start
+    while True:
+        end = data.find(b"\n", position)
+        if end < 0:
+            break
+        record = {"line": line_number, "offset": position, "length": end - position}
+
+        match = ROLE_PATTERN.match(data[position:position + 32])
+        if match:
+            record["role"] = match.group(1).decode()
+            if record["role"] == "metadata":
+                record.update(metadata_fields(data[position:end].decode("utf-8", errors="replace")))
+        else:
+            # Separators and the timestamp of each logged block
+            match = TIMESTAMP_PATTERN.search(data[position:end].decode("utf-8", errors="replace"))
+            if match:
+                time = match.group(1)
+                record["role"] = "timestamp"
+
+        if "role" in record:
+            record["time"] = time
+            records.append(record)
+        position = end + 1
+        line_number += 1
+
+    return records, position, line_number, time
+
+
+class LogIndex:
+    """
+    Byte-offset index of a logfile (or of its .zst archive), kept next to it in <file>.idx as JSON lines.
+
+    update() indexes the lines appended since the last call (the whole file if it was replaced or truncated); the
+    logged lines are then read through a memory map (or by decompressing only the needed archive segments).
+
+    Records:
+    - {"line", "offset", "length", "role", "time"}: one per message, metadata or timestamp line ("time" is the timestamp
+      of its block). Metadata records also hold the "unit" key and the "prompt_tokens"/"completion_tokens".
+    - {"checkpoint", "lines", "time", "head", "tail"}: end of the indexed part after each update.
+    - {"segment", "start", "size", "offset", "length"}: uncompressed and compressed extents of an archive segment.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.archived = file_path.endswith(".zst")
+        self.path = index_path(file_path)
+        self.records = []
+        self.segments = []
+        self.checkpoint = None
+        self.segment_cache = (None, None)
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                header, _, entries = file.read().partition("\n")
+            if json.loads(header or "{}").get("version") == INDEX_VERSION:
+                # One json.loads call for the whole file
+                for entry in json.loads(f"[{','.join(entries.splitlines())}]"):
+                    if "checkpoint" in entry:
+                        self.checkpoint = entry
+                    elif "segment" in entry:
+                        self.segments.append(entry)
+                    else:
+                        self.records.append(entry)
+
+    def _checksums(self, data, end):
+        return zlib.crc32(data[:min(end, CHECK_BYTES)]), zlib.crc32(data[max(0, end - CHECK_BYTES):end])
+
+    def update(self):
+        """
+        Indexes the new complete lines of the logfile. Archives are indexed when they are written.
+
+        Returns:
+        - LogIndex: self.
+        """
+        if self.archived:
+            if self.checkpoint is None:
+                raise FileNotFoundError(f"No index for the archive {self.file_path}")
+            return self
+
+        size = os.path.getsize(self.file_path)
+        with open(self.file_path, "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            try:
+                start, line_number, time = 0, 0, None
+                if self.checkpoint is not None and self.checkpoint["checkpoint"] <= size and \
+                        self._checksums(data, self.checkpoint["checkpoint"]) == (self.checkpoint["head"], self.checkpoint["tail"]):
+                    start, line_number, time = self.checkpoint["checkpoint"], self.checkpoint["lines"], self.checkpoint["time"]
+                    if start == size:
+                        return self
+                else:
+                    self.records = []
+
+                records, end, line_number, time = index_lines(data, start, line_number, time)
+                head, tail = self._checksums(data, end)
+            finally:
+                if size:
+                    data.close()
+
+        self.checkpoint = {"checkpoint": end, "lines": line_number, "time": time, "head": head, "tail": tail}
+        self.records.extend(records)
+
+        mode = "a" if start else "w"
+        with open(self.path, mode) as file:
+            if not start:
+                file.write(json.dumps({"version": INDEX_VERSION, "log": os.path.basename(self.file_path)}) + "\n")
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+            file.write(json.dumps(self.checkpoint) + "\n")
+        return self
+
+    def select(self, roles=None):
+        return [record for record in self.records if roles is None or record["role"] in roles]
+
+    def _segment(self, number):
+        # The last decompressed segment is kept, lines are usually read in order
+        if self.segment_cache[0] != number:
+            segment = self.segments[number]
+            with open(self.file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                frame = data[segment["offset"]:segment["offset"] + segment["length"]]
+            self.segment_cache = (number, zstandard.ZstdDecompressor().decompress(frame, max_output_size=segment["size"]))
+        return self.segment_cache[1]
+
+    def read_lines(self, records):
+        """
+        Yields the text of the given records (with their newline), in the given order.
+        """
+        if self.archived:
+            if zstandard is None:
+                raise ImportError("Reading a .zst log archive needs zstandard (pip install zstandard).")
+            starts = [segment["start"] for segment in self.segments]
+            for record in records:
+                number = bisect.bisect_right(starts, record["offset"]) - 1
+                offset = record["offset"] - starts[number]
+                yield self._segment(number)[offset:offset + record["length"] + 1].decode("utf-8")
+            return
+
+        if not records:
+            return
+        with open(self.file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for record in records:
+                yield data[record["offset"]:record["offset"] + record["length"] + 1].decode("utf-8")
+
+    def lines(self, roles):
+        """
+        Yields the lines of the log with the given roles, in file order. The other lines are yielded empty, so that
+        enumerate() gives the same line numbers as when reading the file (see utils.pair_log_records).
+        """
+        line_number = 0
+        records = self.select(roles)
+        for record, text in zip(records, self.read_lines(records)):
+            while line_number < record["line"]:
+                yield ""
+                line_number += 1
+            yield text
+            line_number += 1
+
+
+def open_log_index(file_path):
+    """
+    Returns the up-to-date index of a logfile, or of its archive (<file_path>.zst) when the logfile is gone.
+    The indexes are kept in memory, so the readers of the same logfile load its index once.
+    """
+    if not os.path.exists(file_path) and os.path.exists(f"{file_path}.zst"):
+        file_path = f"{file_path}.zst"
+    key = os.path.abspath(file_path)
+    index = loaded_indexes.get(key)
+    if index is None or not os.path.exists(index.path):
+        index = loaded_indexes[key] = LogIndex(file_path)
+    return index.update()
+
+
+def archive_log(file_path, segment_size=SEGMENT_SIZE, remove=False):
+    """
+    Compresses a logfile into <file_path>.zst: a sequence of independent zstd frames of about `segment_size` bytes of
+    whole lines (`zstd -d` restores the logfile), indexed in <file_path>.zst.idx.
+
+    Parameters:
+    - file_path (str): The logfile (with extension).
+    - segment_size (int): Uncompressed bytes per segment; a smaller size reads fewer bytes per random access.
+    - remove (bool): Deletes the logfile and its index once the archive is written.
+
+    Returns:
+    - str: Path of the archive.
+    """
+    if zstandard is None:
+        raise ImportError("Archiving logs needs zstandard (pip install zstandard).")
+
+    index = LogIndex(file_path).update()
+    archive_path = f"{file_path}.zst"
+    compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+    segments = []
+    with open(file_path, "rb") as source, open(archive_path, "wb") as target:
+        start = 0
+        offset = 0
+        while start < index.checkpoint["checkpoint"]:
+            chunk = source.read(segment_size)
+            # Segments end on a line boundary
+            chunk += source.readline() if not chunk.endswith(b"\n") else b""
+            chunk = chunk[:index.checkpoint["checkpoint"] - start]
+            frame = compressor.compress(chunk)
+            target.write(frame)
+            segments.append({"segment": len(segments), "start": start, "size": len(chunk), "offset": offset, "length": len(frame)})
+            start += len(chunk)
+            offset += len(frame)
+
+    with open(index_path(archive_path), "w") as file:
+        file.write(json.dumps({"version": INDEX_VERSION, "log": os.path.basename(archive_path)}) + "\n")
+        for entry in segments + index.records + [index.checkpoint]:
+            file.write(json.dumps(entry) + "\n")
+
+    print(f"Archived {file_path} ({start / 1e6:.1f} MB) into {archive_path} ({offset / 1e6:.1f} MB, {len(segments)} segments)")
+    if remove:
+        os.remove(file_path)
+        os.remove(index.path)
+    return archive_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["build", "archive"])
+    parser.add_argument("file_path", help="The logfile (with extension).")
+    parser.add_argument("--segment-mb", type=float, default=SEGMENT_SIZE / 1024 / 1024, help="Uncompressed MB per archive segment.")
+    parser.add_argument("--remove", action="store_true", help="Delete the logfile once it is archived.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = open_log_index(args.file_path)
+        roles = {}
+        for record in index.records:
+            roles[record["role"]] = roles.get(record["role"], 0) + 1
+        print(f"{index.path}: {index.checkpoint['lines']} lines, {roles}")
+    else:
+        archive_log(args.file_path, int(args.segment_mb * 1024 * 1024), args.remove)
@@ -0,0 +1,133 @@
+# Description: Live parsing of a logfile while it is being written. A background thread follows the file and turns every answer
+# into its CSV (or Level 1 JSON) file as soon as the answer's metadata line is logged.
+#
+# Usage (standalone, next to a running 01_get_multi_llm_response.py):
+#   python log_watcher.py demo/phi-4/logfile.txt demo/phi-4/data_l4_family_consumption/LLM/raw_csv family_consumption
+import os
+import time
+import argparse
+import threading
+
+from utils import log_writer, pair_log_records, parse_log_record, write_log_record, parse_json_log_lines, report_log_records
+
+POLL_INTERVAL = 0.2     # Seconds between two reads of the followed file once its end is reached
+
+
+def follow_lines(file_path, stop_event, poll_interval=POLL_INTERVAL):
+    """
+    Yields the complete lines of a file as it grows, from its start. Once `stop_event` is set, the lines written so far
+    are yielded and the generator returns.
+    """
+    if not os.path.exists(file_path):
+        open(file_path, "a").close()
+
+    with open(file_path, "r") as file:
+        partial_line = ""
+        while True:
+            stopping = stop_event.is_set()
+            line = file.readline()
+            if line:
+                # A line can be read while the writer thread is still writing it
+                partial_line += line
+                if partial_line.endswith("\n"):
+                    yield partial_line
+                    partial_line = ""
+                continue
+
+            if stopping:
+                if partial_line:
+                    yield partial_line
+                return
+            stop_event.wait(poll_interval)
+
+
+class LogWatcher:
+    """
+    Parses the answers of a logfile while the requests of a level are still running.
+
+    Each answer is parsed with utils.parse_log_record (or parse_json_log_lines for the Level 1 family types) as soon as
+    its metadata line is in the file, so its output exists when the level finishes. Call stop() before the logfile is
+    copied or cleared: it waits for the pending log writes and parses the remaining answers.
+
+    Parameters:
+    - file_path (str): The followed logfile (with extension).
+    - output_dir (str): Folder of the CSV files.
+    - metadata_type (str): "family_consumption", "weather", "weather_range" or "family_types" (Level 1 JSON files).
+    - output_file_name_template (str): Template of the JSON files of "family_types" (see log_parser_json).
+    """
+    def __init__(self, file_path, output_dir, metadata_type, output_file_name_template=None, poll_interval=POLL_INTERVAL):
+        self.file_path = file_path
+        self.output_dir = output_dir
+        self.metadata_type = metadata_type
+        self.output_file_name_template = output_file_name_template
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.summaries = []
+        self.error = None
+        self.start_time = None
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="log-watcher", daemon=True)
+        self.thread.start()
+        print(f"Live parsing of {self.file_path} into {self.output_dir}")
+        return self
+
+    def _run(self):
+        lines = follow_lines(self.file_path, self.stop_event, self.poll_interval)
+        try:
+            if self.metadata_type == "family_types":
+                for line in lines:
+                    if line.startswith("{'role': 'assistant'"):
+                        for output_file in parse_json_log_lines([line], self.output_dir, self.output_file_name_template):
+                            self.summaries.append({"index": None, "outputs": [(output_file, None)], "notes": [], "errors": []})
+                return
+
+            for metadata_index, metadata_line, assistant, _ in pair_log_records(lines):
+                if assistant is None:
+                    self.summaries.append({"index": metadata_index, "outputs": [], "notes": [], "errors": ["No assistant found"]})
+                    continue
+                summary = parse_log_record(metadata_index, metadata_line, assistant[1], self.output_dir, self.metadata_type)
+                write_log_record(summary)
+                self.summaries.append(summary)
+                if summary["errors"]:
+                    print(f"  Live parse of the record at line {metadata_index}: {summary['errors'][0]}")
+        except Exception as e:
+            self.error = e
+            print(f"Live parsing of {self.file_path} stopped: {e}")
+
+    def stop(self):
+        """
+        Parses the answers that are still in the file and stops the thread.
+
+        Returns:
+        - list: The summary of every parsed record (see utils.parse_log_record).
+        """
+        if self.thread is None:
+            return self.summaries
+        log_writer.flush()
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        report_log_records(self.summaries, f"Live parsed {len(self.summaries)} records of {self.file_path} "
+                                           f"in {time.monotonic() - self.start_time:.1f}s")
+        return self.summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file_path", help="The logfile to follow (e.g. <EXP_PATH>/logfile.txt).")
+    parser.add_argument("output_dir", help="Folder of the CSV files.")
+    parser.add_argument("metadata_type", choices=["family_consumption", "weather", "weather_range"])
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    args = parser.parse_args()
+
+    watcher = LogWatcher(args.file_path, args.output_dir, args.metadata_type, poll_interval=args.poll_interval).start()
+    try:
+        while watcher.thread.is_alive():
+            watcher.thread.join(1.0)
+    except KeyboardInterrupt:
+        pass
+    watcher.stop()
@@ -0,0 +1,114 @@
+# Description: Background log writer. One thread, fed by a queue, appends the logfile lines and the JSON-lines event records in batches.
+import ast
+import json
+import queue
+import atexit
+import threading
+import pandas as pd
+
+BATCH_SIZE = 256    # Queued entries written per batch (one write and flush per file)
+
+
+def message_records(msg):
+    """
+    Returns the (role, content) of the logged messages: the message dicts and the metadata lines
+    ("{'role': 'metadata', ...}"). Separators and timestamps are skipped.
+    """
+    items = msg if isinstance(msg, list) else [msg]
+    records = []
+    for item in items:
+        if isinstance(item, str) and item.startswith("{'role'"):
+            try:
+                item = ast.literal_eval(item)
+            except (ValueError, SyntaxError):
+                continue
+        if isinstance(item, dict) and "role" in item:
+            records.append((item["role"], item.get("content", "")))
+    return records
+
+
+class LogWriter:
+    """
+    Appends text blocks to the logfiles and JSON records to the event log from a single background thread.
+
+    Producers (threads or the event loop) only enqueue: each logger() call is written as one block, so
+    concurrent requests cannot interleave their lines, and the files stay open between batches.
+    Call flush() before reading or copying a logfile.
+    """
+    def __init__(self, event_log_path=None, batch_size=BATCH_SIZE):
+        self.event_log_path = event_log_path
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.files = {}
+        self.thread = None
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self.thread.start()
+
+    def write(self, file_name, text):
+        self._start()
+        self.queue.put((file_name, text))
+
+    def event(self, unit, event, **fields):
+        """
+        Queues one JSON record of the event log (no-op when it is disabled).
+
+        Parameters:
+        - unit (str): Work unit id (manifest.unit_id), or None for run-level events.
+        - event (str): "system", "user", "assistant", "metadata", "timing", ...
+        - fields: The other fields of the record (content, latency, tokens, ...).
+        """
+        if self.event_log_path is None:
+            return
+        record = {"time": pd.Timestamp.now().isoformat(), "unit": unit, "event": event, **fields}
+        self.write(self.event_log_path, json.dumps(record, default=str))
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            lines = {}
+            for entry in batch:
+                if entry is not None:
+                    lines.setdefault(entry[0], []).append(entry[1])
+
+            for file_name, texts in lines.items():
+                try:
+                    file = self.files.get(file_name)
+                    if file is None:
+                        file = self.files[file_name] = open(file_name, "a")
+                    file.write("\n".join(texts) + "\n")
+                    file.flush()
+                except OSError as e:
+                    print(f"An error occurred while writing {file_name}: {e}")
+
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """
+        Blocks until every queued entry is written to disk.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for file in self.files.values():
+            file.close()
+        self.files = {}
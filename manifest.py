@@ -0,0 +1,161 @@
+# Description: Resumable run manifest. Tracks the status of every work unit so that interrupted runs skip finished scenarios.
+import os
+import re
+import json
+import pandas as pd
+
+# Number of rows of a valid parsed CSV per level (Level 1 outputs are JSON files)
+EXPECTED_ROWS = {2: 4, 3: 24, 4: 24}
+# Numeric columns of the parsed CSVs (Level 2 ranges, Level 3 weather values, Level 4 consumptions)
+VALUE_COLUMN_PATTERN = re.compile(r"(_Min|_Max|_Value|_Consumption|^Total_Electricity_Usage)$")
+
+
+def unit_id(unit):
+    return "|".join(str(part) for part in unit["key"])
+
+
+def has_valid_output(unit):
+    """
+    Checks that the parsed output file of a work unit exists and is complete: the expected number of rows, and numeric,
+    non-missing values (non-negative consumptions, as in validation.validate_block). An answer still invalid after its
+    repairs is parsed with NaN hours and must not count as done.
+
+    Parameters:
+    - unit (dict): Work unit with "level" and "output_file".
+
+    Returns:
+    - bool: True if the output can be used downstream.
+    """
+    path = unit.get("output_file")
+    if not path or not os.path.isfile(path):
+        return False
+
+    try:
+        if path.endswith(".json"):
+            with open(path, "r") as file:
+                data = json.load(file)
+            return bool(data) and all(entry.get("Families") for entry in data)
+
+        df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    except Exception:
+        return False
+
+    if df.empty or len(df) != EXPECTED_ROWS.get(unit["level"], len(df)):
+        return False
+
+    values = df[[col for col in df.columns if VALUE_COLUMN_PATTERN.search(col)]].apply(pd.to_numeric, errors="coerce")
+    consumptions = values[[col for col in values.columns if col.endswith("_Consumption")]]
+    return not values.isna().any().any() and not (consumptions < 0).any().any()
+
+
+class RunManifest:
+    """
+    Append-only JSON-lines journal of work unit statuses and level start/finish events.
+
+    Unit statuses:
+    - "pending": listed, not sent yet.
+    - "answered": response received and logged, not parsed yet.
+    - "failed": the request raised an error.
+    - "done": the parsed output exists and is valid.
+    - "invalid": answered, but the parsed output is missing or incomplete, or the answer failed validation after its
+      repairs. Invalid units are sent again, even if their output file looks complete.
+
+    Replaying the journal gives the latest status of every unit, so a crash can never corrupt it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.units = {}
+        self.active_levels = set()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written last line of an interrupted run
+                    self._apply(record)
+
+    def _apply(self, record):
+        if record.get("event") == "level_start":
+            self.active_levels.add(record["level"])
+        elif record.get("event") == "level_finish":
+            self.active_levels.discard(record["level"])
+        else:
+            self.units.setdefault(record["id"], {}).update(record)
+
+    def _write(self, record):
+        self._apply(record)
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+    def mark(self, unit, status, **extra):
+        self._write({
+            "id": unit_id(unit),
+            "level": unit["level"],
+            "country": unit.get("country"),
+            "family_type": unit.get("family_type"),
+            "season": unit.get("season"),
+            "pattern": unit.get("pattern"),
+            "status": status,
+            "updated": pd.Timestamp.now().strftime("%Y-%m-%d_T%H-%M-%S"),
+            **extra,
+        })
+
+    def status(self, unit):
+        return self.units.get(unit_id(unit), {}).get("status")
+
+    def answer(self, unit):
+        return self.units.get(unit_id(unit), {}).get("answer")
+
+    def completed(self, unit):
+        return self.status(unit) != "invalid" and has_valid_output(unit)
+
+    def pending(self, work_units):
+        """
+        Registers the work units and returns the ones without a valid parsed output.
+        Units whose output is valid are marked "done" and skipped.
+        """
+        pending_units = []
+        for unit in work_units:
+            if self.completed(unit):
+                if self.status(unit) != "done":
+                    self.mark(unit, "done")
+            else:
+                if self.status(unit) is None:
+                    self.mark(unit, "pending")
+                pending_units.append(unit)
+
+        level = work_units[0]["level"] if work_units else "-"
+        print(f"Manifest Level {level}: {len(work_units)} work units, {len(work_units) - len(pending_units)} done, {len(pending_units)} to run")
+        return pending_units
+
+    def refresh(self, work_units):
+        """
+        Re-checks the parsed outputs after parsing and prints the status counts.
+        """
+        for unit in work_units:
+            status = self.status(unit)
+            if self.completed(unit):
+                if status != "done":
+                    self.mark(unit, "done")
+            elif status in ("answered", "done"):
+                self.mark(unit, "invalid")
+
+        counts = pd.Series([self.status(unit) for unit in work_units]).value_counts().to_dict()
+        level = work_units[0]["level"] if work_units else "-"
+        print(f"Manifest Level {level}: {counts}")
+
+        return counts
+
+    def level_started(self, level):
+        self._write({"event": "level_start", "level": level})
+
+    def level_finished(self, level):
+        self._write({"event": "level_finish", "level": level})
+
+    def interrupted_level(self):
+        """
+        Returns the level that started but never finished in a previous run (None if there is none).
+        """
+        return max(self.active_levels) if self.active_levels else None
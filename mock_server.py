@@ -0,0 +1,389 @@
+# Description: Local fake OpenAI-compatible endpoint (chat completions) for offline runs and benchmarks.
+#
+# The answers replay the payloads of the demo logfiles (demo/phi-4/logfile_l*.txt), adapted to the request
+# (country, number of families, members, packed scenarios), so that they go through the parsers like real ones.
+#
+# Usage:
+#   python mock_server.py --port 8000 --latency 1.0
+#   python mock_server.py --port 8000 --latency 2.0 --latency-dist lognormal --latency-sigma 0.5 --error-rate 0.05
+#   LLM_BASE_URL=http://127.0.0.1:8000/v1 DEEPINFRA_TOKEN=mock python 01_get_multi_llm_response.py
+import os
+import re
+import ast
+import json
+import math
+import random
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo", "phi-4")
+LEVELS = ["l1", "l2", "l3", "l4"]
+
+
+def fake_family_consumption_payload(user_prompt):
+    """
+    Builds a Level 4 style answer ($$MESSAGE_START$$>>>MEMBERS>>>#Member#[...]...$$MESSAGE_END$$) for the
+    members listed in the user prompt, so the output goes through log_parser like a real one.
+    """
+    match = re.search(r"following members: (.*?) total of", user_prompt)
+    members = [m.strip() for m in match.group(1).split(",")] if match else ["Member"]
+
+    def block(name, action, value):
+        return f"#{name}#[" + ", ".join(f"({hour}, {action}, {value})" for hour in range(24)) + "]"
+
+    member_blocks = "".join(block(member.replace("'", "-"), "Sleeping", 0.02) for member in members)
+    hvac_blocks = block("Heating", "Heating-Maintaining-warmth", 0.3) + block("Cooling", "No-Cooling-Needed", 0)
+    return family_consumption_payload(user_prompt, f">>>MEMBERS>>>{member_blocks}>>>HVAC>>>{hvac_blocks}")
+
+
+def family_consumption_payload(user_prompt, scenario_payload):
+    # Packed prompt (prompts.user_prompt_daily_l4_packed): one >>>SCENARIO>>> section per requested [Season|Pattern]
+    scenarios_match = re.search(r"scenarios \[Season\|Pattern\]: (.*?)\.\n", user_prompt)
+    if scenarios_match:
+        scenarios = re.findall(r"\[(\w+)\|(\w+)\]", scenarios_match.group(1))
+        packed_payload = "".join(f">>>SCENARIO>>>[{season}|{day_pattern}]{scenario_payload}" for season, day_pattern in scenarios)
+        return f"$$MESSAGE_START$${packed_payload}$$MESSAGE_END$$"
+
+    return f"$$MESSAGE_START$${scenario_payload}$$MESSAGE_END$$"
+
+
+def load_demo_payloads(demo_dir=DEMO_DIR):
+    """
+    Loads the $$MESSAGE_START$$...$$MESSAGE_END$$ payloads of the demo logfiles, pairing each metadata line
+    with the last assistant message before it (as utils.log_parser does).
+
+    Returns:
+    - dict: {"l1": [payload, ...], "l2": [...], "l3": {season: [...]}, "l4": [...]}. Missing logfiles give empty lists.
+    """
+    payloads = {"l1": [], "l2": [], "l3": {}, "l4": []}
+    for level in LEVELS:
+        file_path = os.path.join(demo_dir, f"logfile_{level}.txt")
+        if not os.path.exists(file_path):
+            continue
+
+        with open(file_path, "r") as file:
+            last_answer = None
+            for line in file:
+                if line.startswith("{'role': 'assistant'"):
+                    last_answer = ast.literal_eval(line.strip())["content"]
+                elif line.startswith("{'role': 'metadata'") and last_answer is not None:
+                    match = re.search(r"\$\$MESSAGE_START\$\$(.*?)\$\$MESSAGE_END\$\$", last_answer, flags=re.DOTALL)
+                    if match:
+                        if level == "l3":
+                            parts = [part.strip() for part in ast.literal_eval(line.strip())["content"].split(",")]
+                            payloads["l3"].setdefault(parts[parts.index("Season") + 1], []).append(match.group(1))
+                        else:
+                            payloads[level].append(match.group(1))
+                    last_answer = None
+
+    return payloads
+
+
+def replay_family_types(user_prompt, payloads):
+    """
+    Level 1: the demo families of the first logged country, cycled up to the requested number of families
+    (repeated family types get a number suffix) and moved to the requested country.
+    """
+    match = re.search(r"Generate (\d+) unique family types for the following country: (.*?)\. ", user_prompt)
+    if not match or not payloads["l1"]:
+        return None
+
+    number_families, country = int(match.group(1)), match.group(2).strip()
+    demo_families = json.loads(random.choice(payloads["l1"]))[0]["Families"]
+    families = []
+    for i in range(number_families):
+        family = dict(demo_families[i % len(demo_families)])
+        if i >= len(demo_families):
+            family["Family Type"] = f"{family['Family Type']} {i // len(demo_families) + 1}"
+        families.append(family)
+
+    return "$$MESSAGE_START$$" + json.dumps([{"Country": country, "Families": families}], indent=4) + "$$MESSAGE_END$$"
+
+
+def replay_family_consumption(user_prompt, payloads):
+    """
+    Level 4: a demo answer whose member blocks are renamed (and cycled) to the members of the prompt,
+    keeping its HVAC blocks; repeated once per scenario for packed prompts.
+    """
+    match = re.search(r"following members: (.*?) total of", user_prompt)
+    if not match or not payloads["l4"]:
+        return None
+
+    members = [member.strip().replace("'", "-") for member in match.group(1).split(",")]
+    blocks = re.findall(r"#([^#]+)#\[(.+?)\]", random.choice(payloads["l4"]), flags=re.DOTALL)
+    member_blocks = [raw_data for name, raw_data in blocks if name not in ("Heating", "Cooling")]
+    hvac_blocks = "".join(f"#{name}#[{raw_data}]" for name, raw_data in blocks if name in ("Heating", "Cooling"))
+    if not member_blocks:
+        return None
+
+    renamed = "".join(f"#{member}#[{member_blocks[i % len(member_blocks)]}]" for i, member in enumerate(members))
+    return family_consumption_payload(user_prompt, f">>>MEMBERS>>>{renamed}>>>HVAC>>>{hvac_blocks}")
+
+
+def build_answer(user_prompt, payloads):
+    """
+    Returns the (level, answer) for a user prompt: the replayed demo payload of the matching level, or the
+    synthetic Level 4 payload when no demo payload fits.
+    """
+    if "unique family types for the following country" in user_prompt:
+        answer = replay_family_types(user_prompt, payloads)
+        if answer:
+            return "l1", answer
+    elif "provide typical min-max ranges" in user_prompt and payloads["l2"]:
+        return "l2", f"$$MESSAGE_START$${random.choice(payloads['l2'])}$$MESSAGE_END$$"
+    elif "generate a 24-hour weather report" in user_prompt:
+        season = re.search(r"during the (\w+) season", user_prompt)
+        candidates = payloads["l3"].get(season.group(1) if season else None) or [p for ps in payloads["l3"].values() for p in ps]
+        if candidates:
+            return "l3", f"$$MESSAGE_START$${random.choice(candidates)}$$MESSAGE_END$$"
+    else:
+        answer = replay_family_consumption(user_prompt, payloads)
+        if answer:
+            return "l4", answer
+
+    return "l4", fake_family_consumption_payload(user_prompt)
+
+
+class MockStats:
+    """
+    Thread-safe counters of a running mock server (requests per level, injected errors and token usage).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Accept bursts of concurrent connections
+
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self.stats = MockStats()
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    latency = 1.0           # Seconds before the (first chunk of the) answer (median for "lognormal")
+    latency_dist = "fixed"  # "fixed", "uniform" (latency +/- latency_sigma * latency) or "lognormal" (sigma latency_sigma)
+    latency_sigma = 0.5
+    tokens_per_second = 0.0 # Generation speed added on top of the latency (0 answers at once)
+    chunk_delay = 0.0       # Seconds between streamed chunks
+    trailing_chunks = 0     # Streamed chunks sent after $$MESSAGE_END$$, like a model that keeps generating
+    think_tokens = 0        # Approximate tokens of a <think>...</think> block before the answer, like a reasoning model
+    invalid_rate = 0.0      # Share of answers whose first member block only has 20 hours (to exercise validation.py)
+    error_rate = 0.0        # Share of requests answered with 429 (rate limited) and a Retry-After header
+    server_error_rate = 0.0 # Share of requests answered with 500
+    retry_after = 0.5       # Seconds sent in the Retry-After header of the 429 answers
+    chars_per_token = 4.0   # Characters per token of the reported usage
+    payloads = None         # load_demo_payloads() result; None uses the synthetic Level 4 payload only
+
+    def log_message(self, format, *args):
+        pass
+
+    def sample_latency(self):
+        if self.latency_dist == "uniform":
+            return max(0.0, random.uniform(self.latency * (1 - self.latency_sigma), self.latency * (1 + self.latency_sigma)))
+        if self.latency_dist == "lognormal" and self.latency > 0:
+            return random.lognormvariate(math.log(self.latency), self.latency_sigma)
+        return self.latency
+
+    def count_tokens(self, text):
+        return max(1, int(len(text) / self.chars_per_token))
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        messages = request.get("messages", [])
+        stats = self.server.stats
+
+        draw = random.random()
+        if draw < self.error_rate:
+            stats.add(requests=1, rate_limited=1)
+            self.send_json(429, {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit_error"}},
+                           {"Retry-After": str(self.retry_after)})
+            return
+        if draw < self.error_rate + self.server_error_rate:
+            stats.add(requests=1, server_errors=1)
+            self.send_json(500, {"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+            return
+
+        # Repair requests (validation.py) are answered from the original prompt, with every block
+        user_prompt = next((m["content"] for m in messages if m.get("role") == "user"), "")
+        is_repair = sum(m.get("role") == "user" for m in messages) > 1
+
+        level, content = build_answer(user_prompt, self.payloads or {"l1": [], "l2": [], "l3": {}, "l4": []})
+        if level == "l4" and not is_repair and random.random() < self.invalid_rate:
+            content = re.sub(r"\(20, .*?\]", "]", content, count=1)
+        if self.think_tokens:
+            content = "<think>" + " ".join(["hmm"] * int(self.think_tokens)) + "</think>\n" + content
+
+        prompt_tokens = sum(self.count_tokens(str(m.get("content", ""))) for m in messages)
+        completion_tokens = self.count_tokens(content)
+        stats.add(requests=1, **{level: 1}, prompt_tokens=prompt_tokens)
+
+        time.sleep(self.sample_latency())
+
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            self.stream_completion(request, content, prompt_tokens, include_usage)
+            return
+
+        if self.tokens_per_second:
+            time.sleep(completion_tokens / self.tokens_per_second)
+        stats.add(completion_tokens=completion_tokens)
+
+        self.send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def stream_completion(self, request, content, prompt_tokens, include_usage):
+        """
+        Sends the answer as server-sent events (chat.completion.chunk), followed by `trailing_chunks`
+        chunks of filler text. Stops quietly when the client closes the connection.
+        """
+        def event(delta, finish_reason=None, usage=None):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+            }
+            if usage is not None:
+                chunk["usage"] = usage
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        pieces = [content[i:i + 64] for i in range(0, len(content), 64)]
+        pieces += [" Note: the values above are typical estimates."] * self.trailing_chunks
+        completion_tokens = sum(self.count_tokens(piece) for piece in pieces)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        sent_tokens = 0
+        try:
+            self.wfile.write(event({"role": "assistant", "content": ""}))
+            for piece in pieces:
+                self.wfile.write(event({"content": piece}))
+                self.wfile.flush()
+                sent_tokens += self.count_tokens(piece)
+                delay = max(self.chunk_delay, self.count_tokens(piece) / self.tokens_per_second if self.tokens_per_second else 0)
+                if delay:
+                    time.sleep(delay)
+            self.wfile.write(event({}, finish_reason="stop"))
+            if include_usage:
+                self.wfile.write(event(None, usage={"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                                    "total_tokens": prompt_tokens + completion_tokens}))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped reading at $$MESSAGE_END$$
+        self.server.stats.add(completion_tokens=sent_tokens)
+        self.close_connection = True
+
+
+def make_mock_server(host="127.0.0.1", port=8000, demo_dir=DEMO_DIR, **options):
+    """
+    Creates (without starting) a mock server.
+
+    Parameters:
+    - host (str), port (int): Address to listen on (port 0 picks a free port).
+    - demo_dir (str): Folder of the demo logfiles to replay; None answers with the synthetic Level 4 payload only.
+    - options: Overrides of the MockChatHandler settings (latency, latency_dist, latency_sigma, tokens_per_second,
+      chunk_delay, trailing_chunks, think_tokens, invalid_rate, error_rate, server_error_rate, retry_after, chars_per_token).
+
+    Returns:
+    - MockServer: The server; its counters are in server.stats.
+    """
+    unknown = [name for name in options if name == "payloads" or not hasattr(MockChatHandler, name)]
+    if unknown:
+        raise TypeError(f"Unknown mock server options: {unknown}")
+    if options.get("latency_dist", "fixed") not in ("fixed", "uniform", "lognormal"):
+        raise ValueError(f"Unknown latency distribution: {options['latency_dist']}")
+
+    options["payloads"] = load_demo_payloads(demo_dir) if demo_dir else None
+    handler = type("ConfiguredMockChatHandler", (MockChatHandler,), options)
+    return MockServer((host, port), handler)
+
+
+def start_mock_server(host="127.0.0.1", port=8000, demo_dir=DEMO_DIR, **options):
+    """
+    Starts the mock server on a background thread (see make_mock_server for the options).
+
+    Returns:
+    - MockServer: The running server (call .shutdown() to stop it). Its base URL is
+      f"http://{host}:{server.server_port}/v1".
+    """
+    server = make_mock_server(host, port, demo_dir, **options)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake OpenAI-compatible chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--demo-dir", default=DEMO_DIR, help="Folder of the logfile_l*.txt files to replay.")
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds to wait before answering each request.")
+    parser.add_argument("--latency-dist", default="fixed", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Spread of the uniform/lognormal latency.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Generation speed added to the latency (0 disables).")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks.")
+    parser.add_argument("--trailing-chunks", type=int, default=0, help="Streamed chunks sent after $$MESSAGE_END$$.")
+    parser.add_argument("--think-tokens", type=int, default=0, help="Tokens of a <think> block before each answer.")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Share of Level 4 answers with an incomplete member block.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429 and Retry-After.")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share of requests answered with 500.")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After seconds of the 429 answers.")
+    parser.add_argument("--chars-per-token", type=float, default=4.0, help="Characters per token of the reported usage.")
+    args = parser.parse_args()
+
+    server = make_mock_server(args.host, args.port, args.demo_dir,
+                              latency=args.latency, latency_dist=args.latency_dist, latency_sigma=args.latency_sigma,
+                              tokens_per_second=args.tokens_per_second, chunk_delay=args.chunk_delay,
+                              trailing_chunks=args.trailing_chunks, think_tokens=args.think_tokens,
+                              invalid_rate=args.invalid_rate, error_rate=args.error_rate,
+                              server_error_rate=args.server_error_rate, retry_after=args.retry_after,
+                              chars_per_token=args.chars_per_token)
+    print(f"Mock OpenAI endpoint on http://{args.host}:{args.port}/v1 (latency {args.latency}s, {args.latency_dist})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served: {server.stats.snapshot()}")
@@ -0,0 +1,201 @@
+# Description: Tokenizer of the #Name#[(key, label, value), ...] payloads of the Level 2-4 answers (see prompts.py). Regular payloads are read
+# straight into NumPy arrays and one DataFrame per scenario, without the quoting regexes, ast.literal_eval and the per-member DataFrames.
+import re
+import numpy as np
+import pandas as pd
+
+BLOCK_PATTERN = re.compile(r"#([^#]+)#\[(.+?)\]", flags=re.DOTALL)
+
+# One tuple per payload type. Keys and labels accept what utils.parse_log_record would quote (no quotes or backslashes),
+# values are single number tokens; anything else is left to the literal_eval path.
+_HOUR = r"(0+|[1-9]\d*)"
+_NUMBER = r"([^,()\s]+)"
+TUPLE_PATTERNS = {
+    "family_consumption": re.compile(rf"\(\s*{_HOUR}\s*,\s*([^,()'\"\\]+)\s*,\s*{_NUMBER}\s*\)"),
+    "weather": re.compile(rf"\(\s*{_HOUR}\s*,\s*([^,'\"\\]+)\s*,\s*{_NUMBER}\s*\)"),
+    "weather_range": re.compile(rf"\(\s*([^,'\"\\]+)\s*,\s*{_NUMBER}\s*,\s*{_NUMBER}\s*\)"),
+}
+INT_PATTERN = re.compile(r"[-+]?(0+|[1-9]\d{0,17})")
+FLOAT_PATTERN = re.compile(r"[-+]?(\d+\.\d*|\.\d+|\d+(?=[eE]))([eE][-+]?\d+)?")
+
+# Columns of each payload type (first column, then the label / value columns of each parameter)
+PAYLOAD_COLUMNS = {
+    "family_consumption": ("Hour", "_Action", "_Consumption"),
+    "weather": ("Hour", "_Description", "_Value"),
+    "weather_range": ("Season", "_Min", "_Max"),
+}
+
+
+def rename_column(column):
+    # Same renaming as utils.parse_log_record
+    return column.replace("'s", "").replace("-s ", " ").replace("-s-", "-")
+
+
+def fill_numbers(tokens):
+    """
+    Returns the number tokens as an int64 array, or a float64 array if any of them is a float (the dtype pandas infers from
+    the literal_eval tuples). Returns None if a token is not a plain number.
+    """
+    values = np.empty(len(tokens), dtype=np.int64)
+    for i, token in enumerate(tokens):
+        if INT_PATTERN.fullmatch(token) is None:
+            break
+        values[i] = int(token)
+    else:
+        return values
+
+    values = np.empty(len(tokens), dtype=np.float64)
+    for i, token in enumerate(tokens):
+        if INT_PATTERN.fullmatch(token) is None and FLOAT_PATTERN.fullmatch(token) is None:
+            return None
+        values[i] = float(token)
+    return values
+
+
+def tokenize_block(raw_data, pattern, metadata_type):
+    """
+    Tokenizes the tuples of one #Name#[...] block.
+
+    Returns:
+    - tuple: (keys, labels, values) arrays (for weather_range: seasons, minimums, maximums), or None if the block is not a
+      comma-separated list of regular tuples.
+    """
+    keys, labels, values = [], [], []
+    position = 0
+    for match in pattern.finditer(raw_data):
+        separator = raw_data[position:match.start()].strip()
+        if separator != ("," if keys else ""):
+            return None
+        key, label, value = match.groups()
+        keys.append(key)
+        labels.append(label)
+        values.append(value)
+        position = match.end()
+
+    if not keys or raw_data[position:].strip() not in ("", ","):
+        return None
+
+    if metadata_type == "weather_range":
+        minimums, maximums = fill_numbers(labels), fill_numbers(values)
+        if minimums is None or maximums is None:
+            return None
+        return np.array(keys, dtype=object), minimums, maximums
+
+    values = fill_numbers(values)
+    if values is None:
+        return None
+    hours = np.empty(len(keys), dtype=np.int64)
+    for i, key in enumerate(keys):
+        hours[i] = int(key)
+    return hours, np.array(labels, dtype=object), values
+
+
+def tokenize_payload(content, metadata_type):
+    """
+    Splits a final message (output of utils.extract_final_message) into its #Name#[...] blocks.
+
+    Parameters:
+    - content (str): The message of one scenario.
+    - metadata_type (str): "family_consumption", "weather" or "weather_range".
+
+    Returns:
+    - list: (parameter, keys, labels, values) per block, or None if a block has to go through the literal_eval path.
+    """
+    pattern = TUPLE_PATTERNS[metadata_type]
+    blocks = []
+    for parameter, raw_data in BLOCK_PATTERN.findall(content):
+        arrays = tokenize_block(raw_data, pattern, metadata_type)
+        if arrays is None:
+            return None
+        blocks.append((parameter, *arrays))
+    return blocks or None
+
+
+def payload_frame(content, metadata, metadata_type):
+    """
+    Builds the scenario DataFrame of utils.parse_log_record (same columns, order and dtypes) from a tokenized message.
+
+    Returns:
+    - pd.DataFrame: The scenario, or None when the message is irregular (untokenizable blocks, members with different hours,
+      duplicated columns, ...), in which case the caller falls back to the literal_eval path.
+    """
+    if not content:
+        return None
+    blocks = tokenize_payload(content, metadata_type)
+    if blocks is None:
+        return None
+
+    if metadata_type == "family_consumption":
+        # Repeated members keep their first name, then get _01, _02, ...
+        member_count = {}
+        named_blocks = []
+        for parameter, *arrays in blocks:
+            if parameter in member_count:
+                member_count[parameter] += 1
+                parameter = f"{parameter}_{member_count[parameter]:02d}"
+            else:
+                member_count[parameter] = 0
+            named_blocks.append((parameter, *arrays))
+        blocks = named_blocks
+
+    key_column, label_suffix, value_suffix = PAYLOAD_COLUMNS[metadata_type]
+    columns = {}
+    for parameter, keys, labels, values in blocks:
+        parameter_safe = parameter.replace(" ", "-")
+        columns[f"{parameter_safe}{label_suffix}"] = labels
+        columns[f"{parameter_safe}{value_suffix}"] = values
+    if len(columns) != 2 * len(blocks):
+        return None
+
+    if metadata_type == "weather_range":
+        # Seasons are joined as before (outer merges, sorted seasons)
+        scenario_df = None
+        for parameter, keys, minimums, maximums in blocks:
+            parameter_safe = parameter.replace(" ", "-")
+            df = pd.DataFrame({"Season": keys, f"{parameter_safe}_Min": minimums, f"{parameter_safe}_Max": maximums})
+            scenario_df = df if scenario_df is None else scenario_df.merge(df, on="Season", how="outer")
+        scenario_df["Country"] = metadata["Country"]
+        scenario_df = scenario_df.reset_index()
+        metadata_columns = ["Country", "Season"]
+        data_columns = [column for column in scenario_df.columns if column not in metadata_columns]
+        if [rename_column(column) for column in data_columns] != data_columns:
+            return None
+        return scenario_df[metadata_columns + data_columns]
+
+    # Members are aligned on the hour only when they list the same hours, in the same order
+    hours = blocks[0][1]
+    if len(np.unique(hours)) != len(hours) or any(not np.array_equal(keys, hours) for _, keys, _, _ in blocks[1:]):
+        return None
+
+    if metadata_type == "family_consumption":
+        columns = {rename_column(column): values for column, values in columns.items()}
+        if len(columns) != 2 * len(blocks):
+            return None
+        metadata_columns = ["Country", "Family_Type", "Season", "Pattern", "Hour", "Total_Electricity_Usage"]
+    else:
+        metadata_columns = ["Country", "Season", "Hour"]
+
+    if any(column in metadata_columns or rename_column(column) != column for column in columns):
+        return None
+
+    frame_columns = {
+        "Country": metadata["Country"],
+        "Season": metadata["Season"],
+        "Hour": hours,
+    }
+    if metadata_type == "family_consumption":
+        # Row sums in column order, as DataFrame.sum(axis=1) (int64 when every member has integer consumptions)
+        consumptions = [values for column, values in columns.items() if "_Consumption" in column]
+        if any(values.dtype == object for values in consumptions):
+            return None
+        total = consumptions[0].astype(np.float64) if any(values.dtype == np.float64 for values in consumptions) else consumptions[0].copy()
+        for values in consumptions[1:]:
+            total = total + values
+        frame_columns.update({
+            "Family_Type": metadata["Family Type"],
+            "Pattern": metadata["Pattern"],
+            "Total_Electricity_Usage": np.round(total, 2),
+        })
+
+    frame_columns.update(columns)
+    return pd.DataFrame({column: frame_columns[column] for column in metadata_columns + list(columns)})
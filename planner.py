@@ -0,0 +1,365 @@
+# Description: Run planner. Counts the requests the current config would send at each level (pending work units only when
+# RESUME_RUN is True, packed as L4_SCENARIOS_PER_REQUEST says) and predicts their tokens, cost and wall time from the calls
+# recorded in past logfiles and event logs, per model and level. The wall time is simulated (Monte Carlo) on the concurrency
+# each level runs with, within the requests/min and tokens/min budgets.
+#
+# Usage:
+#   python planner.py
+#   python planner.py --model 4 --concurrency 16 --history demo other_experiment
+import os
+import re
+import json
+import glob
+import heapq
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from manifest import has_valid_output
+from dataset_store import raw_profile_path
+from log_index import open_log_index, index_lines
+from work_units import l1_work_units, l2_work_units, l3_country_work_units, l4_season_groups
+
+from config import model_dict, MODEL_PRICES, LLM_MODEL, LLM_MODEL_IDX, get_model_subname, get_model_paths
+from config import FOLDER_PATH, COUNTRIES, SEASONS, PATTERNS, NUMBER_FAMILIES_PER_COUNTRY
+from config import USE_TMY, RESUME_RUN, ASYNC_GENERATION, DAG_SCHEDULER, MAX_CONCURRENT_REQUESTS, L4_SCENARIOS_PER_REQUEST
+from config import RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_TOKENS_PER_MINUTE, LOG_INDEX
+
+SIMULATIONS = 1000          # Monte Carlo runs of each level
+MAX_LOGGED_LATENCY = 900.0  # Seconds; longer gaps between two logged blocks are breaks between runs, not calls
+LOGFILE_PATTERN = re.compile(r"logfile_l(\d)")
+
+
+def unit_scenarios(unit):
+    """
+    Returns the number of Level 4 scenarios answered by a logged call, from its work unit id
+    ("l4|USA|Nuclear Family|Winter-Weekday+Winter-Weekend") or its metadata key ("USA|Nuclear Family|[Winter|Winter]|[...]").
+    """
+    if not unit:
+        return 1
+    packed = re.search(r"\[([^\]]*)\]", unit)
+    if packed:
+        return len(packed.group(1).split("|"))
+    return unit.split("|")[-1].count("+") + 1
+
+
+def logged_calls(log_file):
+    """
+    Lists the calls of a logfile: the tokens of each metadata line and the time to the next logged block (the call
+    latency when the level ran sequentially).
+
+    Returns:
+    - list: One dict per call with "scenarios", "prompt_tokens", "completion_tokens" and "latency" (None if unknown).
+    """
+    if LOG_INDEX:
+        records = open_log_index(log_file).records
+    else:
+        with open(log_file, "rb") as file:
+            records = index_lines(file.read(), 0, 0, None)[0]
+
+    calls, block_calls, block_time = [], [], None
+    for record in records:
+        if record["role"] == "timestamp":
+            time = datetime.strptime(record["time"], "%Y-%m-%d_T%H-%M-%S")
+            if block_time is not None and len(block_calls) == 1:
+                latency = (time - block_time).total_seconds()
+                if 0 < latency <= MAX_LOGGED_LATENCY:
+                    block_calls[0]["latency"] = latency
+            block_calls, block_time = [], time
+        elif record["role"] == "metadata" and "prompt_tokens" in record:
+            call = {"scenarios": unit_scenarios(record.get("unit")), "prompt_tokens": record["prompt_tokens"],
+                    "completion_tokens": record["completion_tokens"], "latency": None}
+            calls.append(call)
+            block_calls.append(call)
+    return calls
+
+
+def event_calls(event_log):
+    """
+    Lists the calls of the "timing" records of an event log (measured latency, concurrent runs included), by level.
+
+    Returns:
+    - dict: Level (int) -> list of calls (same dicts as logged_calls).
+    """
+    calls = {}
+    with open(event_log, "r") as file:
+        for line in file:
+            if '"event": "timing"' not in line:
+                continue
+            record = json.loads(line)
+            unit = record.get("unit") or ""
+            if not re.match(r"l\d\|", unit):
+                continue
+            calls.setdefault(int(unit[1]), []).append({
+                "scenarios": unit_scenarios(unit), "prompt_tokens": record["prompt_tokens"],
+                "completion_tokens": record["completion_tokens"], "latency": record["latency"],
+                "usage_estimated": record.get("usage_estimated", False)})
+    return calls
+
+
+def load_history(folders):
+    """
+    Collects the recorded calls of every model experiment folder (<folder>/<model subname>/) of the given folders.
+    The timing records of events.jsonl are used for a level when they exist, the logfiles otherwise.
+
+    Returns:
+    - dict: (model, level) -> list of calls.
+    """
+    models = {get_model_subname(model): model for model in model_dict.values()}
+    history = {}
+    for folder in folders:
+        for exp_path in sorted(glob.glob(os.path.join(folder, "*", ""))):
+            model = models.get(os.path.basename(os.path.normpath(exp_path)))
+            if model is None:
+                continue
+
+            event_log = os.path.join(exp_path, "events.jsonl")
+            events = event_calls(event_log) if os.path.isfile(event_log) else {}
+            for level, calls in events.items():
+                history.setdefault((model, level), []).extend(calls)
+
+            for log_file in sorted(glob.glob(os.path.join(exp_path, "logfile_l*.txt"))):
+                level = int(LOGFILE_PATTERN.search(os.path.basename(log_file)).group(1))
+                if level not in events:
+                    history.setdefault((model, level), []).extend(logged_calls(log_file))
+    return history
+
+
+def count_families(country, resume):
+    """
+    Returns the family types of a country: those of its Level 1 output when it is reused, NUMBER_FAMILIES_PER_COUNTRY
+    unnamed families otherwise (second value True: estimated).
+    """
+    l1_unit = l1_work_units([country])[0]
+    if (USE_TMY or resume) and has_valid_output(l1_unit):
+        with open(l1_unit["output_file"], "r") as file:
+            return [family["Family Type"] for entry in json.load(file) for family in entry["Families"]], False
+    return [None] * NUMBER_FAMILIES_PER_COUNTRY, True
+
+
+def count_requests(model=LLM_MODEL):
+    """
+    Counts the requests of each level the current config would send for `model` (the L4 work units of another model
+    are those of LLM_MODEL, as in 01B_compare_models.py; its Levels 1-3 are not resumed).
+
+    Returns:
+    - dict: Level -> {"requests": list of scenarios per request, "units": work units, "done": units with a valid output,
+      "estimated": True if the family count is NUMBER_FAMILIES_PER_COUNTRY instead of the Level 1 output}.
+    """
+    resume = RESUME_RUN and model == LLM_MODEL
+    levels = {}
+
+    def add(level, units, estimated=False):
+        done = [unit for unit in units if resume and has_valid_output(unit)]
+        levels[level] = {"requests": [1] * (len(units) - len(done)), "units": len(units), "done": len(done), "estimated": estimated}
+
+    if not USE_TMY:
+        add(1, l1_work_units(COUNTRIES))
+        add(2, l2_work_units(COUNTRIES))
+        l3_units = []
+        for country in COUNTRIES:
+            try:
+                l3_units.extend(l3_country_work_units(country))
+            except FileNotFoundError:
+                # No Level 2 output yet: the seasons of the country are all pending
+                l3_units.extend({"level": 3, "output_file": None} for _ in SEASONS)
+        add(3, l3_units)
+
+    l4_output_dir = get_model_paths(model)["l4_output_dir"]
+    # The DAG scheduler packs within the season groups of its Level 4 tasks
+    season_groups = l4_season_groups(SEASONS, L4_SCENARIOS_PER_REQUEST) if DAG_SCHEDULER else [SEASONS]
+    requests, units, done, estimated = [], 0, 0, False
+    for country in COUNTRIES:
+        families, families_estimated = count_families(country, resume)
+        estimated = estimated or families_estimated
+        for family_type in families:
+            for seasons in season_groups:
+                pending = 0
+                for season in seasons:
+                    for day_pattern in PATTERNS:
+                        units += 1
+                        output_file = raw_profile_path(l4_output_dir, country, family_type, season, day_pattern) if family_type else None
+                        if RESUME_RUN and output_file and has_valid_output({"level": 4, "output_file": output_file}):
+                            done += 1
+                        else:
+                            pending += 1
+                # Same chunks as pack_l4_work_units
+                size = max(1, int(L4_SCENARIOS_PER_REQUEST))
+                requests += [min(size, pending - i) for i in range(0, pending, size)]
+    levels[4] = {"requests": requests, "units": units, "done": done, "estimated": estimated}
+    return levels
+
+
+def level_concurrency(level, concurrency):
+    # Levels 1-3 run one request at a time unless the DAG scheduler runs them
+    if DAG_SCHEDULER or (level == 4 and ASYNC_GENERATION):
+        return max(1, int(concurrency))
+    return 1
+
+
+def makespan(latencies, concurrency):
+    """
+    Wall time of requests started in order on `concurrency` slots (each request takes the first free slot).
+    """
+    if concurrency <= 1 or len(latencies) <= 1:
+        return float(np.sum(latencies))
+    slots = [0.0] * min(concurrency, len(latencies))
+    for latency in latencies:
+        heapq.heapreplace(slots, slots[0] + latency)
+    return max(slots)
+
+
+def simulate(requests, calls, concurrency, simulations=SIMULATIONS, rng=None, latency_calls=None):
+    """
+    Draws the tokens and latency of every request from the recorded calls and simulates the wall time of the level.
+    A request of k scenarios draws from the calls of k scenarios, or scales per-scenario values of the other calls.
+    The wall time is NaN when no call has a latency.
+
+    Parameters:
+    - requests (list): Scenarios per request.
+    - calls (list): Recorded calls (see logged_calls).
+    - concurrency (int): Requests in flight.
+    - simulations (int): Monte Carlo runs.
+    - rng (np.random.Generator): Random generator.
+    - latency_calls (list): Recorded calls to draw the latency from, when `calls` have none (default: `calls`).
+
+    Returns:
+    - dict: Arrays of the prompt tokens, completion tokens and wall time (seconds) of each run.
+    """
+    rng = rng or np.random.default_rng()
+    scenarios = np.array([call["scenarios"] for call in calls], dtype=float)
+    tokens = np.array([[call["prompt_tokens"], call["completion_tokens"]] for call in calls], dtype=float)
+    # Token counts approximated from the text length (streams stopped at $$MESSAGE_END$$) are only drawn without others
+    measured = np.array([not call.get("usage_estimated", False) for call in calls])
+    measured = measured if measured.any() else np.ones(len(calls), bool)
+
+    latency_calls = latency_calls or calls
+    latency_scenarios = np.array([call["scenarios"] for call in latency_calls], dtype=float)
+    timed = np.array([call["latency"] is not None for call in latency_calls])
+    latency = np.array([call["latency"] or 0.0 for call in latency_calls], dtype=float)
+
+    sizes = np.array(requests, dtype=float)
+    token_draws = np.zeros((simulations, len(requests), 2))
+    latency_draws = np.full((simulations, len(requests)), np.nan)
+    for size in np.unique(sizes):
+        columns = np.flatnonzero(sizes == size)
+        for values, pool, pool_scenarios, target in ((tokens, measured, scenarios, token_draws),
+                                                     (latency, timed, latency_scenarios, latency_draws)):
+            exact = pool & (pool_scenarios == size)
+            pool = np.flatnonzero(exact if exact.any() else pool)
+            if not len(pool):
+                continue
+            picks = pool[rng.integers(len(pool), size=(simulations, len(columns)))]
+            scale = size / pool_scenarios[picks]
+            target[:, columns] = values[picks] * (scale[..., None] if values.ndim == 2 else scale)
+
+    prompt_tokens, completion_tokens = token_draws[..., 0].sum(axis=1), token_draws[..., 1].sum(axis=1)
+    wall_time = np.array([makespan(draw, concurrency) for draw in latency_draws])
+
+    # The rate limiter budgets bound the wall time from below
+    if RATE_LIMIT_REQUESTS_PER_MINUTE:
+        wall_time = np.maximum(wall_time, 60 * (len(requests) - 1) / RATE_LIMIT_REQUESTS_PER_MINUTE)
+    if RATE_LIMIT_TOKENS_PER_MINUTE:
+        wall_time = np.maximum(wall_time, 60 * (prompt_tokens + completion_tokens) / RATE_LIMIT_TOKENS_PER_MINUTE)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "wall_time": wall_time}
+
+
+def plan(model=LLM_MODEL, concurrency=MAX_CONCURRENT_REQUESTS, folders=(FOLDER_PATH,), simulations=SIMULATIONS, seed=0):
+    """
+    Predicts the requests, tokens, cost and wall time of each level of the run.
+
+    Parameters:
+    - model (str): Model of the run (its own recorded calls are used first, those of the other models otherwise).
+    - concurrency (int): Requests in flight for the levels that run concurrently (see level_concurrency).
+    - folders (list): Experiment folders (FOLDER_PATH of past runs) holding the recorded calls.
+    - simulations (int): Monte Carlo runs.
+    - seed (int): Seed of the draws.
+
+    Returns:
+    - pd.DataFrame: One row per level and a total row (p50 / p90 of the simulated runs).
+    """
+    rng = np.random.default_rng(seed)
+    history = load_history(folders)
+    prices = MODEL_PRICES.get(model)
+
+    rows, runs = [], []
+    for level, counts in count_requests(model).items():
+        calls, source = history.get((model, level), []), model
+        level_calls = [call for (other, other_level), other_calls in history.items() if other_level == level for call in other_calls]
+        if not calls:
+            calls, source = level_calls, "other models"
+        # Latency of the other models (or levels) when no call of the history has one, e.g. a level run concurrently
+        latency_calls = None
+        if not any(call["latency"] is not None for call in calls):
+            latency_calls = ([call for call in level_calls if call["latency"] is not None] or
+                             [call for other_calls in history.values() for call in other_calls if call["latency"] is not None])
+
+        row = {
+            "Level": level,
+            "Units": counts["units"],
+            "Done": counts["done"],
+            "Requests": len(counts["requests"]),
+            "Concurrency": level_concurrency(level, concurrency),
+            "History": f"{len(calls)} calls ({source})" if calls else "none",
+        }
+        if counts["estimated"]:
+            row["Units"] = f"~{counts['units']}"
+
+        if calls and counts["requests"]:
+            run = simulate(counts["requests"], calls, row["Concurrency"], simulations, rng, latency_calls)
+            if latency_calls:
+                row["History"] += ", latency of other calls"
+            run["cost"] = (run["prompt_tokens"] * prices[0] + run["completion_tokens"] * prices[1]) / 1e6 if prices else np.full(simulations, np.nan)
+            runs.append(run)
+            row.update(summarize(run))
+        rows.append(row)
+
+    if runs:
+        total = {key: sum(run[key] for run in runs) for key in runs[0]}
+        # Levels without any timed call are left out of the total wall time
+        timed_runs = [run["wall_time"] for run in runs if not np.isnan(run["wall_time"]).all()]
+        total["wall_time"] = sum(timed_runs) if timed_runs else np.full(simulations, np.nan)
+        rows.append({"Level": "Total", "Units": "", "Done": "", "Requests": sum(row["Requests"] for row in rows),
+                     "Concurrency": "", "History": "", **summarize(total)})
+
+    return pd.DataFrame(rows)
+
+
+def summarize(run):
+    p50, p90 = (lambda values: np.percentile(values, 50)), (lambda values: np.percentile(values, 90))
+    return {
+        "Prompt_Tokens": int(p50(run["prompt_tokens"])),
+        "Completion_Tokens": int(p50(run["completion_tokens"])),
+        "Completion_Tokens_P90": int(p90(run["completion_tokens"])),
+        "Cost_USD": round(p50(run["cost"]), 2),
+        "Cost_USD_P90": round(p90(run["cost"]), 2),
+        "Wall_Time_min": round(p50(run["wall_time"]) / 60, 1),
+        "Wall_Time_min_P90": round(p90(run["wall_time"]) / 60, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=int, default=LLM_MODEL_IDX, help="model_dict index of the model to plan for.")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_REQUESTS, help="Requests in flight.")
+    parser.add_argument("--history", nargs="+", default=[FOLDER_PATH], help="Experiment folders of the past runs.")
+    parser.add_argument("--simulations", type=int, default=SIMULATIONS, help="Monte Carlo runs.")
+    parser.add_argument("--output", default=None, help="CSV file of the plan.")
+    args = parser.parse_args()
+
+    model = model_dict[int(args.model)]
+    table = plan(model, args.concurrency, args.history, args.simulations)
+
+    print()
+    print(110*"=")
+    print(f"Run plan: {model}, {len(COUNTRIES)} countries, up to {args.concurrency} concurrent requests"
+          f"{', DAG scheduler (levels overlap, the total is an upper bound)' if DAG_SCHEDULER else ''}")
+    print(110*"=")
+    print(table.to_string(index=False))
+    if table["Units"].astype(str).str.startswith("~").any():
+        print(f"~: the families of some countries have no Level 1 output yet, counted as NUMBER_FAMILIES_PER_COUNTRY = {NUMBER_FAMILIES_PER_COUNTRY}.")
+
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"Plan saved to {args.output}")
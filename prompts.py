@@ -261,4 +261,61 @@ temperature = [$Temperature$] (°C)
 humidity = [$Humidity$] (%)
 direct_solar_radiation = [$SolarRadiationDirect$] (W/m²)
 diffuse_solar_radiation = [$SolarRadiationDiffuse$] (W/m²)
-wind_speed = [$WindSpeed$] (m/s)"""
\ No newline at end of file
+wind_speed = [$WindSpeed$] (m/s)"""
+
+
+## Level 4 (packed): Several season/pattern scenarios of the same family in one request
+# ---------------------------------------------------------------------------------------------------------------------------------
+system_prompt_l4_packed = system_prompt_l4 + \
+"""
+
+**Multiple Scenarios**:
+The user may ask for several scenarios (season and day pattern pairs) of the same family in a single request. In that case, generate one \
+complete and independent daily pattern per scenario, following all the guidelines above for each of them, and return them in one single \
+message that starts with '$$MESSAGE_START$$' and ends with '$$MESSAGE_END$$'. Each scenario starts with '>>>SCENARIO>>>' followed by \
+[Season|Pattern] exactly as listed by the user, in the same order, and is structured as follows:
+
+$$MESSAGE_START$$\
+>>>SCENARIO>>>[Winter|Weekday]>>>MEMBERS>>>\
+#Father#[list of 24 tuples: (hour, action, consumption)]\
+...
+>>>HVAC>>>\
+#Heating#[list of 24 tuples: (hour, HVAC_action, consumption)]\
+#Cooling#[list of 24 tuples: (hour, HVAC_action, consumption)]\
+>>>SCENARIO>>>[Winter|Weekend]>>>MEMBERS>>>\
+#Father#[list of 24 tuples: (hour, action, consumption)]\
+...
+>>>HVAC>>>\
+#Heating#[list of 24 tuples: (hour, HVAC_action, consumption)]\
+#Cooling#[list of 24 tuples: (hour, HVAC_action, consumption)]\
+$$MESSAGE_END$$"""
+
+user_prompt_daily_l4_packed = \
+"""For a family in [$Country$] in the year of [$Year$], generate their daily electricity usage pattern for each of the following scenarios \
+[Season|Pattern]: [$Scenarios$].
+The selected family type is [$FamilyType$], which includes the following members: [$Members$] total of [$MembersNum$].
+
+The weather data for each selected season are provided for your reference below as csv lists of the 24-hourly values for the \
+temperature (°C), humidity (%), direct solar radiation (W/m²), diffuse solar radiation (W/m²), and wind speed (m/s) respectively. \
+Use them to determine the heating or cooling actions for the family members.
+[$WeatherBlocks$]"""
+
+user_prompt_l4_weather_block = \
+"""
+[$Season$]:
+hour = [$Hour$]
+temperature = [$Temperature$] (°C)
+humidity = [$Humidity$] (%)
+direct_solar_radiation = [$SolarRadiationDirect$] (W/m²)
+diffuse_solar_radiation = [$SolarRadiationDiffuse$] (W/m²)
+wind_speed = [$WindSpeed$] (m/s)"""
+
+
+## Level 4 (repair): Re-request of the scenarios or blocks that failed validation
+# ---------------------------------------------------------------------------------------------------------------------------------
+user_prompt_l4_repair = \
+"""Your answer did not pass validation:
+[$Errors$]
+
+Regenerate [$Request$], following the same rules and the same output format, starting with '$$MESSAGE_START$$' and ending with '$$MESSAGE_END$$'. \
+Each block must have exactly 24 hourly tuples (hours 0 to 23) with non-negative consumption values. Do not repeat the blocks that were not requested."""
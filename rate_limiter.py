@@ -0,0 +1,204 @@
+# Description: Client-side rate limiting (requests/min and tokens/min) and retries with exponential backoff and jitter.
+import ast
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import deque
+
+import openai
+
+from log_index import metadata_fields
+
+WINDOW_SECONDS = 60.0
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def backoff_delay(attempt, error=None, base_delay=1.0, max_delay=60.0):
+    """
+    Exponential backoff with full jitter: a random delay in [0, min(max_delay, base_delay * 2**attempt)].
+    A Retry-After header sent by the provider takes precedence.
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(max_delay, float(retry_after))
+        except ValueError:
+            pass
+
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+class TokenEstimator:
+    """
+    Estimates the total tokens (prompt + completion) of a request before it is sent.
+
+    The prompt tokens come from the observed tokens-per-character ratio, the completion tokens from the
+    90th percentile of past completions. History is kept per system prompt (i.e. per level) and can be
+    seeded from the usage logged in the metadata lines of existing logfiles.
+    """
+    def __init__(self, chars_per_token=4.0, default_completion_tokens=2048, max_history=500):
+        self.chars_per_token = chars_per_token
+        self.default_completion_tokens = default_completion_tokens
+        self.max_history = max_history
+        self.history = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(system_content):
+        return hashlib.sha1(system_content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _system_content(messages):
+        return next((m["content"] for m in messages if m.get("role") == "system"), "")
+
+    def add(self, system_content, prompt_chars, prompt_tokens, completion_tokens):
+        with self._lock:
+            history = self.history.setdefault(self._key(system_content), deque(maxlen=self.max_history))
+            history.append((int(prompt_chars), int(prompt_tokens), int(completion_tokens)))
+
+    def record(self, messages, prompt_tokens, completion_tokens):
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+        self.add(self._system_content(messages), prompt_chars, prompt_tokens, completion_tokens)
+
+    def estimate(self, messages):
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+
+        with self._lock:
+            history = list(self.history.get(self._key(self._system_content(messages)), []))
+            if not history:
+                history = [entry for entries in self.history.values() for entry in entries]
+
+        if not history:
+            return int(prompt_chars / self.chars_per_token) + self.default_completion_tokens
+
+        total_chars = sum(entry[0] for entry in history)
+        total_prompt_tokens = sum(entry[1] for entry in history)
+        tokens_per_char = total_prompt_tokens / total_chars if total_chars else 1 / self.chars_per_token
+
+        completions = sorted(entry[2] for entry in history)
+        completion_p90 = completions[min(len(completions) - 1, int(0.9 * len(completions)))]
+
+        return int(prompt_chars * tokens_per_char) + completion_p90
+
+    def seed_from_logs(self, log_files):
+        """
+        Loads the (prompt characters, prompt tokens, completion tokens) history of existing logfiles.
+        Each metadata line is paired with the system/user/guide messages logged before it in the same block.
+
+        Returns:
+        - int: Number of calls loaded.
+        """
+        loaded = 0
+        for log_file in log_files:
+            try:
+                with open(log_file, "r") as file:
+                    block = []
+                    for line in file:
+                        if line.startswith("-----"):
+                            block = []
+                        elif line.startswith("{'role': 'metadata'"):
+                            # Truncated lines and estimated usages ("~123") have no token counts and are skipped
+                            fields = metadata_fields(line.strip())
+                            if "prompt_tokens" not in fields or len(block) < 2:
+                                continue
+                            prompt_tokens, completion_tokens = fields["prompt_tokens"], fields["completion_tokens"]
+
+                            prompt_messages = block[:-1]  # The last message of the block is the answer
+                            system_content = next((c for role, c in prompt_messages if role == "system"), "")
+                            prompt_chars = sum(len(c) for _, c in prompt_messages)
+                            self.add(system_content, prompt_chars, prompt_tokens, completion_tokens)
+                            loaded += 1
+                        elif line.startswith(("{'role': 'system'", "{'role': 'user'", "{'role': 'assistant'")):
+                            # The repair requests logged with a Level 4 answer (repair_user, ...) are left out
+                            try:
+                                message = ast.literal_eval(line.strip())
+                            except (ValueError, SyntaxError):
+                                continue
+                            block.append((message.get("role"), str(message.get("content", ""))))
+            except OSError:
+                continue
+
+        return loaded
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter enforcing both requests/min and tokens/min.
+
+    Each request reserves its estimated tokens before it is sent; once the response arrives, the
+    reservation is settled with the actual usage. Works from threads (acquire) and coroutines (acquire_async).
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, estimator=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.estimator = estimator if estimator is not None else TokenEstimator()
+        self.window = deque()   # [timestamp, tokens] reservations of the last minute
+        self._lock = threading.Lock()
+
+    def _try_reserve(self, tokens):
+        """
+        Reserves the budget if available. Returns (reservation, 0) on success or (None, seconds to wait).
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0][0] >= WINDOW_SECONDS:
+                self.window.popleft()
+
+            waits = []
+            if self.requests_per_minute and len(self.window) >= self.requests_per_minute:
+                waits.append(self.window[0][0] + WINDOW_SECONDS - now)
+
+            if self.tokens_per_minute and self.window:
+                used_tokens = sum(entry[1] for entry in self.window)
+                if used_tokens + tokens > self.tokens_per_minute:
+                    # Wait until enough of the oldest reservations leave the window
+                    excess = used_tokens + tokens - self.tokens_per_minute
+                    for timestamp, entry_tokens in self.window:
+                        excess -= entry_tokens
+                        if excess <= 0:
+                            waits.append(timestamp + WINDOW_SECONDS - now)
+                            break
+                    else:
+                        waits.append(self.window[-1][0] + WINDOW_SECONDS - now)
+
+            if waits:
+                return None, max(0.01, max(waits))
+
+            reservation = [now, tokens]
+            self.window.append(reservation)
+            return reservation, 0
+
+    def acquire(self, tokens):
+        while True:
+            reservation, wait = self._try_reserve(tokens)
+            if reservation is not None:
+                return reservation
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        while True:
+            reservation, wait = self._try_reserve(tokens)
+            if reservation is not None:
+                return reservation
+            await asyncio.sleep(wait)
+
+    def settle(self, reservation, actual_tokens):
+        with self._lock:
+            reservation[1] = int(actual_tokens)
@@ -0,0 +1,193 @@
+# Description: Offline replay of recorded logfiles. Answers every LLM call of a run from the logged answers, keyed by work unit.
+import os
+import re
+import ast
+import time
+from glob import glob
+from datetime import datetime
+
+from llm import LLM
+from utils import extract_final_message
+from work_units import scenario_units
+
+LEVEL_METADATA = {
+    # level: names of the metadata fields of the work unit key (positions as in utils.log_parser)
+    1: [("Country", 1)],
+    2: [("Country", 1)],
+    3: [("Country", 1), ("Season", 3)],
+    4: [("Country", 1), ("Family Type", 3), ("Season", 7), ("Pattern", 9)],
+}
+LOGFILE_TIME_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}_T\d{2}-\d{2}-\d{2})")
+
+
+def recorded_logfiles(log_path, level, use_tmy=False):
+    """
+    Lists the logfiles of a level in `log_path`, oldest first, so that later answers of the same work unit win. Files are
+    ordered by the time in their name (logfile_l3_<time>, logfile_l3_partial_<time>), or by their modification time
+    (the base logfile). Level 4 logfiles are TMY or LLM depending on `use_tmy`.
+    """
+    def written(file):
+        match = LOGFILE_TIME_PATTERN.search(os.path.basename(file))
+        if match:
+            return datetime.strptime(match.group(1), "%Y-%m-%d_T%H-%M-%S")
+        return datetime.fromtimestamp(os.path.getmtime(file))
+
+    files = sorted(glob(os.path.join(log_path, f"logfile_l{level}*.txt")), key=written)
+    if level == 4:
+        files = [file for file in files if os.path.basename(file).startswith("logfile_l4_tmy") == use_tmy]
+    return files
+
+
+def replay_key(level, *parts):
+    # Logged family types have their quotes replaced (see log_l4_metadata)
+    return (f"l{level}",) + tuple(str(part).replace("'", "-") for part in parts)
+
+
+class ReplayLog:
+    """
+    Recorded answers of an experiment, keyed by work unit.
+
+    Each metadata line of the logfiles gives the work unit of the answer logged before it. Packed Level 4 answers
+    are split into their scenarios, so a run can replay them with another L4_SCENARIOS_PER_REQUEST.
+
+    The work units of a run are registered (register) before they are sent; a request is then matched to its
+    work unit through its user prompt, and answered with the recorded answer(s) of that unit.
+    """
+    def __init__(self, log_path, use_tmy=False, levels=None):
+        self.log_path = log_path
+        self.records = {}   # key -> (answer, usage_prompt_tokens, usage_completion_tokens, packed)
+        self.units = {}     # user prompt -> registered work unit
+        self.missing = []
+
+        for level in levels or LEVEL_METADATA:
+            for file_path in recorded_logfiles(log_path, level, use_tmy):
+                self.load(file_path, level)
+
+        print(f"Replay: {len(self.records)} recorded answers loaded from {log_path}")
+
+    def load(self, file_path, level):
+        with open(file_path, "r") as file:
+            answer = None
+            for line in file:
+                if line.startswith("{'role': 'assistant'"):
+                    answer = line
+                elif line.startswith("{'role': 'metadata'") and answer is not None:
+                    try:
+                        content = ast.literal_eval(answer.strip())["content"]
+                        metadata_parts = [part.strip() for part in ast.literal_eval(line.strip())["content"].split(",")]
+                    except (ValueError, SyntaxError, KeyError):
+                        answer = None
+                        continue
+                    self.add(level, metadata_parts, content)
+                    answer = None
+
+    def add(self, level, metadata_parts, answer):
+        fields = LEVEL_METADATA[level]
+        if len(metadata_parts) <= fields[-1][1] or "Usage_Prompt_Tokens" not in metadata_parts:
+            return
+
+        usage_prompt_tokens = metadata_parts[metadata_parts.index("Usage_Prompt_Tokens") + 1]
+        usage_completion_tokens = metadata_parts[metadata_parts.index("Usage_Completion_Tokens") + 1]
+        usage_prompt_tokens = int(usage_prompt_tokens) if usage_prompt_tokens.isdigit() else 0
+        usage_completion_tokens = int(usage_completion_tokens) if usage_completion_tokens.isdigit() else 0
+        values = [metadata_parts[position] for _, position in fields]
+
+        if level == 4 and values[2].startswith("["):
+            # Packed Level 4 answer: one record per scenario, with an even share of the usage
+            scenarios = list(zip(values[2].strip("[]").split("|"), values[3].strip("[]").split("|")))
+            content = extract_final_message(answer) or ""
+            sections = content.split(">>>SCENARIO>>>")[1:]
+            for season, day_pattern in scenarios:
+                section = next((section for section in sections
+                                if re.match(rf"\s*\[\s*{re.escape(season)}\s*\|\s*{re.escape(day_pattern)}\s*\]", section)), None)
+                if section is None:
+                    continue
+                section = section[section.index("]") + 1:].strip()
+                self.records[replay_key(4, values[0], values[1], season, day_pattern)] = (
+                    section, usage_prompt_tokens // len(scenarios), usage_completion_tokens // len(scenarios), True)
+        else:
+            self.records[replay_key(level, *values)] = (answer, usage_prompt_tokens, usage_completion_tokens, False)
+
+    def register(self, units):
+        """
+        Registers the work units about to be sent (packed or not). Returns them unchanged.
+        """
+        for unit in units:
+            self.units[unit["user_prompt"]] = unit
+        return units
+
+    def recorded_answer(self, unit):
+        """
+        Returns the recorded answer of a (not packed) work unit, or None.
+        """
+        record = self.records.get(self.record_key(unit))
+        return record[0] if record is not None else None
+
+    def record_key(self, unit):
+        if unit["level"] == 4:
+            return replay_key(4, unit["country"], unit["family_type"], unit["season"], unit["pattern"])
+        if unit["level"] == 3:
+            return replay_key(3, unit["country"], unit["season"])
+        return replay_key(unit["level"], unit["country"])
+
+    def answer(self, messages):
+        """
+        Returns the recorded (answer, usage_prompt_tokens, usage_completion_tokens) of a request. Requests of
+        unregistered or unrecorded work units get an empty answer (and are listed in self.missing).
+        """
+        user_prompt = next((m["content"] for m in messages if m.get("role") == "user"), None)
+        unit = self.units.get(user_prompt)
+        if unit is None:
+            self.missing.append(user_prompt[:80] if user_prompt else None)
+            print("Replay: request of an unregistered work unit, answered with an empty message.")
+            return "", 0, 0
+
+        keys = [self.record_key(scenario_unit) for scenario_unit in scenario_units(unit)]
+        records = [self.records.get(key) for key in keys]
+        missing = [key for key, record in zip(keys, records) if record is None]
+        if missing:
+            self.missing.extend(missing)
+            print(f"Replay: no recorded answer for {missing}")
+        records = [(key, record) for key, record in zip(keys, records) if record is not None]
+        if not records:
+            return "", 0, 0
+
+        usage_prompt_tokens = sum(record[1] for _, record in records)
+        usage_completion_tokens = sum(record[2] for _, record in records)
+
+        if "scenarios" in unit:
+            sections = "".join(f">>>SCENARIO>>>[{key[3]}|{key[4]}]{record[0] if record[3] else extract_final_message(record[0]) or ''}"
+                               for key, record in records)
+            return f"$$MESSAGE_START$${sections}$$MESSAGE_END$$", usage_prompt_tokens, usage_completion_tokens
+
+        answer, _, _, packed = records[0][1]
+        if packed:
+            answer = f"$$MESSAGE_START$${answer}$$MESSAGE_END$$"
+        return answer, usage_prompt_tokens, usage_completion_tokens
+
+    def report(self):
+        if self.missing:
+            print(f"Replay: {len(self.missing)} requests had no recorded answer.")
+
+
+class ReplayLLM(LLM):
+    """
+    Same interface as llm.LLM, answered from a ReplayLog instead of a client.
+    """
+    def __init__(self, modeltype, model, replay_log, metrics=None):
+        super().__init__(modeltype, model, client=None, metrics=metrics)
+        self.replay_log = replay_log
+
+    def getResponse(self, messages, temperature=0.2, max_tokens=4096*10, seed=None):
+        start = time.monotonic()
+        answer, usage_prompt_tokens, usage_completion_tokens = self.replay_log.answer(messages)
+        self._record_call(start, usage_prompt_tokens, usage_completion_tokens)
+        return answer, str(usage_prompt_tokens), str(usage_completion_tokens)
+
+
+class AsyncReplayLLM(ReplayLLM):
+    """
+    Same interface as llm.AsyncLLM, answered from a ReplayLog.
+    """
+    async def getResponse(self, messages, temperature=0.2, max_tokens=4096*10, seed=None):
+        return ReplayLLM.getResponse(self, messages, temperature, max_tokens, seed)
@@ -0,0 +1,196 @@
+# Description: Content-addressed on-disk cache of LLM responses, keyed on (model, messages, temperature, max_tokens).
+import os
+import json
+import time
+import hashlib
+import threading
+
+CACHE_MODES = ["use", "bypass", "refresh"]
+EVICTION_LOW_WATER = 0.9    # Share of max_size_mb kept by an eviction, so that it does not run again on the next put
+
+
+class ResponseCache:
+    """
+    Persistent response cache. Each entry is a small JSON file named after the SHA-256 of the request.
+
+    Modes:
+    - "use": serve hits from disk, store misses.
+    - "bypass": never read nor write the cache.
+    - "refresh": always call the API and overwrite the stored entry.
+
+    Entries created more than `max_age_days` ago are ignored and removed (hits do not extend their age); when the cache
+    grows beyond `max_size_mb`, the least recently used entries (file mtime, updated on every hit) are evicted first.
+    The folder is scanned once; the entries are then tracked in memory.
+    """
+    def __init__(self, cache_dir, mode="use", max_size_mb=512, max_age_days=30):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}. Choose from {CACHE_MODES}.")
+
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 24 * 3600 if max_age_days else None
+        self._lock = threading.Lock()
+        self.entries = {}       # path -> (mtime, size, created) of every entry, for the eviction
+        self.size_bytes = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.reset_stats()
+        self.scan()
+        self.evict()
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens):
+        request = json.dumps({
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """
+        Returns the cached entry (dict with "answer", "usage_prompt_tokens", "usage_completion_tokens" and
+        "usage_estimated", True when the usage was approximated from the text length) or None.
+        """
+        if self.mode != "use":
+            with self._lock:
+                self.misses += 1
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "r") as file:
+                entry = json.load(file)
+            stat = os.stat(path)
+            created = entry.get("created")
+            if self.is_expired(created, stat.st_mtime, time.time()):
+                self._remove(path)
+                raise FileNotFoundError(path)
+            os.utime(path)  # Mark as recently used for the LRU eviction
+            self._index(path, time.time(), stat.st_size, created)
+        except (OSError, ValueError, AttributeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.saved_prompt_tokens += int(entry.get("usage_prompt_tokens") or 0)
+            self.saved_completion_tokens += int(entry.get("usage_completion_tokens") or 0)
+        return entry
+
+    def put(self, key, answer, usage_prompt_tokens, usage_completion_tokens, usage_estimated=False):
+        if self.mode == "bypass":
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        created = time.time()
+        entry = {
+            "answer": answer,
+            "usage_prompt_tokens": usage_prompt_tokens,
+            "usage_completion_tokens": usage_completion_tokens,
+            "usage_estimated": usage_estimated,
+            "created": created,
+        }
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(entry, file)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        self._index(path, created, size, created)
+        if self.max_size_bytes is not None and self.size_bytes > self.max_size_bytes:
+            self.evict()
+
+    def remove(self, key):
+        # Drops an entry (e.g. an answer that failed validation), so that the request is sent again
+        self._remove(self._path(key))
+
+    def scan(self):
+        """
+        Builds the in-memory index of the entries (path -> mtime, size, creation time) with one os.scandir per
+        subfolder. The creation time is only read from the entries when `max_age_days` is set.
+        """
+        entries = {}
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir():
+                continue
+            for item in os.scandir(folder.path):
+                if not item.name.endswith(".json"):
+                    continue
+                try:
+                    stat = item.stat()
+                    created = None
+                    if self.max_age_seconds:
+                        with open(item.path, "r") as file:
+                            created = json.load(file).get("created")
+                except (OSError, ValueError, AttributeError):
+                    continue
+                entries[item.path] = (stat.st_mtime, stat.st_size, created)
+
+        with self._lock:
+            self.entries = entries
+            self.size_bytes = sum(size for _, size, _ in entries.values())
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the cache fits in EVICTION_LOW_WATER x
+        `max_size_mb`, so that the next puts do not evict again. Works on the in-memory index, without reading the folder.
+
+        Returns:
+        - int: The cache size in bytes after eviction.
+        """
+        now = time.time()
+        with self._lock:
+            entries = sorted((mtime, path, created) for path, (mtime, _, created) in self.entries.items())
+
+        if self.max_age_seconds:
+            for mtime, path, created in entries:
+                if self.is_expired(created, mtime, now):
+                    self._remove(path)
+
+        if self.max_size_bytes is not None and self.size_bytes > self.max_size_bytes:
+            target_bytes = self.max_size_bytes * EVICTION_LOW_WATER
+            for _, path, _ in entries:
+                if self.size_bytes <= target_bytes:
+                    break
+                self._remove(path)
+
+        return self.size_bytes
+
+    def is_expired(self, created, mtime, now):
+        # Age from the creation time of the entry (mtime only for entries written without it)
+        return bool(self.max_age_seconds) and now - float(created or mtime) > self.max_age_seconds
+
+    def _index(self, path, mtime, size, created):
+        with self._lock:
+            previous = self.entries.get(path)
+            self.size_bytes += size - (previous[1] if previous else 0)  # Overwritten entry (refresh mode)
+            self.entries[path] = (mtime, size, created)
+
+    def _remove(self, path):
+        with self._lock:
+            _, size, _ = self.entries.pop(path, (None, 0, None))
+            self.size_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+
+    def report(self, label=""):
+        print(f"Response cache {label} [{self.mode}]: {self.hits} hits, {self.misses} misses, "
+              f"saved {self.saved_prompt_tokens} prompt tokens and {self.saved_completion_tokens} completion tokens")
+        self.reset_stats()
@@ -0,0 +1,94 @@
+# Description: Dependency-aware async task scheduler (DAG), used to overlap the generation levels across countries.
+import time
+import asyncio
+
+
+class DependencyFailed(Exception):
+    pass
+
+
+class DagScheduler:
+    """
+    Runs async tasks as soon as all their dependencies have finished.
+
+    Each task is a coroutine function receiving the results of its dependencies (in the order they are listed).
+    The generation script adds the whole graph up front: per country, the Level 1 task, the Level 2 -> Level 3 chain of
+    the seasons (or the TMY task), and one Level 4 task per group of seasons (work_units.l4_season_groups), waiting for
+    the Level 1 task of its country and the weather of its seasons. Tasks added while the scheduler is running are awaited as well. When a task fails, the tasks
+    depending on it fail with DependencyFailed.
+
+    The scheduler does not limit concurrency itself: the tasks share a semaphore around their API calls, so that
+    tasks waiting on their inputs do not hold a request slot.
+    """
+    def __init__(self):
+        self.tasks = {}
+        self.timeline = {}  # task_id -> (start, end) in seconds since the scheduler started
+        self.start = None
+
+    def add(self, task_id, run, deps=()):
+        """
+        Adds a task. Its dependencies must already be added.
+
+        Parameters:
+        - task_id (tuple): Unique task id; the first element is the group used in the timeline report (e.g. "l3").
+        - run (callable): Coroutine function called with the results of the dependencies.
+        - deps (list): Ids of the tasks this task waits for.
+        """
+        if task_id in self.tasks:
+            raise ValueError(f"Task {task_id} already exists.")
+        missing = [dep for dep in deps if dep not in self.tasks]
+        if missing:
+            raise ValueError(f"Unknown dependencies of {task_id}: {missing}")
+
+        self.tasks[task_id] = asyncio.ensure_future(self._run_task(task_id, run, [self.tasks[dep] for dep in deps]))
+        return self.tasks[task_id]
+
+    async def _run_task(self, task_id, run, dep_tasks):
+        dep_results = []
+        for dep_task in dep_tasks:
+            try:
+                dep_results.append(await dep_task)
+            except Exception as e:
+                raise DependencyFailed(f"{task_id} skipped: a dependency failed ({e})") from e
+
+        task_start = time.monotonic() - self.start
+        try:
+            return await run(*dep_results)
+        finally:
+            self.timeline[task_id] = (task_start, time.monotonic() - self.start)
+
+    async def run(self, setup):
+        """
+        Calls `setup(scheduler)` to add the initial tasks, then waits until every task (including the ones added
+        on the way) has finished.
+
+        Returns:
+        - dict: task_id -> result, or the exception of failed tasks.
+        """
+        self.start = time.monotonic()
+        setup(self)
+
+        while True:
+            pending = [task for task in self.tasks.values() if not task.done()]
+            if not pending:
+                break
+            await asyncio.wait(pending)
+
+        return {task_id: task.exception() or task.result() for task_id, task in self.tasks.items()}
+
+    def report(self):
+        """
+        Prints, per task group, the number of tasks and when the first started and the last finished,
+        which shows how much the levels overlapped.
+        """
+        groups = {}
+        for task_id, (task_start, task_end) in self.timeline.items():
+            group = groups.setdefault(task_id[0], [0, task_start, task_end])
+            group[0] += 1
+            group[1] = min(group[1], task_start)
+            group[2] = max(group[2], task_end)
+
+        failed = sum(1 for task in self.tasks.values() if task.done() and task.exception() is not None)
+        for group, (count, first_start, last_end) in sorted(groups.items()):
+            print(f"  {group}: {count} tasks, from {first_start:.1f}s to {last_end:.1f}s")
+        print(f"  {len(self.tasks)} tasks, {failed} failed, total {max((end for _, end in self.timeline.values()), default=0):.1f}s")
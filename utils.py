@@ -4,12 +4,24 @@ import re
 import ast
 import sys
 import json
+import time
 import shutil
+import multiprocessing
 import pandas as pd
 from glob import glob
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
-from config import original_logfile_path, SEASONS, EXTRACT_COLUMNS
+from config import original_logfile_path, EVENT_LOG_PATH, SEASONS, EXTRACT_COLUMNS, LOG_PARSER_WORKERS, LOG_PARSER_CHUNK_SIZE, LOG_INDEX
+from log_writer import LogWriter, message_records
+from payload_parser import payload_frame
+from dataset_store import raw_profile_path, write_parquet
+from log_index import open_log_index
+from llm import usage_count, usage_estimated
+
+# All logfile and event log writes go through one background writer thread
+log_writer = LogWriter(EVENT_LOG_PATH)
 
 def system_prompt_msg(prompt):
     system_prompt = [{"role": "system", "content": prompt}]
@@ -30,24 +42,38 @@ def assistent_prompt_msg(prompt):
     return guidePrompt
 
 def logger_print(msg, file_name=original_logfile_path):
-    log_file = open(file_name, 'a')
-    sys.stdout = log_file
-    print(msg);
-
-    # Restore the default stdout
-    sys.stdout = sys.__stdout__
+    # Same line as print(msg) would write, without redirecting sys.stdout
+    log_writer.write(file_name, str(msg))
 
-    log_file.close()
+def logger(msg, file_name=original_logfile_path, unit=None):
+    """
+    Appends a message, or a list of messages (one per line), to a logfile as one block.
 
-def logger(msg, file_name=original_logfile_path):
-    log_file = open(file_name, 'a')
+    Parameters:
+    - msg (str or list): The line(s) to log.
+    - file_name (str): The logfile.
+    - unit (str): Optional work unit id; the logged messages and metadata lines are then also written
+      to the event log (EVENT_LOG_PATH) as JSON records.
+    """
     if isinstance(msg, list):
-        msg = "\n".join([str(item) for item in msg])  # Convert each item to string and join with newline
-    log_file.write(msg + "\n")
-    log_file.close()
+        text = "\n".join([str(item) for item in msg])  # Convert each item to string and join with newline
+    else:
+        text = msg
+    log_writer.write(file_name, text)
+
+    if unit is not None:
+        for role, content in message_records(msg):
+            log_writer.event(unit, role, content=content, log=file_name)
+
+def log_timing(unit, latency, usage_prompt_tokens, usage_completion_tokens):
+    # Event log record of one request (including its retries and repairs); usage_estimated marks approximated token counts
+    estimated = {"usage_estimated": True} if usage_estimated(usage_prompt_tokens, usage_completion_tokens) else {}
+    log_writer.event(unit, "timing", latency=round(latency, 3),
+                     prompt_tokens=usage_count(usage_prompt_tokens), completion_tokens=usage_count(usage_completion_tokens), **estimated)
 
 def copy_log_file(original_file_path, new_file_path, clear_original=False):
     new_file_path = f"{new_file_path}.txt"
+    log_writer.flush()
 
     try:        
         # Copy the contents of the original file to the new file
@@ -96,333 +122,501 @@ def extract_final_message(content):
 
     # If no valid message sequence is found, return None
     return None
+
+def split_packed_message(content, scenarios):
+    """
+    Splits a packed Level 4 message (>>>SCENARIO>>>[Season|Pattern]>>>MEMBERS>>>...>>>SCENARIO>>>...) into its scenarios.
+
+    Parameters:
+    - content (str): The final message (output of extract_final_message).
+    - scenarios (list): The requested (season, pattern) pairs, used when a scenario header is missing.
+
+    Returns:
+    - list: (season, pattern, content) tuples, where content is a regular single-scenario message.
+    """
+    scenario_messages = []
+    for i, section in enumerate(content.split(">>>SCENARIO>>>")[1:]):
+        match = re.match(r"\s*\[\s*([^|\]]+?)\s*\|\s*([^\]]+?)\s*\]", section)
+        if match:
+            season, day_pattern = match.groups()
+            section = section[match.end():]
+        elif i < len(scenarios):
+            season, day_pattern = scenarios[i]
+        else:
+            continue
+
+        if (season, day_pattern) not in scenarios:
+            print(f"Skipping scenario {season}|{day_pattern}: not requested.")
+            continue
+        scenario_messages.append((season, day_pattern, section.strip()))
+
+    return scenario_messages
 # :///////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
 
 # ### Log Parser
-def log_parser(file_path, output_dir, metadata_type):
+def pair_log_records(lines, counts=None):
+    """
+    Pairs each metadata line with the nearest preceding assistant line that is not paired yet, in a single pass.
+
+    Parameters:
+    - lines (iterable): The logged lines (a file object is read line by line).
+    - counts (dict): Optional dict receiving the number of "assistant" and "metadata" lines.
+
+    Yields:
+    - tuple: (metadata_index, metadata_line, assistant, previous_index), where assistant is the (index, line) of the
+      paired assistant line (None if there is none) and previous_index the index of the unpaired assistant line
+      before it (None if there is none).
+    """
+    if counts is None:
+        counts = {}
+    counts.update(assistant=0, metadata=0)
+
+    # Assistant lines waiting for their metadata, most recent last. Each block normally pairs its answer right away;
+    # only the assistant lines that are not answers (e.g. the Level 3 guide prompts) stay behind.
+    unpaired = []
+    for index, line in enumerate(lines):
+        if line.startswith("{'role': 'assistant'"):
+            counts["assistant"] += 1
+            unpaired.append((index, line.strip()))
+        elif line.startswith("{'role': 'metadata'"):
+            counts["metadata"] += 1
+            assistant = unpaired.pop() if unpaired else None
+            previous_index = unpaired[-1][0] if assistant is not None and unpaired else None
+            yield index, line.strip(), assistant, previous_index
+
+def log_parser(file_path, output_dir, metadata_type, workers=LOG_PARSER_WORKERS):
     file_path = f'{file_path}.txt'
+    log_writer.flush()
 
-    # Read the file
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
+    # Only the assistant and metadata lines are read, through the index of the logfile (or of its archive)
+    if LOG_INDEX:
+        return parse_log_lines(open_log_index(file_path).lines(("assistant", "metadata")), output_dir, metadata_type, workers)
 
-    # Extract all assistant and metadata lines in sequence
-    assistant_lines = [(i, line.strip()) for i, line in enumerate(lines) 
-                       if line.startswith("{'role': 'assistant'")]
-    
-    metadata_lines = [(i, line.strip()) for i, line in enumerate(lines) 
-                      if line.startswith("{'role': 'metadata'")]
+    # Stream the file: the lines are paired and parsed as they are read
+    with open(file_path, 'r') as file:
+        return parse_log_lines(file, output_dir, metadata_type, workers)
 
-    if not metadata_lines or not assistant_lines:
-        print("No metadata or assistant lines found.")
-        return
+def parse_log_lines(lines, output_dir, metadata_type, workers=1):
+    """
+    Parses logged lines (a whole logfile, or the block of a single request) and saves one CSV file per scenario.
+    See log_parser.
 
-    print(f"Extracted {len(metadata_lines)} metadata lines.")
-    print(f"Extracted {len(assistant_lines)} assistant lines.")
+    Parameters:
+    - lines (iterable): The logged lines.
+    - output_dir (str): Folder of the CSV files.
+    - metadata_type (str): "family_consumption", "weather" or "weather_range".
+    - workers (int): Number of processes; above 1, the records are parsed in parallel and a summary is printed
+      instead of the messages of every record.
 
+    Returns:
+    - list: The summary of every parsed record (see parse_log_record).
+    """
     # Ensure the output directory exists
     # output_dir = f"{output_dir}/raw_csv"
     os.makedirs(output_dir, exist_ok=True)
 
-    # Process assistant and metadata pairs
-    processed_indices = set()
-    for metadata_index, metadata_line in metadata_lines:
-        # Find the nearest assistant(s) before the metadata
-        assistant_candidates = [
-            (idx, line) for idx, line in assistant_lines if idx < metadata_index and idx not in processed_indices
-        ]
+    if workers > 1:
+        if fork_context() is not None:
+            return parse_log_lines_parallel(lines, output_dir, metadata_type, workers)
+        print("LOG_PARSER_WORKERS > 1 needs the 'fork' start method (not available here): parsing serially.")
 
+    # Process assistant and metadata pairs
+    counts = {}
+    summaries = []
+    for metadata_index, metadata_line, assistant, previous_index in pair_log_records(lines, counts):
         print(f"\n------------------ Processing assistant and metadata pair...")
-        if len(assistant_candidates) == 0:
+        if assistant is None:
             print(f"No assistant found for metadata at index {metadata_index}.")
+            summaries.append({"index": metadata_index, "outputs": [], "notes": [], "errors": ["No assistant found"]})
             continue
 
-        if len(assistant_candidates) == 1:
-            assistant_index, assistant_line = assistant_candidates[0]
+        assistant_index, assistant_line = assistant
+        if previous_index is None:
             print(f"Having single assistant at index {assistant_index}")
         else:
-            assistant_index, assistant_line = assistant_candidates[-1]
-            print(f"Having double assistant at indices {assistant_candidates[-2][0]} and {assistant_candidates[-1][0]}")
+            print(f"Having double assistant at indices {previous_index} and {assistant_index}")
 
-        # Mark this assistant as processed
-        processed_indices.add(assistant_index)
+        summary = parse_log_record(metadata_index, metadata_line, assistant_line, output_dir, metadata_type)
+        write_log_record(summary)
+        for message in summary["notes"]:
+            print(message)
+        summaries.append(summary)
 
-        try:
-            # Process metadata
-            metadata_dict = ast.literal_eval(metadata_line)
-            metadata_content = metadata_dict.get("content", "")
+    if not counts["metadata"] or not counts["assistant"]:
+        print("No metadata or assistant lines found.")
+    else:
+        print(f"Extracted {counts['metadata']} metadata lines.")
+        print(f"Extracted {counts['assistant']} assistant lines.")
+
+    return summaries
+
+def fork_context():
+    # The parser processes are forked: under spawn / forkserver every worker would re-import __main__, and the
+    # top-level scripts (01_get_multi_llm_response.py, 01B_compare_models.py) would re-run the whole pipeline
+    try:
+        return multiprocessing.get_context("fork")
+    except ValueError:
+        return None
+
+def parse_log_lines_parallel(lines, output_dir, metadata_type, workers):
+    """
+    Parallel mode of parse_log_lines: the paired records are parsed by a process pool, in batches so that
+    only a bounded number of records is held in memory, and their CSV files are written in record order
+    (so a scenario logged twice keeps its last answer, as in the serial mode).
+    """
+    start = time.monotonic()
+    batch_size = workers * LOG_PARSER_CHUNK_SIZE * 4
+    summaries = []
+    counts = {}
+
+    def flush(executor, batch):
+        indices, metadata_lines, assistant_lines = zip(*batch)
+        for summary in executor.map(parse_log_record, indices, metadata_lines, assistant_lines,
+                                    repeat(output_dir), repeat(metadata_type), chunksize=LOG_PARSER_CHUNK_SIZE):
+            write_log_record(summary)
+            summaries.append(summary)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=fork_context()) as executor:
+        batch = []
+        for metadata_index, metadata_line, assistant, _ in pair_log_records(lines, counts):
+            if assistant is None:
+                summaries.append({"index": metadata_index, "outputs": [], "notes": [], "errors": ["No assistant found"]})
+                continue
+            batch.append((metadata_index, metadata_line, assistant[1]))
+            if len(batch) >= batch_size:
+                flush(executor, batch)
+                batch = []
+        if batch:
+            flush(executor, batch)
+
+    report_log_records(summaries, f"Parsed {len(summaries)} records with {workers} processes in {time.monotonic() - start:.1f}s")
+    return summaries
+
+def report_log_records(summaries, header):
+    # Compact replacement of the per-record messages of the serial mode
+    failed = [summary for summary in summaries if not summary["outputs"]]
+    partial = [summary for summary in summaries if summary["outputs"] and summary["errors"]]
+    n_files = sum(len(summary["outputs"]) for summary in summaries)
+    print(f"{header}: {n_files} CSV files, "
+          f"{len(summaries) - len(failed) - len(partial)} ok, {len(partial)} with errors, {len(failed)} failed")
+    for summary in (failed + partial)[:20]:
+        print(f"  Record at line {summary['index']}: {summary['errors'][0]}")
+    if len(failed) + len(partial) > 20:
+        print(f"  ... and {len(failed) + len(partial) - 20} more")
+
+def parse_log_record(metadata_index, metadata_line, assistant_line, output_dir, metadata_type):
+    """
+    Parses one (metadata, assistant) pair of a logfile into the CSV text of its scenario(s), without writing them.
+
+    Returns:
+    - dict: {"index": metadata line index, "outputs": [(CSV path, CSV text) or (Parquet path, DataFrame), ...], "notes": [messages],
+      "errors": [error messages]}. Runs in the worker processes of the parallel mode, so it prints nothing.
+    """
+    summary = {"index": metadata_index, "outputs": [], "notes": [], "errors": []}
+
+    def note(message, error=False):
+        summary["notes"].append(message)
+        if error:
+            summary["errors"].append(message)
+
+    try:
+        # Process metadata
+        metadata_dict = ast.literal_eval(metadata_line)
+        metadata_content = metadata_dict.get("content", "")
+
+        # Handle metadata based on type
+        metadata_parts = [part.strip() for part in metadata_content.split(",")]
+
+        if metadata_type == "family_consumption":
+            if len(metadata_parts) < 10:
+                note(f"Skipping metadata at index {metadata_index}: insufficient metadata parts.", error=True)
+                return summary
+
+            metadata = {
+                "Country": metadata_parts[1].strip(),
+                "Family Type": metadata_parts[3].strip(),
+                "Members": metadata_parts[5].strip("[]").split("|"),
+                "Season": metadata_parts[7].strip(),
+                "Pattern": metadata_parts[9].strip(),
+            }
+            if metadata["Season"].startswith("["):
+                # Packed request (see log_metadata_packed)
+                metadata["Scenarios"] = list(zip(metadata["Season"].strip("[]").split("|"),
+                                                 metadata["Pattern"].strip("[]").split("|")))
+        elif metadata_type == "weather":
+            if len(metadata_parts) < 4:
+                note(f"Skipping metadata at index {metadata_index}: insufficient metadata parts.", error=True)
+                return summary
+
+            metadata = {
+                "Country": metadata_parts[1].strip(),
+                "Season": metadata_parts[3].strip(),
+            }
+        elif metadata_type == "weather_range":
+            if len(metadata_parts) < 2:
+                note(f"Skipping metadata at index {metadata_index}: insufficient metadata parts.", error=True)
+                return summary
+
+            metadata = {
+                "Country": metadata_parts[1].strip(),
+            }
+        else:
+            raise ValueError(f"Unknown metadata type: {metadata_type}")
+
+        # print(f"Processing metadata: {metadata}")
 
-            # Handle metadata based on type
-            metadata_parts = [part.strip() for part in metadata_content.split(",")]
+        # Process assistant line
+        assistant_line = assistant_line.replace("\n", "").strip()
+        assistant_dict = ast.literal_eval(assistant_line)
+        content = assistant_dict.get("content", "").strip()
+        
+        # Remove message delimiters
+        # content = content.replace("$$MESSAGE_START$$", "").replace("$$MESSAGE_END$$", "").strip()
+        # match = re.search(r"\$\$MESSAGE_START\$\$(.*?)\$\$MESSAGE_END\$\$", assistant_line, re.DOTALL)
+        # if match:
+        #     content = match.group(1).strip()  # Extract the content inside
+
+        content = extract_final_message(assistant_line)
+        if not content:
+            note("No valid message sequence found!", error=True)
+        # else:
+        #     print("Extracted Final Message:")
+        #     print(content)
+            
+        # A packed Level 4 response holds one message per (season, pattern) scenario
+        if metadata_type == "family_consumption" and "Scenarios" in metadata and content:
+            scenario_messages = []
+            for season, day_pattern, scenario_content in split_packed_message(content, metadata["Scenarios"]):
+                scenario_messages.append(({**metadata, "Season": season, "Pattern": day_pattern}, scenario_content))
+            note(f"Packed response with {len(scenario_messages)} of {len(metadata['Scenarios'])} scenarios")
+        else:
+            scenario_messages = [(metadata, content)]
+
+        for metadata, content in scenario_messages:
+            # Regular payloads are tokenized straight into arrays, the others go through literal_eval
+            scenario_df = payload_frame(content, metadata, metadata_type)
+            if scenario_df is None:
+                scenario_df = parse_payload_literal(content, metadata, metadata_type, note)
+            if scenario_df is None:
+                continue
 
+            # Generate a unique filename based on metadata
             if metadata_type == "family_consumption":
-                if len(metadata_parts) < 10:
-                    print(f"Skipping metadata at index {metadata_index}: insufficient metadata parts.")
-                    continue
-
-                metadata = {
-                    "Country": metadata_parts[1].strip(),
-                    "Family Type": metadata_parts[3].strip(),
-                    "Members": metadata_parts[5].strip("[]").split("|"),
-                    "Season": metadata_parts[7].strip(),
-                    "Pattern": metadata_parts[9].strip(),
-                }
+                output_file_path = raw_profile_path(output_dir, metadata['Country'], metadata['Family Type'], metadata['Season'], metadata['Pattern'])
             elif metadata_type == "weather":
-                if len(metadata_parts) < 4:
-                    print(f"Skipping metadata at index {metadata_index}: insufficient metadata parts.")
-                    continue
-
-                metadata = {
-                    "Country": metadata_parts[1].strip(),
-                    "Season": metadata_parts[3].strip(),
-                }
+                output_file_path = os.path.join(output_dir, f"{metadata['Country'].replace(' ', '-')}_{metadata['Season']}.csv")
             elif metadata_type == "weather_range":
-                if len(metadata_parts) < 2:
-                    print(f"Skipping metadata at index {metadata_index}: insufficient metadata parts.")
-                    continue
+                output_file_path = os.path.join(output_dir, f"{metadata['Country'].replace(' ', '-')}_weather_min_max.csv")
 
-                metadata = {
-                    "Country": metadata_parts[1].strip(),
-                }
+            # The CSV text (or the DataFrame of a Parquet partition) is written by the caller (in record order, also when parsing in parallel)
+            if output_file_path.endswith(".parquet"):
+                summary["outputs"].append((output_file_path, scenario_df))
             else:
-                raise ValueError(f"Unknown metadata type: {metadata_type}")
+                summary["outputs"].append((output_file_path, scenario_df.to_csv(index=False)))
+            note(f"  Data saved to {output_file_path}")
 
-            # print(f"Processing metadata: {metadata}")
+    except Exception as e:
+        note(f"Error processing assistant and metadata pair: {e}", error=True)
 
-            # Process assistant line
-            assistant_line = assistant_line.replace("\n", "").strip()
-            assistant_dict = ast.literal_eval(assistant_line)
-            content = assistant_dict.get("content", "").strip()
-            
-            # Remove message delimiters
-            # content = content.replace("$$MESSAGE_START$$", "").replace("$$MESSAGE_END$$", "").strip()
-            # match = re.search(r"\$\$MESSAGE_START\$\$(.*?)\$\$MESSAGE_END\$\$", assistant_line, re.DOTALL)
-            # if match:
-            #     content = match.group(1).strip()  # Extract the content inside
-
-            content = extract_final_message(assistant_line)
-            if not content:
-                print("No valid message sequence found!")
-            # else:
-            #     print("Extracted Final Message:")
-            #     print(content)
-                
-            # Preprocess the content based on metadata_type
-            if metadata_type == "family_consumption":
-                # Add quotes around the second parameter in the tuples
-                content = re.sub(r"\(\s*(\d+)\s*,\s*([^,()]+)\s*,", r"(\1,'\2',", content)  # ***
+    return summary
 
-            elif metadata_type == "weather":
-                # Add quotes around the second parameter in tuples
-                content = re.sub(r"\(\s*(\d+)\s*,\s*([^,']+)\s*,", r"(\1, '\2',", content)  # ***
+def parse_payload_literal(content, metadata, metadata_type, note):
+    """
+    Parses the message of one scenario by quoting its labels and evaluating each #Name#[...] block with ast.literal_eval.
+    Used for the messages that payload_parser.payload_frame cannot tokenize.
 
-            elif metadata_type == "weather_range":
-                # Add quotes around the first parameter in tuples
-                content = re.sub(r"\(\s*([^,']+)\s*,", r"('\1',", content)  # ***
+    Returns:
+    - pd.DataFrame: The scenario, or None (the reason is passed to `note`).
+    """
+    # Preprocess the content based on metadata_type
+    if metadata_type == "family_consumption":
+        # Add quotes around the second parameter in the tuples
+        content = re.sub(r"\(\s*(\d+)\s*,\s*([^,()]+)\s*,", r"(\1,'\2',", content)  # ***
 
-            # print(f"Processed content: {content}")  # Debugging
+    elif metadata_type == "weather":
+        # Add quotes around the second parameter in tuples
+        content = re.sub(r"\(\s*(\d+)\s*,\s*([^,']+)\s*,", r"(\1, '\2',", content)  # ***
 
-            # Extract parameter data and raw data using regex
-            parameter_data = re.findall(r"#([^#]+)#\[(.+?)\]", content, flags=re.DOTALL)
-            if not parameter_data:
-                raise ValueError("No valid parameter data found in the message.")
+    elif metadata_type == "weather_range":
+        # Add quotes around the first parameter in tuples
+        content = re.sub(r"\(\s*([^,']+)\s*,", r"('\1',", content)  # ***
 
-            if metadata_type == "family_consumption":
-                # Dictionary to track occurrences of each member
-                member_count = {}
-
-                updated_parameter_data = []
-                
-                for parameter, raw_data in parameter_data:
-                    if parameter in member_count:
-                        member_count[parameter] += 1
-                        new_parameter = f"{parameter}_{member_count[parameter]:02d}"  # Append _01, _02, etc.
-                    else:
-                        member_count[parameter] = 0  # First occurrence keeps original name
-                        new_parameter = parameter  # Keep first occurrence unchanged
-                    
-                    updated_parameter_data.append((new_parameter, raw_data))
-
-                # Use updated parameter data with unique names
-                parameter_data = updated_parameter_data
-                
-            # Parse the data for each parameter
-            parsed_data = []
-            for parameter, raw_data in parameter_data:
-                try:
-                    parameter_safe = parameter.replace(" ", "-")  # Replace spaces with dashes for column names
-
-                    # Safely parse the list of tuples
-                    if metadata_type == "family_consumption":
-                        columns = ["Hour", f"{parameter_safe}_Action", f"{parameter_safe}_Consumption"]
-                    elif metadata_type == "weather":
-                        columns = ["Hour", f"{parameter_safe}_Description", f"{parameter_safe}_Value"]
-                    elif metadata_type == "weather_range":
-                        columns = ["Season", f"{parameter_safe}_Min", f"{parameter_safe}_Max"]
-
-                    # print(f"Raw data for {parameter}: {raw_data}")  # Debugging
-                    tuples = ast.literal_eval(f"[{raw_data}]")
-                    df = pd.DataFrame(tuples, columns=columns)
-                    
-                    if metadata_type in ["family_consumption", "weather"]:
-                        df.set_index("Hour", inplace=True)
+    # print(f"Processed content: {content}")  # Debugging
 
-                    parsed_data.append(df)
+    # Extract parameter data and raw data using regex
+    parameter_data = re.findall(r"#([^#]+)#\[(.+?)\]", content, flags=re.DOTALL)
+    if not parameter_data:
+        note(f"Error processing assistant and metadata pair: No valid parameter data found in the message.", error=True)
+        return None
 
-                except Exception as e:
-                    print(f"Error parsing data for member {parameter}: {e}")
-                    print(f"Raw data for debugging: {raw_data}")
+    if metadata_type == "family_consumption":
+        # Dictionary to track occurrences of each member
+        member_count = {}
 
-            # Combine parsed DataFrames into a single DataFrame
-            if parsed_data:
-                
-                if metadata_type == "family_consumption":
-                    scenario_df = pd.concat(parsed_data, axis=1)
-                    scenario_df.rename(columns=lambda x: x.replace("'s", "").replace("-s ", " ").replace("-s-", "-"), inplace=True)
+        updated_parameter_data = []
+    
+        for parameter, raw_data in parameter_data:
+            if parameter in member_count:
+                member_count[parameter] += 1
+                new_parameter = f"{parameter}_{member_count[parameter]:02d}"  # Append _01, _02, etc.
+            else:
+                member_count[parameter] = 0  # First occurrence keeps original name
+                new_parameter = parameter  # Keep first occurrence unchanged
+        
+            updated_parameter_data.append((new_parameter, raw_data))
 
-                    scenario_df["Country"] = metadata["Country"]
-                    scenario_df["Season"] = metadata["Season"]
-                    scenario_df["Family_Type"] = metadata["Family Type"]
-                    scenario_df["Pattern"] = metadata["Pattern"]
-                    scenario_df['Total_Electricity_Usage'] = scenario_df.filter(like='_Consumption').sum(axis=1).round(2)
+        # Use updated parameter data with unique names
+        parameter_data = updated_parameter_data
+    
+    # Parse the data for each parameter
+    parsed_data = []
+    for parameter, raw_data in parameter_data:
+        try:
+            parameter_safe = parameter.replace(" ", "-")  # Replace spaces with dashes for column names
 
-                    metadata_columns = ["Country", "Family_Type", "Season", "Pattern", "Hour", "Total_Electricity_Usage"]
-                
-                elif metadata_type == "weather":
-                    scenario_df = pd.concat(parsed_data, axis=1)
-                    scenario_df["Country"] = metadata["Country"]
-                    scenario_df["Season"] = metadata["Season"]
+            # Safely parse the list of tuples
+            if metadata_type == "family_consumption":
+                columns = ["Hour", f"{parameter_safe}_Action", f"{parameter_safe}_Consumption"]
+            elif metadata_type == "weather":
+                columns = ["Hour", f"{parameter_safe}_Description", f"{parameter_safe}_Value"]
+            elif metadata_type == "weather_range":
+                columns = ["Season", f"{parameter_safe}_Min", f"{parameter_safe}_Max"]
 
-                    metadata_columns = ["Country", "Season", "Hour"]
-                
-                elif metadata_type == "weather_range":
-                    scenario_df = parsed_data[0]
-                    for df in parsed_data[1:]:
-                        scenario_df = scenario_df.merge(df, on="Season", how="outer")
-                    scenario_df["Country"] = metadata["Country"]
+            # print(f"Raw data for {parameter}: {raw_data}")  # Debugging
+            tuples = ast.literal_eval(f"[{raw_data}]")
+            df = pd.DataFrame(tuples, columns=columns)
+        
+            if metadata_type in ["family_consumption", "weather"]:
+                df.set_index("Hour", inplace=True)
 
-                    metadata_columns = ["Country", "Season"]
+            parsed_data.append(df)
 
-                scenario_df = scenario_df.reset_index()
+        except Exception as e:
+            note(f"Error parsing data for member {parameter}: {e}", error=True)
+            note(f"Raw data for debugging: {raw_data}")
 
-                data_columns = [col for col in scenario_df.columns if col not in metadata_columns]
+    # Combine parsed DataFrames into a single DataFrame
+    if parsed_data:
+    
+        if metadata_type == "family_consumption":
+            scenario_df = pd.concat(parsed_data, axis=1)
+            scenario_df.rename(columns=lambda x: x.replace("'s", "").replace("-s ", " ").replace("-s-", "-"), inplace=True)
 
-                # print(f"Data columns: {data_columns}")
-                data_columns = [k.replace("'s", "").replace("-s ", " ").replace("-s-", "-") for k in data_columns]
-                # print(f"Data columns: {data_columns}")
+            scenario_df["Country"] = metadata["Country"]
+            scenario_df["Season"] = metadata["Season"]
+            scenario_df["Family_Type"] = metadata["Family Type"]
+            scenario_df["Pattern"] = metadata["Pattern"]
+            scenario_df['Total_Electricity_Usage'] = scenario_df.filter(like='_Consumption').sum(axis=1).round(2)
 
-                scenario_df = scenario_df[metadata_columns + data_columns]
+            metadata_columns = ["Country", "Family_Type", "Season", "Pattern", "Hour", "Total_Electricity_Usage"]
+    
+        elif metadata_type == "weather":
+            scenario_df = pd.concat(parsed_data, axis=1)
+            scenario_df["Country"] = metadata["Country"]
+            scenario_df["Season"] = metadata["Season"]
 
-                # Generate a unique filename based on metadata
-                if metadata_type == "family_consumption":
-                    file_name = f"{metadata['Country'].replace(' ', '-')}_{metadata['Family Type'].replace(' ', '-')}_{metadata['Season']}_{metadata['Pattern']}.csv"
-                elif metadata_type == "weather":
-                    file_name = f"{metadata['Country'].replace(' ', '-')}_{metadata['Season']}.csv"
-                elif metadata_type == "weather_range":
-                    file_name = f"{metadata['Country'].replace(' ', '-')}_weather_min_max.csv"
+            metadata_columns = ["Country", "Season", "Hour"]
+    
+        elif metadata_type == "weather_range":
+            scenario_df = parsed_data[0]
+            for df in parsed_data[1:]:
+                scenario_df = scenario_df.merge(df, on="Season", how="outer")
+            scenario_df["Country"] = metadata["Country"]
 
-                output_file_path = os.path.join(output_dir, file_name)
+            metadata_columns = ["Country", "Season"]
 
-                # Save the DataFrame to a CSV file
-                scenario_df.to_csv(output_file_path, index=False)
-                print(f"  Data saved to {output_file_path}")
+        scenario_df = scenario_df.reset_index()
 
-            else:
-                print(f"No valid data parsed for this assistant line.")
+        data_columns = [col for col in scenario_df.columns if col not in metadata_columns]
 
-        except Exception as e:
-            print(f"Error processing assistant and metadata pair: {e}")
-        # break
+        # print(f"Data columns: {data_columns}")
+        data_columns = [k.replace("'s", "").replace("-s ", " ").replace("-s-", "-") for k in data_columns]
+        # print(f"Data columns: {data_columns}")
 
-def log_parser_json_org(file_path, output_dir, output_file_name):
-    # Read the file
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
+        scenario_df = scenario_df[metadata_columns + data_columns]
 
-    # Extract all assistant and metadata lines in sequence
-    assistant_lines = [(i, line.strip()) for i, line in enumerate(lines) 
-                       if line.startswith("{'role': 'assistant'")]
-    
-    metadata_lines = [(i, line.strip()) for i, line in enumerate(lines) 
-                      if line.startswith("{'role': 'metadata'")]
+        return scenario_df
 
-    if not metadata_lines or not assistant_lines:
-        print("No metadata or assistant lines found.")
-        return
+    note(f"No valid data parsed for this assistant line.", error=True)
+    return None
 
-    print(f"Extracted {len(metadata_lines)} metadata lines.")
-    print(f"Extracted {len(assistant_lines)} assistant lines.")
+def write_log_record(summary):
+    # Same bytes as DataFrame.to_csv(path)
+    for output_file_path, data in summary["outputs"]:
+        if isinstance(data, pd.DataFrame):
+            write_parquet(data, output_file_path)
+            continue
+        with open(output_file_path, "w", encoding="utf-8", newline="") as file:
+            file.write(data)
+
+def log_parser_json_org(file_path, output_dir, output_file_name):
+    log_writer.flush()
 
     # Ensure the output directory exists
     # output_dir = f"{output_dir}/raw_csv"
     os.makedirs(output_dir, exist_ok=True)
 
-    # Process assistant and metadata pairs
-    processed_indices = set()
-    for metadata_index, metadata_line in metadata_lines:
-        # Find the nearest assistant(s) before the metadata
-        assistant_candidates = [
-            (idx, line) for idx, line in assistant_lines if idx < metadata_index and idx not in processed_indices
-        ]
-
-        print(f"\n------------------ Processing assistant and metadata pair...")
-        if len(assistant_candidates) == 0:
-            print(f"No assistant found for metadata at index {metadata_index}.")
-            continue
-
-        if len(assistant_candidates) == 1:
-            assistant_index, assistant_line = assistant_candidates[0]
-            print(f"Having single assistant at index {assistant_index}")
-        else:
-            assistant_index, assistant_line = assistant_candidates[-1]
-            print(f"Having double assistant at indices {assistant_candidates[-2][0]} and {assistant_candidates[-1][0]}")
+    # Stream the file: each metadata line is paired with the nearest preceding unpaired assistant line
+    counts = {}
+    with open(file_path, 'r') as log_file:
+        for metadata_index, metadata_line, assistant, previous_index in pair_log_records(log_file, counts):
+            print(f"\n------------------ Processing assistant and metadata pair...")
+            if assistant is None:
+                print(f"No assistant found for metadata at index {metadata_index}.")
+                continue
 
-        # Mark this assistant as processed
-        processed_indices.add(assistant_index)
+            assistant_index, assistant_line = assistant
+            if previous_index is None:
+                print(f"Having single assistant at index {assistant_index}")
+            else:
+                print(f"Having double assistant at indices {previous_index} and {assistant_index}")
 
-        try:
-            # Process metadata
-            metadata_dict = ast.literal_eval(metadata_line)
-            metadata_content = metadata_dict.get("content", "")
+            try:
+                # Process metadata
+                metadata_dict = ast.literal_eval(metadata_line)
+                metadata_content = metadata_dict.get("content", "")
 
-            # Handle metadata based on type
-            metadata_parts = [part.strip() for part in metadata_content.split(",")]
+                # Handle metadata based on type
+                metadata_parts = [part.strip() for part in metadata_content.split(",")]
 
-            print(f"Processing metadata...")
+                print(f"Processing metadata...")
 
-            # Process assistant line
-            assistant_dict = ast.literal_eval(assistant_line)
-            content = assistant_dict.get("content", "").strip()
-            content = content.replace("```", "")
+                # Process assistant line
+                assistant_dict = ast.literal_eval(assistant_line)
+                content = assistant_dict.get("content", "").strip()
+                content = content.replace("```", "")
 
-            # Use regex to extract the JSON content between MESSAGE_START and MESSAGE_END
-            match = re.search(r"\$\$MESSAGE_START\$\$(.*?)\$\$MESSAGE_END\$\$", content, re.DOTALL)
+                # Use regex to extract the JSON content between MESSAGE_START and MESSAGE_END
+                match = re.search(r"\$\$MESSAGE_START\$\$(.*?)\$\$MESSAGE_END\$\$", content, re.DOTALL)
 
-            if match:
-                content_between = match.group(1).strip()  # Extract the content inside
-                # print("Extracted Content:")
-                # print(content_between)
+                if match:
+                    content_between = match.group(1).strip()  # Extract the content inside
+                    # print("Extracted Content:")
+                    # print(content_between)
 
-                # Parse the extracted content as JSON
-                try:
-                    content_parsed = json.loads(content_between)
+                    # Parse the extracted content as JSON
+                    try:
+                        content_parsed = json.loads(content_between)
 
-                    # Combine output directory and output file name
-                    output_file_path = os.path.join(output_dir, output_file_name)
+                        # Combine output directory and output file name
+                        output_file_path = os.path.join(output_dir, output_file_name)
                     
-                    # Save to a JSON file
-                    with open(output_file_path, "w") as file:
-                        json.dump(content_parsed, file, indent=2)
-                        print(f"  Data saved to {output_file_path}")
+                        # Save to a JSON file
+                        with open(output_file_path, "w") as file:
+                            json.dump(content_parsed, file, indent=2)
+                            print(f"  Data saved to {output_file_path}")
 
-                except json.JSONDecodeError as e:
-                    print(f"Failed to parse JSON: {e}")
+                    except json.JSONDecodeError as e:
+                        print(f"Failed to parse JSON: {e}")
 
-            else:
-                print("MESSAGE_START and MESSAGE_END markers not found!")
+                else:
+                    print("MESSAGE_START and MESSAGE_END markers not found!")
 
-        except Exception as e:
-            print(f"Error processing assistant and metadata pair: {e}")
+            except Exception as e:
+                print(f"Error processing assistant and metadata pair: {e}")
+
+    if not counts["metadata"] or not counts["assistant"]:
+        print("No metadata or assistant lines found.")
 
 def log_parser_json(file_path, output_dir, output_file_name_template):
     """
@@ -437,11 +631,21 @@ def log_parser_json(file_path, output_dir, output_file_name_template):
         List of file paths for the saved JSON files.
     """
     file_path = f'{file_path}.txt'
+    log_writer.flush()
+
+    if LOG_INDEX:
+        return parse_json_log_lines(open_log_index(file_path).lines(("assistant",)), output_dir, output_file_name_template)
 
     # Read the file
     with open(file_path, 'r') as file:
         lines = file.readlines()
 
+    return parse_json_log_lines(lines, output_dir, output_file_name_template)
+
+def parse_json_log_lines(lines, output_dir, output_file_name_template):
+    """
+    Parses logged Level 1 lines (a whole logfile, or the block of a single request). See log_parser_json.
+    """
     # Extract all assistant lines
     assistant_lines = [(i, line.strip()) for i, line in enumerate(lines) 
                        if line.startswith("{'role': 'assistant'")]
@@ -512,6 +716,21 @@ def log_metadata(country, family_type, members, season, day_pattern, usage_promp
     )
     logger(metadata_final)
 
+def log_metadata_packed(country, family_type, members, scenarios, usage_prompt_tokens, usage_completion_tokens, logger):
+    # Same layout as log_metadata, with the seasons and patterns of the packed scenarios as [a|b|...] lists
+    metadata_final = (
+        f"{{'role': 'metadata', 'content': '"
+        f"Country, {country}, "
+        f"Family Type, {family_type}, "
+        f"Members, [{'|'.join(members)}], "
+        f"Season, [{'|'.join(season for season, _ in scenarios)}], "
+        f"Pattern, [{'|'.join(day_pattern for _, day_pattern in scenarios)}],"
+        f"Usage_Prompt_Tokens, {usage_prompt_tokens}, "
+        f"Usage_Completion_Tokens, {usage_completion_tokens}"
+        f"'}}"
+    )
+    logger(metadata_final)
+
 def log_metadata_weather(country, season, usage_prompt_tokens, usage_completion_tokens, logger):
     metadata_final = (
         f"{{'role': 'metadata', 'content': '"
@@ -608,17 +827,22 @@ def process_log_timestamps(log_file):
     - total_duration (timedelta): Total duration between the first and last timestamps.
     - avg_duration (timedelta): Average duration between consecutive timestamps.
     """
-    # Read the log file
-    with open(log_file, 'r') as file:
-        lines = file.readlines()
-
-    # Extract timestamps
-    timestamp_pattern = r"\[(\d{4}-\d{2}-\d{2}_T\d{2}-\d{2}-\d{2})\]"
-    timestamps = []
-    for line in lines:
-        match = re.search(timestamp_pattern, line)
-        if match:
-            timestamps.append(datetime.strptime(match.group(1), "%Y-%m-%d_T%H-%M-%S"))
+    # The timestamps are in the index of the log file
+    if LOG_INDEX:
+        timestamps = [datetime.strptime(record["time"], "%Y-%m-%d_T%H-%M-%S")
+                      for record in open_log_index(log_file).select(("timestamp",))]
+    else:
+        # Read the log file
+        with open(log_file, 'r') as file:
+            lines = file.readlines()
+
+        # Extract timestamps
+        timestamp_pattern = r"\[(\d{4}-\d{2}-\d{2}_T\d{2}-\d{2}-\d{2})\]"
+        timestamps = []
+        for line in lines:
+            match = re.search(timestamp_pattern, line)
+            if match:
+                timestamps.append(datetime.strptime(match.group(1), "%Y-%m-%d_T%H-%M-%S"))
 
     # Ensure at least two timestamps
     if len(timestamps) < 2:
@@ -649,18 +873,23 @@ def process_log_tokens(log_file):
     - Total_Usage_Prompt_Tokens (int): Total number of tokens in the usage prompt.
     - Total_Usage_Completion_Tokens (int): Total number of tokens in the usage completion.
     """
-    # Read the log file
-    with open(log_file, 'r') as file:
-        lines = file.readlines()
-
-    # Extract tokens
-    # search for lines that start with {'role': 'metadata',
-    token_pattern = r"Usage_Prompt_Tokens, (\d+), Usage_Completion_Tokens, (\d+)"
-    tokens = []    
-    for line in lines:
-        match = re.search(token_pattern, line)
-        if match:
-            tokens.append((int(match.group(1)), int(match.group(2))))
+    # The token counts of the metadata lines are in the index of the log file
+    if LOG_INDEX:
+        tokens = [(record["prompt_tokens"], record["completion_tokens"])
+                  for record in open_log_index(log_file).select(("metadata",)) if "prompt_tokens" in record]
+    else:
+        # Read the log file
+        with open(log_file, 'r') as file:
+            lines = file.readlines()
+
+        # Extract tokens
+        # search for lines that start with {'role': 'metadata',
+        token_pattern = r"Usage_Prompt_Tokens, (\d+), Usage_Completion_Tokens, (\d+)"
+        tokens = []    
+        for line in lines:
+            match = re.search(token_pattern, line)
+            if match:
+                tokens.append((int(match.group(1)), int(match.group(2))))
 
     # Ensure at least one token pair
     if not tokens:
@@ -0,0 +1,266 @@
+# Description: Validates Level 4 answers as they arrive and re-requests only the scenarios or member blocks that fail.
+import re
+import ast
+
+from llm import total_usage
+from prompts import user_prompt_l4_repair
+from utils import extract_final_message, split_packed_message, assistent_prompt_msg, user_prompt_msg
+
+HOURS_PER_DAY = 24
+HVAC_BLOCKS = ["Heating", "Cooling"]
+
+
+def parse_blocks(content):
+    """
+    Returns the (name, raw tuples) blocks of a single-scenario message (#Name#[(hour, action, consumption), ...]),
+    in order. The raw text is kept as the model wrote it, so that it can be logged again unchanged.
+    """
+    return re.findall(r"#([^#]+)#\[(.+?)\]", content, flags=re.DOTALL)
+
+
+def validate_block(name, raw_data):
+    """
+    Checks one block: it parses (with the same quoting as utils.log_parser), has one tuple per hour 0-23
+    and no negative consumption.
+
+    Returns:
+    - str: The problem, or None if the block is valid.
+    """
+    quoted = re.sub(r"\(\s*(\d+)\s*,\s*([^,()]+)\s*,", r"(\1,'\2',", raw_data)
+    try:
+        tuples = ast.literal_eval(f"[{quoted}]")
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return f"#{name}# cannot be parsed"
+
+    if any(not isinstance(entry, tuple) or len(entry) != 3 for entry in tuples):
+        return f"#{name}# must only contain (hour, action, consumption) tuples"
+    if sorted(entry[0] for entry in tuples if isinstance(entry[0], int)) != list(range(HOURS_PER_DAY)):
+        return f"#{name}# has {len(tuples)} hourly tuples instead of one for each hour 0-23"
+    if any(not isinstance(entry[2], (int, float)) or entry[2] < 0 for entry in tuples):
+        return f"#{name}# has negative or non-numeric consumption values"
+
+    return None
+
+
+def parse_answer(answer, scenarios, packed):
+    """
+    Splits an answer into its scenarios and blocks.
+
+    Parameters:
+    - answer (str): The raw answer of the model.
+    - scenarios (list): The requested (season, pattern) pairs.
+    - packed (bool): True if the answer uses the packed >>>SCENARIO>>> format.
+
+    Returns:
+    - dict: {(season, pattern): [(name, raw tuples), ...]} for the scenarios found in the answer.
+    """
+    content = extract_final_message(answer)
+    if not content:
+        return {}
+
+    if packed:
+        sections = split_packed_message(content, scenarios)
+    else:
+        sections = [(scenarios[0][0], scenarios[0][1], content)]
+
+    return {(season, day_pattern): parse_blocks(section) for season, day_pattern, section in sections}
+
+
+def unit_scenarios(unit):
+    return unit["scenarios"] if "scenarios" in unit else [(unit["season"], unit["pattern"])]
+
+
+def validate_l4_answer(unit, answer):
+    """
+    Validates a Level 4 answer (packed or not) against the family of its work unit.
+
+    Returns:
+    - dict: {(season, pattern): {"errors": [...], "blocks": [names] or None}} for every failing scenario;
+      "blocks" lists the blocks to regenerate, None meaning the whole scenario. Empty if the answer is valid.
+    """
+    scenarios = unit_scenarios(unit)
+    parsed = parse_answer(answer, scenarios, "scenarios" in unit)
+
+    problems = {}
+    for scenario in scenarios:
+        if scenario not in parsed:
+            problems[scenario] = {"errors": ["the answer has no valid $$MESSAGE_START$$...$$MESSAGE_END$$ payload for this scenario"], "blocks": None}
+            continue
+
+        names = [name for name, _ in parsed[scenario]]
+        member_names = [name for name in names if name not in HVAC_BLOCKS]
+        if len(member_names) != len(unit["members"]) or len(set(member_names)) != len(member_names):
+            problems[scenario] = {"errors": [f"{len(member_names)} member blocks ({', '.join(member_names)}) "
+                                             f"instead of one per member ({', '.join(unit['members'])})"], "blocks": None}
+            continue
+
+        errors, blocks = [], []
+        for name, raw_data in parsed[scenario]:
+            error = validate_block(name, raw_data)
+            if error:
+                errors.append(error)
+                blocks.append(name)
+        for name in HVAC_BLOCKS:
+            if names.count(name) != 1:
+                errors.append(f"#{name}# must appear exactly once")
+                blocks.append(name)
+
+        if errors:
+            problems[scenario] = {"errors": errors, "blocks": list(dict.fromkeys(blocks))}
+
+    return problems
+
+
+def repair_messages(unit, answer, problems):
+    """
+    Builds the follow-up request asking only for the failing scenarios / blocks: the original conversation,
+    the previous answer and a user message listing the problems.
+    """
+    packed = "scenarios" in unit
+    errors = []
+    requests = []
+    for (season, day_pattern), problem in problems.items():
+        label = f"[{season}|{day_pattern}] " if packed else ""
+        errors.extend(f"- {label}{error}" for error in problem["errors"])
+
+        if problem["blocks"] is None:
+            requests.append(f"the complete scenario {label}".strip() if packed else "the complete answer")
+        else:
+            blocks = ", ".join(f"#{name}#" for name in problem["blocks"])
+            requests.append(f"only the blocks {blocks} of the scenario {label}".strip() if packed else f"only the blocks {blocks}")
+
+    request = "; ".join(requests)
+    if packed:
+        request += " (each scenario starting with >>>SCENARIO>>>[Season|Pattern])"
+
+    user_prompt = user_prompt_l4_repair.replace("[$Errors$]", "\n".join(errors)).replace("[$Request$]", request)
+    return unit["messages"] + assistent_prompt_msg(answer) + user_prompt_msg(user_prompt)
+
+
+def render_answer(parsed, packed):
+    sections = []
+    for (season, day_pattern), blocks in parsed.items():
+        member_blocks = "".join(f"#{name}#[{raw_data}]" for name, raw_data in blocks if name not in HVAC_BLOCKS)
+        hvac_blocks = "".join(f"#{name}#[{raw_data}]" for name, raw_data in blocks if name in HVAC_BLOCKS)
+        header = f">>>SCENARIO>>>[{season}|{day_pattern}]" if packed else ""
+        sections.append(f"{header}>>>MEMBERS>>>{member_blocks}>>>HVAC>>>{hvac_blocks}")
+
+    return "$$MESSAGE_START$$" + "".join(sections) + "$$MESSAGE_END$$"
+
+
+def merge_repair(unit, answer, repaired_answer, problems):
+    """
+    Replaces the failing scenarios / blocks of `answer` with the ones of `repaired_answer`.
+
+    Returns:
+    - str: The merged answer, in the regular output format.
+    """
+    packed = "scenarios" in unit
+    scenarios = unit_scenarios(unit)
+    parsed = parse_answer(answer, scenarios, packed)
+    repaired = parse_answer(repaired_answer, list(problems), packed)
+
+    merged = {}
+    for scenario in scenarios:
+        problem = problems.get(scenario)
+        if problem is None or scenario not in repaired:
+            if scenario in parsed:
+                merged[scenario] = parsed[scenario]
+        elif problem["blocks"] is None or scenario not in parsed:
+            merged[scenario] = repaired[scenario]
+        else:
+            blocks = list(parsed[scenario])
+            for name, raw_data in repaired[scenario]:
+                if name not in problem["blocks"]:
+                    continue
+                positions = [i for i, (block_name, _) in enumerate(blocks) if block_name == name]
+                if positions:
+                    blocks[positions[0]] = (name, raw_data)
+                    blocks = [block for i, block in enumerate(blocks) if i not in positions[1:]]
+                else:
+                    blocks.append((name, raw_data))
+            merged[scenario] = blocks
+
+    return render_answer(merged, packed) if merged else repaired_answer
+
+
+def report_problems(unit, problems, attempt, max_repairs):
+    for (season, day_pattern), problem in problems.items():
+        target = "whole scenario" if problem["blocks"] is None else ", ".join(problem["blocks"])
+        print(f"  Invalid answer for {unit['country']} | {unit['family_type']} | {season} | {day_pattern} "
+              f"(repair {attempt + 1}/{max_repairs}: {target}): {'; '.join(problem['errors'])}")
+
+
+def validation_steps(unit, max_repairs):
+    """
+    Validate/repair loop of a Level 4 work unit, shared by the sync and async callers: a generator yielding the messages
+    of each request and receiving its (answer, usage_prompt_tokens, usage_completion_tokens). Failing scenarios or member
+    blocks are re-requested (up to `max_repairs` times) and merged into the answer.
+
+    Returns (as the StopIteration value):
+    - tuple: (answer, usage_prompt_tokens, usage_completion_tokens, problems, exchanges): the token counts covering all
+      requests, the problems of the scenarios still invalid after the repairs (see validate_l4_answer; empty if the answer
+      is valid) and one dict per request ("prompt": the repair prompt, None for the first request, "answer": the raw
+      answer, "usage_prompt_tokens", "usage_completion_tokens").
+    """
+    answer, usage_prompt_tokens, usage_completion_tokens = yield unit["messages"]
+    exchanges = [{"prompt": None, "answer": answer, "usage_prompt_tokens": usage_prompt_tokens,
+                  "usage_completion_tokens": usage_completion_tokens}]
+
+    for attempt in range(max_repairs + 1):
+        problems = validate_l4_answer(unit, answer)
+        if not problems:
+            break
+        if attempt == max_repairs:
+            print(f"  Answer still invalid after {max_repairs} repairs: {unit['country']} | {unit['family_type']} | {list(problems)}")
+            break
+
+        report_problems(unit, problems, attempt, max_repairs)
+        messages = repair_messages(unit, answer, problems)
+        repaired_answer, repair_prompt_tokens, repair_completion_tokens = yield messages
+        answer = merge_repair(unit, answer, repaired_answer, problems)
+        exchanges.append({"prompt": messages[-1]["content"], "answer": repaired_answer,
+                          "usage_prompt_tokens": repair_prompt_tokens, "usage_completion_tokens": repair_completion_tokens})
+
+    usages = [(exchange["usage_prompt_tokens"], exchange["usage_completion_tokens"]) for exchange in exchanges]
+    return (answer, *total_usage(usages), problems, exchanges)
+
+
+def get_valid_l4_response(llm, unit, max_repairs=2):
+    """
+    Sends a Level 4 work unit and validates the answer right away (see validation_steps). The cached responses of an
+    answer that is still invalid are removed.
+
+    Returns:
+    - tuple: (answer, usage_prompt_tokens, usage_completion_tokens, problems, exchanges), see validation_steps.
+    """
+    steps = validation_steps(unit, max_repairs)
+    sent = [next(steps)]
+    try:
+        while True:
+            sent.append(steps.send(llm.getResponse(sent[-1])))
+    except StopIteration as done:
+        result = done.value
+
+    if result[3]:
+        for messages in sent:
+            llm.forget(messages)
+    return result
+
+
+async def get_valid_l4_response_async(async_llm, unit, max_repairs=2):
+    """
+    Async version of get_valid_l4_response (for llm.AsyncLLM).
+    """
+    steps = validation_steps(unit, max_repairs)
+    sent = [next(steps)]
+    try:
+        while True:
+            sent.append(steps.send(await async_llm.getResponse(sent[-1])))
+    except StopIteration as done:
+        result = done.value
+
+    if result[3]:
+        for messages in sent:
+            async_llm.forget(messages)
+    return result
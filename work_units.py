@@ -0,0 +1,305 @@
+# Description: Builds the per-request work units (prompt + metadata) of the generation levels.
+import os
+import json
+import pandas as pd
+
+from prompts import system_prompt_l1, user_prompt_family_types_l1, \
+                    system_prompt_l2, user_prompt_l2, \
+                    system_prompt_l3, user_prompt_daily_l3, \
+                    system_prompt_l4, user_prompt_daily_l4, \
+                    system_prompt_l4_packed, user_prompt_daily_l4_packed, user_prompt_l4_weather_block
+from utils import system_prompt_msg, user_prompt_msg
+from dataset_store import raw_profile_path
+
+from config import YEAR, SEASONS, PATTERNS, JSON_FILE_PATH
+from config import l2_output_dir, l3_output_dir, l4_output_dir
+
+
+def make_work_unit(key, system_prompt, user_prompt, output_file, **metadata):
+    """
+    Creates a work unit: one request with its prompts, ready-to-send messages, the file its parsed
+    output is written to, and the scenario metadata (country, season, ...).
+    """
+    return {
+        "key": key,
+        "level": int(key[0][1:]),
+        **metadata,
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "messages": system_prompt_msg(system_prompt) + user_prompt_msg(user_prompt),
+        "output_file": output_file,
+    }
+
+
+def l1_work_units(countries):
+    """
+    Lists the Level 1 requests (family types), one per country.
+    """
+    work_units = []
+    for country in countries:
+        user_prompt = user_prompt_family_types_l1.replace("$COUNTRY$", country)
+        output_file = JSON_FILE_PATH.replace("$COUNTRY$", country.replace(" ", "-"))
+        work_units.append(make_work_unit(("l1", country), system_prompt_l1, user_prompt, output_file, country=country))
+
+    return work_units
+
+
+def l2_work_units(countries):
+    """
+    Lists the Level 2 requests (weather min-max ranges), one per country.
+    """
+    work_units = []
+    for country in countries:
+        user_prompt = user_prompt_l2.replace("$Country$", country)
+        user_prompt = user_prompt.replace("[$Year$]", str(YEAR))
+        output_file = os.path.join(l2_output_dir, f"{country.replace(' ', '-')}_weather_min_max.csv")
+        work_units.append(make_work_unit(("l2", country), system_prompt_l2, user_prompt, output_file, country=country))
+
+    return work_units
+
+
+def build_l3_user_prompt(country, season, weather_data):
+    """
+    Fills the Level 3 user prompt template with the Level 2 min-max ranges of one season.
+
+    Parameters:
+    - country (str): Country name.
+    - season (str): Season name.
+    - weather_data (pd.DataFrame): The Level 2 output of the country (<COUNTRY>_weather_min_max.csv).
+
+    Returns:
+    - str: The user prompt.
+    """
+    season_ranges = weather_data.loc[weather_data["Season"] == season]
+
+    user_prompt_indexed = user_prompt_daily_l3
+    user_prompt_indexed = user_prompt_indexed.replace("[$Country$]", country)
+    user_prompt_indexed = user_prompt_indexed.replace("[$Season$]", season)
+    user_prompt_indexed = user_prompt_indexed.replace("[$Year$]", str(YEAR))
+    for parameter in ["Temperature", "Humidity", "SolRad-Diffuse", "SolRad-Direct", "Wind-Speed"]:
+        for bound in ["Min", "Max"]:
+            column = f"{parameter}_{bound}"
+            user_prompt_indexed = user_prompt_indexed.replace(f"[${column}$]", str(season_ranges[column].values[0]))
+
+    return user_prompt_indexed
+
+
+def l3_country_work_units(country, l2_output_dir=l2_output_dir):
+    """
+    Lists the Level 3 requests of one country, one per season in chaining order. Needs the country's Level 2 output.
+    """
+    weather_file = f"{l2_output_dir}/{country.replace(' ', '-')}_weather_min_max.csv"
+    weather_data = pd.read_csv(weather_file)
+
+    work_units = []
+    for season in SEASONS:
+        user_prompt = build_l3_user_prompt(country, season, weather_data)
+        output_file = os.path.join(l3_output_dir, f"{country.replace(' ', '-')}_{season}.csv")
+        work_units.append(make_work_unit(("l3", country, season), system_prompt_l3, user_prompt, output_file,
+                                         country=country, season=season))
+
+    return work_units
+
+
+def l3_work_units(family_types_json, l2_output_dir=l2_output_dir):
+    """
+    Lists the Level 3 requests (daily weather), one per country and season, in chaining order:
+    within a country, each season is sent with the previous season's answer as guide.
+    """
+    work_units = []
+    for country_data in family_types_json:
+        work_units.extend(l3_country_work_units(country_data['Country'], l2_output_dir))
+
+    return work_units
+
+
+def load_family_types_json(l1_output_dir):
+    """
+    Loads and concatenates the Level 1 family type files (family_types_<COUNTRY>.json).
+
+    Parameters:
+    - l1_output_dir (str): Folder holding the Level 1 JSON files.
+
+    Returns:
+    - list: The country entries of all family type files.
+    """
+    family_json_files = [f for f in os.listdir(l1_output_dir) if f.endswith(".json") and not f.startswith("selected_")]
+    print(family_json_files)
+
+    family_types_json = []
+    for output_file in family_json_files:
+        full_file_path = os.path.join(l1_output_dir, output_file)
+        with open(full_file_path, "r") as file:
+            family_types_json.extend(json.load(file))
+
+    return family_types_json
+
+
+def build_l4_user_prompt(country, family, season, day_pattern, weather_data):
+    """
+    Fills the Level 4 user prompt template for one (country, family, season, pattern) scenario.
+
+    Parameters:
+    - country (str): Country name.
+    - family (dict): Family entry of the Level 1 JSON ("Family Type" and "Members").
+    - season (str): Season name.
+    - day_pattern (str): "Weekday" or "Weekend".
+    - weather_data (dict): Output of utils.process_all_csv_files.
+
+    Returns:
+    - str: The user prompt.
+    """
+    season_weather = weather_data[country][season]
+
+    user_prompt_indexed = user_prompt_daily_l4
+    user_prompt_indexed = user_prompt_indexed.replace("[$Country$]", country)
+    user_prompt_indexed = user_prompt_indexed.replace("[$Year$]", str(YEAR))
+    user_prompt_indexed = user_prompt_indexed.replace("[$FamilyType$]", family['Family Type'])
+    user_prompt_indexed = user_prompt_indexed.replace("[$Members$]", ", ".join(family['Members']))
+    user_prompt_indexed = user_prompt_indexed.replace("[$MembersNum$]", str(len(family['Members'])))
+    user_prompt_indexed = user_prompt_indexed.replace("[$Pattern$]", day_pattern)
+    user_prompt_indexed = user_prompt_indexed.replace("[$Season$]", season)
+    user_prompt_indexed = user_prompt_indexed.replace("[$Hour$]", str(season_weather["Hour"]))
+    user_prompt_indexed = user_prompt_indexed.replace("[$Temperature$]", str(season_weather["Temperature_Value"]))
+    user_prompt_indexed = user_prompt_indexed.replace("[$Humidity$]", str(season_weather["Humidity_Value"]))
+    user_prompt_indexed = user_prompt_indexed.replace("[$SolarRadiationDirect$]", str(season_weather["SolRad-Direct_Value"]))
+    user_prompt_indexed = user_prompt_indexed.replace("[$SolarRadiationDiffuse$]", str(season_weather["SolRad-Diffuse_Value"]))
+    user_prompt_indexed = user_prompt_indexed.replace("[$WindSpeed$]", str(season_weather["Wind-Speed_Value"]))
+
+    return user_prompt_indexed
+
+
+def l4_work_units(family_types_json, weather_data, l4_output_dir=l4_output_dir, seasons=SEASONS):
+    """
+    Lists every Level 4 request (country x family x season x pattern) as a work unit.
+
+    Each unit carries the scenario metadata ("country", "family_type", "members", "season", "pattern").
+
+    Parameters:
+    - family_types_json (list): Country entries of the Level 1 JSON files.
+    - weather_data (dict): Output of utils.process_all_csv_files.
+    - l4_output_dir (str): Folder of the parsed CSV files (another model's folder when comparing models).
+    - seasons (list): Seasons to list (only these need to be in `weather_data`).
+
+    Returns:
+    - list: The work units in the same order as the sequential generation loop.
+    """
+    work_units = []
+
+    for country_data in family_types_json:
+        country = country_data['Country']
+
+        for family in country_data['Families']:
+            for season in seasons:
+                for day_pattern in PATTERNS:
+                    user_prompt = build_l4_user_prompt(country, family, season, day_pattern, weather_data)
+
+                    output_file = raw_profile_path(l4_output_dir, country, family['Family Type'], season, day_pattern)
+
+                    work_units.append(make_work_unit(("l4", country, family['Family Type'], season, day_pattern),
+                                                     system_prompt_l4, user_prompt, output_file,
+                                                     country=country, family_type=family['Family Type'],
+                                                     members=family['Members'], season=season, pattern=day_pattern))
+
+    return work_units
+
+
+def build_l4_packed_user_prompt(country, family, scenarios, weather_data):
+    """
+    Fills the packed Level 4 user prompt: several (season, pattern) scenarios of one family, with the
+    weather data of each season listed once.
+
+    Parameters:
+    - country (str): Country name.
+    - family (dict): Family entry of the Level 1 JSON ("Family Type" and "Members").
+    - scenarios (list): (season, pattern) pairs.
+    - weather_data (dict): Output of utils.process_all_csv_files.
+
+    Returns:
+    - str: The user prompt.
+    """
+    weather_blocks = ""
+    for season in dict.fromkeys(season for season, _ in scenarios):
+        season_weather = weather_data[country][season]
+
+        weather_block = user_prompt_l4_weather_block.replace("[$Season$]", season)
+        weather_block = weather_block.replace("[$Hour$]", str(season_weather["Hour"]))
+        weather_block = weather_block.replace("[$Temperature$]", str(season_weather["Temperature_Value"]))
+        weather_block = weather_block.replace("[$Humidity$]", str(season_weather["Humidity_Value"]))
+        weather_block = weather_block.replace("[$SolarRadiationDirect$]", str(season_weather["SolRad-Direct_Value"]))
+        weather_block = weather_block.replace("[$SolarRadiationDiffuse$]", str(season_weather["SolRad-Diffuse_Value"]))
+        weather_block = weather_block.replace("[$WindSpeed$]", str(season_weather["Wind-Speed_Value"]))
+        weather_blocks += weather_block
+
+    user_prompt_indexed = user_prompt_daily_l4_packed
+    user_prompt_indexed = user_prompt_indexed.replace("[$Country$]", country)
+    user_prompt_indexed = user_prompt_indexed.replace("[$Year$]", str(YEAR))
+    user_prompt_indexed = user_prompt_indexed.replace("[$Scenarios$]", ", ".join(f"[{season}|{day_pattern}]" for season, day_pattern in scenarios))
+    user_prompt_indexed = user_prompt_indexed.replace("[$FamilyType$]", family['Family Type'])
+    user_prompt_indexed = user_prompt_indexed.replace("[$Members$]", ", ".join(family['Members']))
+    user_prompt_indexed = user_prompt_indexed.replace("[$MembersNum$]", str(len(family['Members'])))
+    user_prompt_indexed = user_prompt_indexed.replace("[$WeatherBlocks$]", weather_blocks)
+
+    return user_prompt_indexed
+
+
+def pack_l4_work_units(work_units, weather_data, scenarios_per_request):
+    """
+    Packs the Level 4 work units of the same family into requests of up to `scenarios_per_request` scenarios,
+    so the system prompt and the family context are sent once per request instead of once per scenario.
+
+    A packed unit keeps the single-scenario units it answers under "units" (their output files are unchanged).
+    A family left with a single scenario is sent unpacked.
+
+    Parameters:
+    - work_units (list): Level 4 work units (output of l4_work_units, e.g. only the pending ones).
+    - weather_data (dict): Output of utils.process_all_csv_files.
+    - scenarios_per_request (int): Scenarios per request (1 disables packing).
+
+    Returns:
+    - list: Packed and single-scenario work units.
+    """
+    if scenarios_per_request <= 1:
+        return work_units
+
+    families = {}
+    for unit in work_units:
+        families.setdefault((unit["country"], unit["family_type"]), []).append(unit)
+
+    packed_units = []
+    for (country, family_type), family_units in families.items():
+        for i in range(0, len(family_units), scenarios_per_request):
+            chunk = family_units[i:i + scenarios_per_request]
+            if len(chunk) == 1:
+                packed_units.append(chunk[0])
+                continue
+
+            scenarios = [(unit["season"], unit["pattern"]) for unit in chunk]
+            family = {"Family Type": family_type, "Members": chunk[0]["members"]}
+            user_prompt = build_l4_packed_user_prompt(country, family, scenarios, weather_data)
+
+            key = ("l4", country, family_type, "+".join(f"{season}-{day_pattern}" for season, day_pattern in scenarios))
+            packed_units.append(make_work_unit(key, system_prompt_l4_packed, user_prompt, None,
+                                               country=country, family_type=family_type, members=chunk[0]["members"],
+                                               scenarios=scenarios, units=chunk))
+
+    return packed_units
+
+
+def l4_season_groups(seasons, scenarios_per_request):
+    """
+    Splits the seasons into the groups of one Level 4 task of the DAG scheduler: as many seasons as a packed request can
+    hold (all patterns of a season are answered together), so that packing works as in the level-by-level mode.
+
+    Returns:
+    - list: Lists of seasons, in order.
+    """
+    size = max(1, int(scenarios_per_request) // len(PATTERNS))
+    return [list(seasons[i:i + size]) for i in range(0, len(seasons), size)]
+
+
+def scenario_units(unit):
+    """
+    Returns the single-scenario work units answered by a (possibly packed) work unit.
+    """
+    return unit.get("units", [unit])
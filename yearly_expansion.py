@@ -0,0 +1,68 @@
+# Description: Expansion of the 24-hour templates (Level 4 family profiles, Level 3 weather) to a full calendar
+# (02C_expand_to_yearly_dataframes.ipynb). The calendar is indexed once per country: each timestamp gets the number of its
+# template slot, e.g. (season, pattern, hour). A template is then reduced to one row per slot, and the templates of all
+# families and members are expanded together with a single NumPy take of the slot table.
+import numpy as np
+import pandas as pd
+
+
+class TemplateIndex:
+    """
+    Slot index of a country calendar.
+
+    Parameters:
+    - master_df (pd.DataFrame): Country calendar (one row per timestamp).
+    - keys (list): Columns of the template slots (["season", "pattern", "hour"] or ["season", "hour"]).
+    """
+    def __init__(self, master_df, keys):
+        self.keys = list(keys)
+        missing = [key for key in self.keys if key not in master_df.columns]
+        if missing:
+            raise KeyError(f"Columns {missing} are missing in master_df.")
+        # Codes of each key column, combined into one integer per key tuple
+        codes, uniques = zip(*(pd.factorize(master_df[key]) for key in self.keys))
+        shape = tuple(len(values) for values in uniques)
+        combined = np.ravel_multi_index(codes, shape)
+
+        # slot_of_row[i] is the position of the key tuple of timestamp i in self.slots (distinct key tuples)
+        self.slot_of_row, slot_codes = pd.factorize(combined)
+        self.slot_of_row = self.slot_of_row.astype(np.intp)
+        self.slots = pd.MultiIndex.from_arrays(
+            [np.asarray(values)[key_codes] for values, key_codes in zip(uniques, np.unravel_index(slot_codes, shape))],
+            names=self.keys)
+
+    def positions(self, template_df):
+        """
+        Returns the template row of each slot (-1 if the template has no row for it; duplicated slots use their first row).
+        """
+        missing = [key for key in self.keys if key not in template_df.columns]
+        if missing:
+            raise KeyError(f"Columns {missing} are missing in the template.")
+        template_keys = pd.MultiIndex.from_frame(template_df[self.keys])
+        first_rows = np.flatnonzero(~template_keys.duplicated())
+        found = template_keys[first_rows].get_indexer(self.slots)
+        return np.where(found >= 0, first_rows[found], -1)
+
+    def expand(self, templates, value_columns):
+        """
+        Expands templates to the calendar: the value columns of every template are gathered into one slot table
+        (slots x all columns), then broadcast to the timestamps by a single take. Timestamps without a template row get NaN.
+
+        Parameters:
+        - templates (list): Template DataFrames.
+        - value_columns (list): Columns to expand, one list per template.
+
+        Returns:
+        - list: One DataFrame (value columns, one row per timestamp) per template.
+        """
+        widths = [len(columns) for columns in value_columns]
+        offsets = np.cumsum([0] + widths)
+        slot_table = np.full((len(self.slots), offsets[-1]), np.nan)
+        for template_df, columns, start, end in zip(templates, value_columns, offsets[:-1], offsets[1:]):
+            positions = self.positions(template_df)
+            found = positions >= 0
+            slot_table[found, start:end] = template_df[columns].to_numpy(dtype=float)[positions[found]]
+
+        values = slot_table.take(self.slot_of_row, axis=0)
+        return [pd.DataFrame(values[:, start:end], columns=columns)
+                for columns, start, end in zip(value_columns, offsets[:-1], offsets[1:])]